@@ -0,0 +1,206 @@
+""" Microbenchmarks for the robot's tick pipeline
+
+Steps a headless robot on a virtual clock through a set of standard
+scenarios with `Robot.step`, as headless runs step it, with telemetry
+recorded to a temporary directory. Every section that the robot's
+instrumentation times is reported: each system's update, snapshot
+publishing, the tick as a whole, event dispatch and telemetry, plus the
+whole step. Results are written as JSON and can be compared against a
+stored baseline:
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json --tolerance 0.15
+"""
+import hri
+import hri.telemetry
+import argparse
+import json
+import logging
+import platform
+import sys
+import tempfile
+import time
+
+
+class Scenario(object):
+    """ A reproducible arrangement of the simulated world """
+    name = None
+
+    def prepare(self, robot):
+        pass
+
+    def advance(self, robot, elapsed):
+        """ Changes the world before each tick """
+        pass
+
+
+class NoStimuliScenario(Scenario):
+    """ Nothing is visible to the robot """
+    name = 'no-stimuli'
+
+
+class FacePresentScenario(Scenario):
+    """ A single stationary face is visible to the robot """
+    name = 'face-present'
+
+    def prepare(self, robot):
+        robot.cozmo.world.faces.append(hri.simulation.SimulatedEntity(300, 0, 0, face_id=1))
+
+
+class ThreateningToyScenario(Scenario):
+    """ A toy is moving fast enough to trip the threatening-stimulus-releaser """
+    name = 'threatening-toy'
+
+    def __init__(self, speed=400):
+        self.speed = speed      # mm/s
+        self.x = 0
+
+    def prepare(self, robot):
+        self.toy = hri.simulation.SimulatedEntity(0, 0, 0, object_id=1)
+        robot.cozmo.world.objects.append(self.toy)
+
+    def advance(self, robot, elapsed):
+        self.x += self.speed * elapsed
+        self.toy.move_to(self.x, 0, 0)
+
+
+class DriveFlipScenario(Scenario):
+    """ The active drive flips between the solo-drive and social-drive every tick """
+    name = 'drive-flips'
+
+    def advance(self, robot, elapsed):
+        drive_system = robot.drive_system
+        other = drive_system.solo_drive if drive_system.active_drive is drive_system.social_drive else drive_system.social_drive
+
+        drive_system.active_drive.drive_level = 0
+        other.drive_level = 90
+
+
+SCENARIOS = [NoStimuliScenario, FacePresentScenario, ThreateningToyScenario, DriveFlipScenario]
+
+
+def percentile(sorted_samples, fraction):
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def summarize(samples):
+    """ Summarizes timing samples (in seconds) as microsecond statistics """
+    samples = sorted(samples)
+    return {
+        'mean_us': sum(samples) / len(samples) * 1e6,
+        'p50_us': percentile(samples, 0.50) * 1e6,
+        'p95_us': percentile(samples, 0.95) * 1e6,
+        'min_us': samples[0] * 1e6,
+        'max_us': samples[-1] * 1e6,
+    }
+
+
+def make_robot(recorders=()):
+    logger = logging.getLogger('benchmark')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    return hri.robot.Robot(logger, clock=hri.clock.VirtualClock(), recorders=recorders)
+
+
+def run_scenario(scenario, ticks, warmup, elapsed):
+    """ Runs one scenario and returns the timing summary of every instrumented section and the whole step """
+    with tempfile.TemporaryDirectory() as directory:
+        robot = make_robot([hri.telemetry.TelemetryRecorder(directory)])
+        scenario.prepare(robot)
+
+        instrumentation = robot.instrumentation
+        timer = instrumentation.timer
+        steps = []
+
+        for i in range(warmup + ticks):
+            # Only the ticks after the warmup are kept, all of them
+            if i == warmup:
+                instrumentation.window = ticks
+                instrumentation.histograms.clear()
+                steps.clear()
+
+            scenario.advance(robot, elapsed)
+
+            start = timer()
+            robot.step(elapsed)
+            steps.append(timer() - start)
+
+        robot.shutdown()
+
+    results = {name: summarize(hist.samples) for name, hist in instrumentation.histograms.items()}
+    results['step'] = summarize(steps)
+    return results
+
+
+def run(ticks=2000, warmup=200, elapsed=0.03, scenarios=None):
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'ticks': ticks,
+        'elapsed': elapsed,
+        'scenarios': {},
+    }
+
+    for scenario_class in SCENARIOS:
+        if scenarios and scenario_class.name not in scenarios:
+            continue
+
+        results['scenarios'][scenario_class.name] = run_scenario(scenario_class(), ticks, warmup, elapsed)
+
+    return results
+
+
+def compare(results, baseline, tolerance, metric='p50_us'):
+    """ Returns a list of (scenario, system, baseline, current) entries that regressed beyond the tolerance """
+    regressions = []
+
+    for scenario, systems in results['scenarios'].items():
+        for name, stats in systems.items():
+            try:
+                previous = baseline['scenarios'][scenario][name][metric]
+            except KeyError:
+                continue
+
+            if previous and stats[metric] > previous * (1 + tolerance):
+                regressions.append((scenario, name, previous, stats[metric]))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the robot tick pipeline')
+    parser.add_argument('--ticks', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--elapsed', type=float, default=0.03, help='simulated seconds per tick')
+    parser.add_argument('--scenario', action='append', dest='scenarios', help='only run the named scenario(s)')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    parser.add_argument('--baseline', help='compare against a stored JSON result')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed relative slowdown versus the baseline')
+    args = parser.parse_args(argv)
+
+    results = run(args.ticks, args.warmup, args.elapsed, args.scenarios)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.tolerance)
+        for scenario, name, previous, current in regressions:
+            print('REGRESSION {}/{}: {:.1f}us -> {:.1f}us'.format(scenario, name, previous, current), file=sys.stderr)
+
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
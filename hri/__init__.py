@@ -1,2 +1,4 @@
 from . import robot
-from . import drive
\ No newline at end of file
+from . import drive
+from . import clock
+from . import simulation
\ No newline at end of file
@@ -0,0 +1,166 @@
+from collections import namedtuple
+import threading
+import time
+
+Step = namedtuple('Step', ['name', 'start', 'wait'])
+Step.__doc__ = """ One step of an ActionSequence
+
+`start` is called with the sequence's owner and returns the SDK action or
+behavior it started. The sequence waits for an action to complete before
+the next step (`wait`), while a behavior is left running until the
+sequence is cancelled.
+"""
+
+def action(name, start):
+    """ A step that starts an SDK action and waits for it to complete """
+    return Step(name, start, True)
+
+def background(name, start):
+    """ A step that starts an SDK behavior, which runs until the sequence is cancelled """
+    return Step(name, start, False)
+
+
+class ActionSequence(object):
+    """ Runs steps one after another, either by chaining the actions' completion callbacks or as a coroutine
+
+    `cancel()` is the single cancellation point. Steps are only started
+    under the sequence's lock after checking that it hasn't been cancelled,
+    so no step can start once `cancel()` has returned, even when a completion
+    callback arrives on another thread at the same time. Cancelling aborts
+    the running action and stops the background behaviors; the sequence
+    counts as stopped once the aborted action reports its completion, and
+    the time from `cancel()` until then is passed to `on_stopped`.
+    """
+
+    def __init__(self, owner, steps, repeat=False, timer=time.perf_counter, on_stopped=None, on_step_started=None, logger=None):
+        self.owner = owner
+        self.steps = steps
+        self.repeat = repeat
+        self.timer = timer
+        self.on_stopped = on_stopped
+        self.on_step_started = on_step_started
+        self.logger = logger
+
+        self.lock = threading.Lock()
+        self.index = 0
+        self.current = None
+        self.background = []
+
+        self.finished = False
+        self.cancelled = False
+        self.cancelled_at = None
+        self.stopped = False
+        self.preemption_latency = None
+
+    def _start_next(self, chain=False):
+        """ Starts the next step unless the sequence is over, returning (step, started) or None
+
+        With `chain`, the completion callback is registered before the lock
+        is released, so a concurrent `cancel()` always sees it called.
+        """
+        started = self._start_locked(chain)
+
+        if started and self.on_step_started:
+            self.on_step_started(self, started[0])
+
+        return started
+
+    def _start_locked(self, chain):
+        with self.lock:
+            if self.cancelled or self.finished:
+                return None
+
+            if self.index == len(self.steps):
+                if not self.repeat or not self.steps:
+                    self.finished = True
+                    return None
+                self.index = 0
+
+            step = self.steps[self.index]
+            self.index += 1
+
+            try:
+                started = step.start(self.owner)
+            except Exception as e:
+                self.finished = True
+                if self.logger:
+                    self.logger.error('Step {} of {} failed to start: {!r}'.format(step.name, getattr(self.owner, 'name', self.owner), e))
+                return None
+
+            if step.wait:
+                self.current = started
+                if chain:
+                    started.on_completed(self._completed)
+            else:
+                self.background.append(started)
+
+            return step, started
+
+    def start(self):
+        """ Starts the first step; each completed action then starts the next """
+        while True:
+            started = self._start_next(chain=True)
+            if started is None or started[0].wait:
+                return
+
+    def _completed(self, evt=None, **kwargs):
+        with self.lock:
+            self.current = None
+            cancelled = self.cancelled
+
+        if cancelled:
+            self._stop()
+        else:
+            self.start()
+
+    async def run(self):
+        """ Runs the steps on the running event loop, awaiting each action """
+        while True:
+            started = self._start_next()
+            if started is None:
+                return
+
+            step, running = started
+            if not step.wait:
+                continue
+
+            try:
+                await running.wait_for_completed()
+            finally:
+                with self.lock:
+                    self.current = None
+                    cancelled = self.cancelled
+
+                if cancelled:
+                    self._stop()
+
+    def cancel(self):
+        """ Stops the sequence: no further step starts, the running action is aborted and background behaviors stopped """
+        with self.lock:
+            if self.cancelled:
+                return
+
+            self.cancelled = True
+            self.cancelled_at = self.timer()
+            current = self.current
+            background, self.background = self.background, []
+
+        for behavior in background:
+            if getattr(behavior, 'is_active', True):
+                behavior.stop()
+
+        if current is not None and current.is_running:
+            # The sequence stops once the action reports that it was aborted
+            current.abort()
+        else:
+            self._stop()
+
+    def _stop(self):
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+            self.preemption_latency = self.timer() - self.cancelled_at
+
+        if self.on_stopped:
+            self.on_stopped(self, self.preemption_latency)
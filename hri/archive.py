@@ -0,0 +1,184 @@
+from collections import namedtuple
+import io
+import mmap
+import os
+import struct
+import threading
+import time
+
+# frame number, timestamp, segment number, offset, length
+INDEX_RECORD = struct.Struct('<QdIQI')
+INDEX_FILENAME = 'index.bin'
+SEGMENT_FILENAME = 'segment-{:05d}.bin'
+
+Frame = namedtuple('Frame', ['number', 'timestamp', 'segment', 'offset', 'length'])
+
+
+class FrameArchiveWriter(object):
+    """ Appends encoded frames to large segment files, with a compact fixed-size index record per frame
+
+    The archive directory and files are created with the first appended frame,
+    and reopening an existing archive continues after its last frame. The
+    files are flushed at least every `flush_interval` seconds (the segment
+    before the index), so a reader refreshing a live archive sees its frames.
+    """
+
+    def __init__(self, directory, segment_size=256 * 1024 * 1024, flush_interval=1.0, timer=time.monotonic):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.flush_interval = flush_interval
+        self.timer = timer
+        self.lock = threading.Lock()
+        self.last_flush = None
+
+        self.index_file = None
+        self.segment_file = None
+        self.segment_number = 0
+        self.segment_offset = 0
+        self.frame_count = 0
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+        index_path = os.path.join(self.directory, INDEX_FILENAME)
+        if os.path.exists(index_path):
+            size = os.path.getsize(index_path)
+            self.frame_count = size // INDEX_RECORD.size
+
+            # Drop a partially written trailing record
+            if size % INDEX_RECORD.size:
+                with open(index_path, 'r+b') as f:
+                    f.truncate(self.frame_count * INDEX_RECORD.size)
+
+            if self.frame_count:
+                with open(index_path, 'rb') as f:
+                    f.seek((self.frame_count - 1) * INDEX_RECORD.size)
+                    last = Frame(*INDEX_RECORD.unpack(f.read(INDEX_RECORD.size)))
+                self.segment_number = last.segment
+                self.segment_offset = last.offset + last.length
+
+        self.index_file = open(index_path, 'ab')
+        self._open_segment()
+        self.last_flush = self.timer()
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, SEGMENT_FILENAME.format(self.segment_number))
+        self.segment_file = open(path, 'r+b' if os.path.exists(path) else 'wb')
+
+        # Anything past the last indexed frame was never committed
+        self.segment_file.truncate(self.segment_offset)
+        self.segment_file.seek(self.segment_offset)
+
+    def append(self, data, timestamp, number=None):
+        """ Appends an encoded frame and returns its frame number (the next in sequence unless given) """
+        with self.lock:
+            if self.index_file is None:
+                self._open()
+
+            if self.segment_offset and self.segment_offset + len(data) > self.segment_size:
+                self.segment_file.close()
+                self.segment_number += 1
+                self.segment_offset = 0
+                self._open_segment()
+
+            if number is None:
+                number = self.frame_count
+
+            self.segment_file.write(data)
+            self.index_file.write(INDEX_RECORD.pack(number, timestamp, self.segment_number, self.segment_offset, len(data)))
+
+            self.segment_offset += len(data)
+            self.frame_count += 1
+
+            if self.timer() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+            return number
+
+    def write(self, data, number, timestamp):
+        """ Sink interface for the ImageWriter """
+        self.append(data, timestamp, number)
+
+    def flush(self):
+        with self.lock:
+            if self.index_file is not None:
+                self._flush()
+
+    def _flush(self):
+        # The frames' data is flushed before the index records that point to it
+        self.segment_file.flush()
+        self.index_file.flush()
+        self.last_flush = self.timer()
+
+    def close(self):
+        with self.lock:
+            if self.index_file is not None:
+                self.segment_file.close()
+                self.index_file.close()
+                self.segment_file = None
+                self.index_file = None
+
+
+class FrameArchiveReader(object):
+    """ Random and sequential access to an archive's frames through memory-mapped segments """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = {}
+        self.frames = []
+        self.refresh()
+
+    def refresh(self):
+        """ Re-reads the index to pick up frames appended since the archive was opened """
+        with open(os.path.join(self.directory, INDEX_FILENAME), 'rb') as f:
+            data = f.read()
+
+        usable = len(data) - len(data) % INDEX_RECORD.size
+        self.frames = [Frame(*record) for record in INDEX_RECORD.iter_unpack(data[:usable])]
+
+        # Segments that grew need to be mapped again
+        for segment in list(self.segments):
+            self.segments.pop(segment).close()
+
+    def _segment(self, number):
+        segment = self.segments.get(number)
+
+        if segment is None:
+            with open(os.path.join(self.directory, SEGMENT_FILENAME.format(number)), 'rb') as f:
+                # An empty file can't be mapped; it only holds empty frames until it grows
+                if os.fstat(f.fileno()).st_size == 0:
+                    return b''
+
+                segment = self.segments[number] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return segment
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, i):
+        """ Returns the encoded bytes of the i-th appended frame (see `frames[i].number` for its frame number) """
+        frame = self.frames[i]
+        return self._segment(frame.segment)[frame.offset:frame.offset + frame.length]
+
+    def __iter__(self):
+        for i in range(len(self.frames)):
+            yield self.frames[i], self[i]
+
+    def image(self, i):
+        """ Decodes the i-th frame into a PIL image """
+        from PIL import Image
+        return Image.open(io.BytesIO(self[i]))
+
+    def export_jpegs(self, directory, run_id):
+        """ Writes every frame as its own file using the robot's `image{run_id}_{number}.jpg` layout """
+        os.makedirs(directory, exist_ok=True)
+
+        for frame, data in self:
+            with open(os.path.join(directory, 'image{}_{}.jpg'.format(run_id, frame.number)), 'wb') as f:
+                f.write(data)
+
+    def close(self):
+        for segment in self.segments.values():
+            segment.close()
+        self.segments.clear()
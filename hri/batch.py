@@ -0,0 +1,380 @@
+from . import clock
+from . import emotion
+from . import robot as hrirobot
+from .perception import poses
+from .perception import stimulus
+
+import logging
+import numpy as np
+
+# The modelled stimuli: a single face and a single toy
+STIMULUS_CLASSES = (stimulus.FaceStimulus, stimulus.ToyStimulus)
+
+# Speed above which each stimulus type is threatening
+THREATENING_SPEED = {cls.type: cls.threatening_speed for cls in STIMULUS_CLASSES}
+
+
+NONE = -1
+
+
+class BatchEngine(object):
+    """ Steps N independent copies of the drive, releaser, emotion and behavior model at once
+
+    State and tuning constants are NumPy arrays with one row per instance,
+    copied from a template robot (a freshly constructed one by default). Every
+    row therefore starts out identical to the object model, and the constants
+    can be perturbed per row for Monte Carlo studies. Only one face and one
+    toy are modelled; given the same visible face and toy positions, each row produces exactly the same drive levels,
+    releaser, emotion and behavior state as `Robot.step`. SDK actions are not
+    modelled. Affect components and speeds that are None in the object model
+    are NaN here, and the active drive, emotion and behavior are indices
+    into the name lists (-1 for none).
+    """
+
+    def __init__(self, n, robot=None):
+        if robot is None:
+            robot = hrirobot.Robot(logging.getLogger('batch'), clock=clock.VirtualClock())
+
+        self.n = n
+        self.rows = np.arange(n)
+        self.time = robot.clock.now()
+
+        self._init_drives(robot.drive_system)
+        self._init_stimuli(robot.perception_system)
+        self._init_releasers(robot.perception_system)
+        self._init_emotions(robot.emotion_system)
+        self._init_behaviors(robot.behavior_system)
+
+    def _rows(self, values, dtype=float):
+        """ Repeats the per-instance values for every row """
+        values = np.array(values, dtype=dtype)
+        return np.broadcast_to(values, (self.n,) + values.shape).copy()
+
+    def _init_drives(self, drive_system):
+        drives = drive_system.drives
+        self.drive_names = [drive.name for drive in drives]
+        self.REST_DRIVE = self.drive_names.index('rest-drive')
+        self.SOLO_DRIVE = self.drive_names.index('solo-drive')
+        self.SOCIAL_DRIVE = self.drive_names.index('social-drive')
+
+        self.drive_level = self._rows([drive.drive_level for drive in drives])
+        self.drive_max = self._rows([drive.drive_max for drive in drives])
+        self.drive_rate = self._rows([0.5] * len(drives))
+        self.range_overwhelmed = self._rows([drive.range_overwhelmed for drive in drives])
+        self.range_underwhelmed = self._rows([drive.range_underwhelmed for drive in drives])
+        self.range_homeostatic = self._rows([drive.range_homeostatic for drive in drives])
+
+        self.active_drive = self._rows(drives.index(drive_system.active_drive), int)
+        self.drive_changes = np.zeros(self.n, int)
+
+    def _init_stimuli(self, perception_system):
+        # The first stimulus of each type, or a fresh one if the robot hasn't perceived that type yet
+        stimuli = []
+        for stimulus_class in STIMULUS_CLASSES:
+            known = perception_system.stimuli_by_type.get(stimulus_class.type)
+            stimuli.append(next(iter(known.values())) if known else stimulus_class(perception_system, None))
+
+        self.stimulus_types = [stim.type for stim in stimuli]
+        self.FACE = self.stimulus_types.index('face-stimulus')
+        self.TOY = self.stimulus_types.index('toy-stimulus')
+
+        vision = perception_system.vision
+        timeouts = {'face-stimulus': vision.face_disappearance_timeout, 'toy-stimulus': vision.toy_disappearance_timeout}
+
+        self.detected = self._rows([stim.detected for stim in stimuli], bool)
+        self.detection_duration = self._rows([stim.detection_duration for stim in stimuli])
+        self.disappearance_duration = self._rows([stim.disappearance_duration for stim in stimuli])
+        self.average_speed = self._rows([np.nan if stim.average_speed is None else stim.average_speed for stim in stimuli])
+        self.disappearance_timeout_limit = self._rows([timeouts[stim.type] for stim in stimuli])
+        self.disappearance_timeout = self._rows([vision.disappearance_timeouts.get(stim.id, timeouts[stim.type]) for stim in stimuli])
+        self.threatening_speed = self._rows([THREATENING_SPEED[stim.type] for stim in stimuli])
+
+        # Mirror the pose store, with a slot per row and stimulus holding a copy of the template stimulus's poses
+        store = perception_system.pose_store
+        self.uptime = perception_system.uptime
+        self.pose_store = poses.PoseStore(store.capacity, self.n * len(stimuli), store.min_samples, store.estimator, store.time_constant)
+        self.pose_slots = np.arange(self.n * len(stimuli)).reshape(self.n, len(stimuli))
+
+        for i, stim in enumerate(stimuli):
+            for name in ('positions', 'times', 'heads', 'counts', 'segments', 'path_lengths', 'evictions', 'smoothed_speeds'):
+                getattr(self.pose_store, name)[self.pose_slots[:, i]] = getattr(store, name)[stim.pose_slot]
+
+    def _init_releasers(self, perception_system):
+        releasers = perception_system.releasers
+        self.releaser_names = [rel.name for rel in releasers]
+        self.ABSENCE = self.releaser_names.index('absence-of-desired-stimulus-releaser')
+        self.DESIRED = self.releaser_names.index('desired-stimulus-releaser')
+        self.UNDESIRED = self.releaser_names.index('undesired-stimulus-releaser')
+        self.THREATENING = self.releaser_names.index('threatening-stimulus-releaser')
+        self.UNDERWHELMED = self.releaser_names.index('underwhelmed-drive-releaser')
+        self.OVERWHELMED = self.releaser_names.index('overwhelmed-drive-releaser')
+
+        self.releaser_activation = self._rows([rel.activation_level for rel in releasers])
+        self.releaser_threshold = self._rows([rel.activation_threshold for rel in releasers])
+        self.releaser_active_duration = self._rows([rel.active_duration for rel in releasers])
+        self.releaser_affect = self._rows([rel.affect or (np.nan,) * 3 for rel in releasers])
+        self.releaser_affect_base = self._rows([rel.affect_base for rel in releasers])
+        self.releaser_affect_growth = self._rows([rel.affect_growth for rel in releasers])
+
+    def _init_emotions(self, emotion_system):
+        emotions = emotion_system.emotions
+        self.emotion_names = [em.name for em in emotions]
+        self.JOY = self.emotion_names.index('joy-emotion')
+        self.SORROW = self.emotion_names.index('sorrow-emotion')
+        self.FEAR = self.emotion_names.index('fear-emotion')
+
+        self.net_affect = self._rows([[np.nan if v is None else v for v in em.net_affect] for em in emotions])
+        self.elicitation_level = self._rows([em.elicitation_level for em in emotions])
+        self.emotion_activation = self._rows([em.activation_level for em in emotions])
+        self.activation_bias = self._rows([em.activation_bias for em in emotions])
+        self.activation_persistence = self._rows([em.activation_persistence for em in emotions])
+        self.activation_decay = self._rows([em.activation_decay for em in emotions])
+        self.default_activation_bias = self._rows([em.default_activation_bias for em in emotions])
+        self.default_activation_persistence = self._rows([em.default_activation_persistence for em in emotions])
+        self.activation_max = self._rows([em.activation_max for em in emotions])
+        self.threshold_expression = self._rows([em.threshold_expression for em in emotions])
+        self.elicitation_divisor = self._rows([em.elicitation_divisor for em in emotions])
+
+        self.filter_above = np.array([[above for above, _ in em.affect_filter] for em in emotions])
+        self.filter_threshold = self._rows([[threshold for _, threshold in em.affect_filter] for em in emotions])
+        self.elicited_by = [self.releaser_names.index(em.elicited_by) if em.elicited_by else NONE for em in emotions]
+
+        self.active_emotion = self._rows(emotions.index(emotion_system.active_emotion) if emotion_system.active_emotion else NONE, int)
+        self.emotion_changes = np.zeros(self.n, int)
+
+    def _init_behaviors(self, behavior_system):
+        behaviors = behavior_system.behaviors
+        self.behavior_names = [beh.name for beh in behaviors]
+        self.SEARCH = self.behavior_names.index('search-for-stimulus-behavior')
+        self.REJECT = self.behavior_names.index('reject-stimulus-behavior')
+        self.ESCAPE = self.behavior_names.index('escape-stimulus-behavior')
+        self.PLAY = self.behavior_names.index('play-with-toy-behavior')
+        self.ENGAGE = self.behavior_names.index('engage-with-face-behavior')
+        self.REST_BEHAVIOR = self.behavior_names.index('rest-behavior')
+
+        self.behavior_activation = self._rows([beh.activation_level for beh in behaviors])
+        self.behavior_threshold = self._rows([beh.activation_threshold for beh in behaviors])
+        self.behavior_rate = self._rows([beh.activation_rate for beh in behaviors])
+        self.activation_duration = self._rows([beh.activation_duration for beh in behaviors])
+        self.last_activated = self._rows([np.nan if beh.last_activated is None else beh.last_activated for beh in behaviors])
+
+        self.active_behavior = self._rows(behaviors.index(behavior_system.active_behavior) if behavior_system.active_behavior else NONE, int)
+        self.behavior_changes = np.zeros(self.n, int)
+
+    def step(self, elapsed, face_position=None, toy_position=None):
+        """ Advances every instance by `elapsed` seconds
+
+        `face_position` and `toy_position` are (n, 3) arrays of the visible
+        face/toy position per instance, with NaN rows (or None for all rows)
+        where nothing is visible.
+        """
+        self.time += elapsed
+
+        positions = np.full((self.n, len(self.stimulus_types), 3), np.nan)
+        if face_position is not None:
+            positions[:, self.FACE] = face_position
+        if toy_position is not None:
+            positions[:, self.TOY] = toy_position
+
+        self.update_drives(elapsed)
+        self.update_perception(elapsed, positions)
+        self.update_emotions(elapsed)
+        self.update_behaviors(elapsed)
+
+    def releaser_is_active(self, i):
+        return self.releaser_activation[:, i] >= self.releaser_threshold[:, i]
+
+    def _in_range(self, level, ranges):
+        return (ranges[..., 0] <= level) & (level <= ranges[..., 1])
+
+    def update_drives(self, elapsed):
+        """ Mirrors DriveSystem.update """
+        step = self.drive_rate * elapsed
+
+        # The solo and social drives are satisfied while active and the desired stimulus is present
+        decrease = np.zeros(self.drive_level.shape, bool)
+        desired = self.releaser_is_active(self.DESIRED)
+        for d in (self.SOLO_DRIVE, self.SOCIAL_DRIVE):
+            decrease[:, d] = desired & (self.active_drive == d)
+
+        level = np.minimum(self.drive_max, np.where(decrease, self.drive_level - step, self.drive_level + step))
+        self.drive_level = level
+
+        homeostatic = self._in_range(level, self.range_homeostatic)
+
+        # Ignore an overwhelmed rest-drive
+        intensity = np.abs(level)
+        rest_overwhelmed = self._in_range(level[:, self.REST_DRIVE], self.range_overwhelmed[:, self.REST_DRIVE])
+        intensity[:, self.REST_DRIVE] = np.where(rest_overwhelmed, 0, intensity[:, self.REST_DRIVE])
+        most_intense = np.argmax(intensity, axis=1)
+
+        switch = homeostatic[self.rows, self.active_drive] & ~homeostatic[self.rows, most_intense] & (most_intense != self.active_drive)
+        self.active_drive = np.where(switch, most_intense, self.active_drive)
+        self.drive_changes += switch
+
+    def update_perception(self, elapsed, positions):
+        """ Mirrors PerceptionSystem.update: stimulus timing, then releasers, then vision """
+        rows = self.rows
+        self.uptime += elapsed
+
+        self.detection_duration = np.where(self.detected, self.detection_duration + elapsed, self.detection_duration)
+        self.disappearance_duration = np.where(self.detected, self.disappearance_duration, self.disappearance_duration + elapsed)
+
+        activation = self.releaser_activation.copy()
+        threshold = self.releaser_threshold
+
+        # The stimulus releasers don't operate on the rest-drive
+        frozen = self.active_drive == self.REST_DRIVE
+        desired = np.where(self.active_drive == self.SOLO_DRIVE, self.TOY, self.FACE)
+        desired_detected = self.detected[rows, desired]
+
+        absence = np.where(desired_detected, 0, threshold[:, self.ABSENCE] + 5 * self.disappearance_duration[rows, desired])
+        activation[:, self.ABSENCE] = np.where(frozen, activation[:, self.ABSENCE], absence)
+
+        present = np.where(desired_detected, threshold[:, self.DESIRED] + 5 * self.detection_duration[rows, desired], 0)
+        activation[:, self.DESIRED] = np.where(frozen, activation[:, self.DESIRED], present)
+
+        first_detected = np.argmax(self.detected, axis=1)
+        other = ~desired_detected & self.detected.any(axis=1)
+        undesired = np.where(other, threshold[:, self.UNDESIRED] + 5 * self.detection_duration[rows, first_detected], 0)
+        activation[:, self.UNDESIRED] = np.where(frozen, activation[:, self.UNDESIRED], undesired)
+
+        threatening = (self.detected & (np.nan_to_num(self.average_speed) > self.threatening_speed)).any(axis=1)
+        current = activation[:, self.THREATENING]
+        mult = np.where(current < 100, 40, np.where(current < 130, 20, 5))
+        activation[:, self.THREATENING] = np.where(threatening, current + mult * elapsed, np.maximum(0, current - 40 * elapsed))
+
+        level = self.drive_level[rows, self.active_drive]
+
+        under = self.range_underwhelmed[rows, self.active_drive]
+        is_under = (under[:, 0] <= level) & (level <= under[:, 1])
+        activation[:, self.UNDERWHELMED] = np.where(is_under, threshold[:, self.UNDERWHELMED] + ((level - under[:, 0]) / (under[:, 1] - under[:, 0])) * 10, 0)
+
+        over = self.range_overwhelmed[rows, self.active_drive]
+        is_over = (over[:, 0] <= level) & (level <= over[:, 1])
+        activation[:, self.OVERWHELMED] = np.where(is_over, threshold[:, self.OVERWHELMED] + ((over[:, 1] - level) / (over[:, 1] - over[:, 0])) * 10, 0)
+
+        # Affect is only present while a releaser is active, except where the releaser didn't run
+        unchanged = np.zeros(activation.shape, bool)
+        unchanged[:, [self.ABSENCE, self.DESIRED, self.UNDESIRED]] = frozen[:, None]
+
+        active = activation >= threshold
+        active_duration = np.where(active, self.releaser_active_duration + 0, 0)
+        growth = (active_duration * self.releaser_affect_growth)[:, :, None]
+        base = self.releaser_affect_base
+        affect = np.where(active[:, :, None], np.where(base < 0, base - growth, base + growth), np.nan)
+
+        self.releaser_activation = activation
+        self.releaser_active_duration = np.where(unchanged, self.releaser_active_duration, active_duration)
+        self.releaser_affect = np.where(unchanged[:, :, None], self.releaser_affect, affect)
+
+        self.update_vision(elapsed, positions)
+
+    def update_vision(self, elapsed, positions):
+        """ Mirrors Vision.update and Stimulus.detect/disappear """
+        visible = ~np.isnan(positions).any(axis=2)
+
+        self.disappearance_timeout = np.where(visible, self.disappearance_timeout_limit, self.disappearance_timeout - elapsed)
+
+        self.pose_store.append_many(self.pose_slots[visible], positions[visible], self.uptime)
+
+        newly_detected = visible & ~self.detected
+        self.detection_duration = np.where(newly_detected, 0, self.detection_duration)
+
+        disappeared = ~visible & (self.disappearance_timeout <= 0) & self.detected
+        self.disappearance_duration = np.where(disappeared, 0, self.disappearance_duration)
+        self.pose_store.clear(self.pose_slots[disappeared])
+
+        self.detected = (self.detected | visible) & ~disappeared
+
+        speeds = self.pose_store.speeds(self.pose_slots.ravel()).reshape(self.detected.shape)
+        self.average_speed = np.where(self.detected, speeds, np.nan)
+
+    def update_emotions(self, elapsed):
+        """ Mirrors EmotionSystem.update """
+        active = self.releaser_activation >= self.releaser_threshold
+        affect = self.releaser_affect
+        clamped = np.clip(affect, -emotion.AFFECT_LIMIT, emotion.AFFECT_LIMIT)
+
+        for k in range(len(self.emotion_names)):
+            threshold = self.filter_threshold[:, k]
+            sums = np.zeros((self.n, 3))
+            counts = np.zeros((self.n, 3), int)
+
+            # Accumulate in releaser order so the sums match the object model exactly
+            for r in range(len(self.releaser_names)):
+                with np.errstate(invalid='ignore'):
+                    passes = np.where(self.filter_above[k], affect[:, r] > threshold, affect[:, r] < threshold)
+                used = passes & active[:, r, None] & (clamped[:, r] != 0)
+                sums += np.where(used, clamped[:, r], 0)
+                counts += used
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.net_affect[:, k] = np.where(counts > 0, sums / counts, 0)
+
+        magnitude = ((np.abs(self.net_affect[:, :, 0]) + np.abs(self.net_affect[:, :, 1])) + np.abs(self.net_affect[:, :, 2]))
+        self.elicitation_level = magnitude / self.elicitation_divisor
+
+        # Emotions that need a releaser are only elicited while it is active
+        for k, r in enumerate(self.elicited_by):
+            if r != NONE:
+                self.net_affect[:, k] = np.where(active[:, r, None], self.net_affect[:, k], np.nan)
+                self.elicitation_level[:, k] = np.where(active[:, r], self.elicitation_level[:, k], 0)
+
+        activation = self.emotion_activation
+        missing = ((self.net_affect == 0) | np.isnan(self.net_affect)).any(axis=2)
+        decayed = np.where(activation >= self.threshold_expression, activation - self.activation_decay, 0)
+        elicited = np.maximum(0, np.minimum(np.abs(self.elicitation_level) + self.activation_bias + self.activation_persistence - self.activation_decay, self.activation_max))
+        activation = np.where(missing, decayed, elicited)
+        self.emotion_activation = activation
+
+        expressed = activation > self.threshold_expression
+        self.activation_decay = np.where(expressed, self.activation_decay + elapsed / 10, 0)
+        self.activation_bias = np.where(expressed, self.activation_bias, self.default_activation_bias)
+        self.activation_persistence = np.where(expressed, self.activation_persistence, self.default_activation_persistence)
+
+        new_active = np.argmax(activation, axis=1)
+        causes_expression = activation[self.rows, new_active] >= self.threshold_expression[self.rows, new_active]
+        new_active = np.where(causes_expression, new_active, NONE)
+
+        self.emotion_changes += new_active != self.active_emotion
+        self.active_emotion = new_active
+
+    def update_behaviors(self, elapsed):
+        """ Mirrors BehaviorSystem.update """
+        emotion = self.active_emotion
+        drive = self.active_drive
+        desired = self.releaser_is_active(self.DESIRED)
+        joy = emotion == self.JOY
+
+        conditions = np.zeros(self.behavior_activation.shape, bool)
+        conditions[:, self.SEARCH] = self.releaser_is_active(self.ABSENCE) & (emotion == self.SORROW)
+        conditions[:, self.REJECT] = self.releaser_is_active(self.UNDESIRED) & (emotion == self.SORROW)
+        conditions[:, self.ESCAPE] = self.releaser_is_active(self.THREATENING) & (emotion == self.FEAR)
+        conditions[:, self.PLAY] = desired & (drive == self.SOLO_DRIVE) & joy
+        conditions[:, self.ENGAGE] = desired & (drive == self.SOCIAL_DRIVE) & joy
+        conditions[:, self.REST_BEHAVIOR] = drive == self.REST_DRIVE
+
+        delta = self.behavior_rate * elapsed
+        level = self.behavior_activation
+        decayed = np.maximum(0, level - delta)
+        decayed[:, self.SEARCH] = 0     # The search behavior resets instead of decaying
+        level = np.where(conditions, level + delta, decayed)
+        self.behavior_activation = level
+
+        is_active = np.zeros(level.shape, bool)
+        has_active = self.active_behavior != NONE
+        is_active[self.rows[has_active], self.active_behavior[has_active]] = True
+        self.activation_duration = np.where(is_active, self.activation_duration + elapsed, self.activation_duration)
+
+        new_active = np.argmax(level, axis=1)
+        over_threshold = level[self.rows, new_active] >= self.behavior_threshold[self.rows, new_active]
+        new_active = np.where(over_threshold, new_active, NONE)
+
+        changed = new_active != self.active_behavior
+        activated = changed & (new_active != NONE)
+        self.last_activated[self.rows[activated], new_active[activated]] = self.time
+        self.activation_duration[self.rows[activated], new_active[activated]] = 0
+
+        self.behavior_changes += changed
+        self.active_behavior = new_active
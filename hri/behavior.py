@@ -1,13 +1,20 @@
 from . import system
+from . import incremental
+from . import actions
+from . import instrumentation
 
 import operator
 import random
-import cozmo as cozmosdk
-from timeit import default_timer as timeit
 
-class Behavior(object):
+class Behavior(incremental.Incremental):
     """ Represents a behavior that the robot should enact """
     name = None
+    reads = ()
+    activation_rate = 10
+
+    # Steps (see actions.action and actions.background) enacted while the behavior is active
+    steps = ()
+    repeat_steps = False
 
     def __init__(self, behavior_system):
         self.behavior_system = behavior_system
@@ -18,11 +25,53 @@ class Behavior(object):
         self.last_activated = None
         self.activation_duration = 0
 
+        # The steps run while the behavior is active, started anew on every activation
+        self.sequence = None
+
     def activate(self):
-        pass
+        """ Starts the behavior's steps, each one started by the completion of the previous action """
+        if self.steps:
+            self.new_sequence().start()
+
+    def perform(self):
+        """ Returns a coroutine that enacts the behavior as a task on the robot's event loop
+
+        The sequence is created right away rather than once the task first runs,
+        so deactivating the behavior before then cancels it before its first step.
+        """
+        if self.steps:
+            return self.new_sequence().run()
+        return self.activate_if_active()
+
+    async def activate_if_active(self):
+        if self.is_active:
+            self.activate()
+
+    def new_sequence(self):
+        self.robot = self.behavior_system.robot
+        self.cozmo = self.robot.cozmo
+        self.sdk = self.robot.sdk
+
+        self.sequence = actions.ActionSequence(self, self.steps, repeat=self.repeat_steps, timer=self.robot.instrumentation.timer,
+            on_stopped=self.behavior_system.on_sequence_stopped, on_step_started=self.behavior_system.on_step_started, logger=self.robot.logger)
+        return self.sequence
 
     def deactivate(self):
-        pass
+        """ Cancels the behavior's steps """
+        if self.sequence:
+            self.sequence.cancel()
+            self.sequence = None
+
+    def is_released(self):
+        """ Returns whether the emotions, drives, and releasers that raise the activation level are active """
+        raise NotImplementedError()
+
+    def input_key(self):
+        # While released the activation level keeps rising, otherwise it decays to a resting value
+        return None if self.is_released() else ()
+
+    def state_key(self):
+        return self.activation_level
 
     def update(self, elapsed):
         """ Updates activation level based on emotions, drives, and releasers """
@@ -33,6 +82,8 @@ class SearchForStimulusBehavior(Behavior):
     """ Behavior that tries to search for stimuli if the absence-of-desired-stimulus-releaser
         is active (looking for a toy with the solo-drive or a face with the social-drive) """
     name = 'search-for-stimulus-behavior'
+    reads = ('absence-of-desired-stimulus-releaser', 'sorrow-emotion')
+    activation_rate = 10
 
     def __init__(self, behavior_system):
         super().__init__(behavior_system)
@@ -43,28 +94,37 @@ class SearchForStimulusBehavior(Behavior):
         """ Determine the type of stimulus that should be looked for """
         self.robot = self.behavior_system.robot
         self.cozmo = self.robot.cozmo
+        self.sdk = self.robot.sdk
 
         active_drive = self.robot.drive_system.active_drive
+        self.search_behavior = None
 
         if active_drive.name == 'solo-drive':
             # Look for a toy/block
-            self.search_behavior = self.cozmo.start_behavior(cozmosdk.behavior.BehaviorTypes.LookAroundInPlace)
+            self.search_behavior = self.cozmo.start_behavior(self.sdk.behavior.BehaviorTypes.LookAroundInPlace)
         elif active_drive.name == 'social-drive':
             # Look for a face
-            self.search_behavior = self.cozmo.start_behavior(cozmosdk.behavior.BehaviorTypes.FindFaces)
+            self.search_behavior = self.cozmo.start_behavior(self.sdk.behavior.BehaviorTypes.FindFaces)
+
+        if self.search_behavior:
+            self.behavior_system.action_started(self, 'search')
 
     def deactivate(self):
         """ Deactivate the search behavior if it's active """
         if self.search_behavior:
             self.search_behavior.stop()
 
-    def update(self, elapsed):
+    def is_released(self):
         """ Activates if the absence-of-desired-stimulus-releaser is active """
-        delta = 10 * elapsed
         rel = self.behavior_system.robot.perception_system.get_releaser('absence-of-desired-stimulus-releaser')
         sorrow = self.behavior_system.robot.emotion_system.emotion_sorrow
 
-        if rel.is_active() and self.behavior_system.robot.emotion_system.active_emotion == sorrow:
+        return rel.is_active() and self.behavior_system.robot.emotion_system.active_emotion == sorrow
+
+    def update(self, elapsed):
+        delta = self.activation_rate * elapsed
+
+        if self.is_released():
             self.activation_level = self.activation_level + delta
         else:
             self.activation_level = 0
@@ -73,56 +133,27 @@ class SearchForStimulusBehavior(Behavior):
 class RejectStimulusBehavior(Behavior):
     """ Behavior that tries to avoid a stimulus that it has been shown """
     name = 'reject-stimulus-behavior'
+    reads = ('undesired-stimulus-releaser', 'sorrow-emotion')
+    activation_rate = 18
 
-    def __init__(self, behavior_system):
-        super().__init__(behavior_system)
-
-        self.angry_anim = None
-        self.neutral_anim = None
-        self.look_action = None
-
-    def activate(self):
-        """ Show an upset expression """
-        self.robot = self.behavior_system.robot
-        self.cozmo = self.robot.cozmo
+    # Show an upset expression, then a neutral one, then look up
+    steps = (
+        actions.action('angry-anim', lambda beh: beh.cozmo.play_anim_trigger(beh.sdk.anim.Triggers.DriveStartAngry)),
+        actions.action('neutral-anim', lambda beh: beh.cozmo.play_anim_trigger(beh.sdk.anim.Triggers.NeutralFace)),
+        actions.action('look', lambda beh: beh.cozmo.set_head_angle(beh.sdk.util.degrees(0))),
+    )
 
-        # Play the animation
-        try:
-            self.angry_anim = self.cozmo.play_anim_trigger(cozmosdk.anim.Triggers.DriveStartAngry)
-            self.angry_anim.on_completed(lambda evt, **kwargs: self._angry_anim_completed(evt))
-        except:
-            pass
-
-    def _angry_anim_completed(self, evt):
-        try:
-            self.neutral_anim = self.cozmo.play_anim_trigger(cozmosdk.anim.Triggers.NeutralFace)
-            self.neutral_anim.on_completed(lambda evt, **kwargs: self._neutral_anim_completed(evt))
-        except:
-            pass
-
-    def _neutral_anim_completed(self, evt):
-        try:
-            self.look_action = self.cozmo.set_head_angle(cozmosdk.util.degrees(0))
-        except:
-            pass
-
-    def deactivate(self):
-        if self.angry_anim and self.angry_anim.is_running:
-            self.angry_anim.abort()
-
-        if self.neutral_anim and self.neutral_anim.is_running:
-            self.angry_anim.abort()
-
-        if self.look_action and self.look_action.is_running:
-            self.look_action.abort()
-
-    def update(self, elapsed):
+    def is_released(self):
         """ Activates if the undesired-stimulus-releaser is active """
-        delta = 18 * elapsed
         rel = self.behavior_system.robot.perception_system.get_releaser('undesired-stimulus-releaser')
         sorry = self.behavior_system.robot.emotion_system.emotion_sorrow
 
-        if rel.is_active() and self.behavior_system.robot.emotion_system.active_emotion == sorry:
+        return rel.is_active() and self.behavior_system.robot.emotion_system.active_emotion == sorry
+
+    def update(self, elapsed):
+        delta = self.activation_rate * elapsed
+
+        if self.is_released():
             self.activation_level = self.activation_level + delta
         else:
             self.activation_level = max(0, self.activation_level - delta)
@@ -131,55 +162,28 @@ class RejectStimulusBehavior(Behavior):
 class EscapeStimulusBehavior(Behavior):
     """ Behavior that tries to escape a stimulus that it has been shown """
     name = 'escape-stimulus-behavior'
+    reads = ('threatening-stimulus-releaser', 'fear-emotion')
+    activation_rate = 35
 
-    def __init__(self, behavior_system):
-        super().__init__(behavior_system)
-
-        self.scared_anim = None
-        self.drive_away_action = None
-        self.turn_away_action = None
-
-    def activate(self):
-        self.robot = self.behavior_system.robot
-        self.cozmo = self.robot.cozmo
-
-        try:
-            self.scared_anim = self.cozmo.play_anim_trigger(cozmosdk.anim.Triggers.DriveStartAngry)
-            self.scared_anim.on_completed(lambda evt, **kwargs: self._scared_animation_completed(evt))
-        except:
-            pass
-
-    def _scared_animation_completed(self, evt):
-        try:
-            self.drive_away_action = self.cozmo.drive_straight(cozmosdk.util.distance_inches(-2), cozmosdk.util.speed_mmps(100), should_play_anim=False)
-            self.drive_away_action.on_completed(lambda evt, **kwargs: self._drive_away_action_completed(evt))
-        except:
-            pass
-
-    def _drive_away_action_completed(self, evt):
-        try:
-            self.turn_away_action = self.cozmo.turn_in_place(cozmosdk.util.degrees(-90))
-        except:
-            pass
-
-    def deactivate(self):
-        if self.scared_anim and self.scared_anim.is_running:
-            self.scared_anim.abort()
-
-        if self.drive_away_action and self.drive_away_action.is_running:
-            self.drive_away_action.abort()
+    # Show a scared expression, then back away and turn around
+    steps = (
+        actions.action('scared-anim', lambda beh: beh.cozmo.play_anim_trigger(beh.sdk.anim.Triggers.DriveStartAngry)),
+        actions.action('drive-away', lambda beh: beh.cozmo.drive_straight(beh.sdk.util.distance_inches(-2), beh.sdk.util.speed_mmps(100), should_play_anim=False)),
+        actions.action('turn-away', lambda beh: beh.cozmo.turn_in_place(beh.sdk.util.degrees(-90))),
+    )
 
-        if self.turn_away_action and self.turn_away_action.is_running:
-            self.turn_away_action.abort()
-
-    def update(self, elapsed):
+    def is_released(self):
         """ Activates if the threatening-stimulus-releaser is active and the fear emotion is active """
-        delta = 35 * elapsed
         rel = self.behavior_system.robot.perception_system.get_releaser('threatening-stimulus-releaser')
         fear = self.behavior_system.robot.emotion_system.emotion_fear
 
         # TODO: incorporate fear emotion
-        if rel.is_active() and self.behavior_system.robot.emotion_system.active_emotion == fear:
+        return rel.is_active() and self.behavior_system.robot.emotion_system.active_emotion == fear
+
+    def update(self, elapsed):
+        delta = self.activation_rate * elapsed
+
+        if self.is_released():
             self.activation_level = self.activation_level + delta
         else:
             self.activation_level = max(0, self.activation_level - delta)
@@ -188,44 +192,27 @@ class EscapeStimulusBehavior(Behavior):
 class PlayWithToyBehavior(Behavior):
     """ Behavior that tries to engage and play with a toy stimulus """
     name = 'play-with-toy-behavior'
+    reads = ('desired-stimulus-releaser', 'solo-drive', 'joy-emotion')
+    activation_rate = 10
 
-    def __init__(self, behavior_system):
-        super().__init__(behavior_system)
-
-        self.happy_anim = None
-        self.roll_block_behavior = None
-
-    def activate(self):
-        """ Roll the block over """
-        self.robot = self.behavior_system.robot
-        self.cozmo = self.robot.cozmo
-
-        # Begin the behavior to roll the block over
-        try:
-            self.happy_anim = self.cozmo.play_anim_trigger(cozmosdk.anim.Triggers.AcknowledgeFaceNamed)
-            self.happy_anim.on_completed(lambda evt, **kwargs: self._happy_animation_completed(evt))
-        except:
-            pass
+    # Show a happy expression, then roll the block over
+    steps = (
+        actions.action('happy-anim', lambda beh: beh.cozmo.play_anim_trigger(beh.sdk.anim.Triggers.AcknowledgeFaceNamed)),
+        actions.background('roll-block', lambda beh: beh.cozmo.start_behavior(beh.sdk.behavior.BehaviorTypes.RollBlock)),
+    )
 
-    def _happy_animation_completed(self, evt):
-        self.roll_block_behavior = self.cozmo.start_behavior(cozmosdk.behavior.BehaviorTypes.RollBlock)
-
-    def deactivate(self):
-        """ Deactivate the behaviors if they are active """
-        if self.happy_anim and self.happy_anim.is_running:
-            self.happy_anim.abort()
-
-        if self.roll_block_behavior and self.roll_block_behavior.is_active:
-            self.roll_block_behavior.stop()
-
-    def update(self, elapsed):
+    def is_released(self):
         """ Activates if the desired-stimulus-releaser is active and the solo-drive is active and the joy-emotion is active """
-        delta = 10 * elapsed
         rel = self.behavior_system.robot.perception_system.get_releaser('desired-stimulus-releaser')
         solo = self.behavior_system.robot.drive_system.solo_drive
         joy = self.behavior_system.robot.emotion_system.emotion_joy
 
-        if rel.is_active() and self.behavior_system.robot.drive_system.active_drive == solo and self.behavior_system.robot.emotion_system.active_emotion == joy:
+        return rel.is_active() and self.behavior_system.robot.drive_system.active_drive == solo and self.behavior_system.robot.emotion_system.active_emotion == joy
+
+    def update(self, elapsed):
+        delta = self.activation_rate * elapsed
+
+        if self.is_released():
             self.activation_level = self.activation_level + delta
         else:
             self.activation_level = max(0, self.activation_level - delta)
@@ -234,60 +221,33 @@ class PlayWithToyBehavior(Behavior):
 class EngageWithFaceBehavior(Behavior):
     """ Behavior that tries to engage with a face stimulus """
     name = 'engage-with-face-behavior'
+    reads = ('desired-stimulus-releaser', 'social-drive', 'joy-emotion')
+    activation_rate = 10
+
+    # Show a happy expression and say hello, for as long as the behavior stays active
+    steps = (
+        actions.action('happy-anim', lambda beh: beh.cozmo.play_anim_trigger(beh.sdk.anim.Triggers.AcknowledgeFaceNamed)),
+        actions.action('phrase', lambda beh: beh.cozmo.say_text(random.choice(beh.phrases))),
+    )
+    repeat_steps = True
 
     def __init__(self, behavior_system):
         super().__init__(behavior_system)
-        
-        self.phrases = ['Hello', 'Hi', 'Hi there', 'Hey']
-        self.happy_anim = None
-        self.phrase_action = None
-
-    def activate(self):
-        """ Look up at the face, show a happy expression, and say hello """
-        self.robot = self.behavior_system.robot
-        self.cozmo = self.robot.cozmo
-
-        self._start_loop()
-
-    def _start_loop(self):
-        # Play the animation
-        if not self.is_active:
-            return
-
-        try:
-            self.happy_anim = self.cozmo.play_anim_trigger(cozmosdk.anim.Triggers.AcknowledgeFaceNamed)
-            self.happy_anim.on_completed(lambda evt, **kwargs: self._happy_anim_completed(evt))
-        except:
-            pass
-
-    def _happy_anim_completed(self, evt):
-        phrase = random.choice(self.phrases)
 
-        # Say a phrase
-        try:
-            self.phrase_action = self.cozmo.say_text(phrase)
-            self.phrase_action.on_completed(lambda evt, **kwargs: self._phrase_action_completed(evt))
-        except:
-            pass
-
-    def _phrase_action_completed(self, evt):
-        self._start_loop()
-
-    def deactivate(self):
-        if self.happy_anim and self.happy_anim.is_running:
-            self.happy_anim.abort()
-
-        if self.phrase_action and self.phrase_action.is_running:
-            self.phrase_action.abort()
+        self.phrases = ['Hello', 'Hi', 'Hi there', 'Hey']
 
-    def update(self, elapsed):
+    def is_released(self):
         """ Activates if the desired-stimulus-releaser is active and the social-drive is active """
-        delta = 10 * elapsed
         rel = self.behavior_system.robot.perception_system.get_releaser('desired-stimulus-releaser')
         social = self.behavior_system.robot.drive_system.social_drive
         joy = self.behavior_system.robot.emotion_system.emotion_joy
 
-        if rel.is_active() and self.behavior_system.robot.drive_system.active_drive == social and self.behavior_system.robot.emotion_system.active_emotion == joy:
+        return rel.is_active() and self.behavior_system.robot.drive_system.active_drive == social and self.behavior_system.robot.emotion_system.active_emotion == joy
+
+    def update(self, elapsed):
+        delta = self.activation_rate * elapsed
+
+        if self.is_released():
             self.activation_level = self.activation_level + delta
         else:
             self.activation_level = max(0, self.activation_level - delta)
@@ -296,16 +256,22 @@ class EngageWithFaceBehavior(Behavior):
 class RestBehavior(Behavior):
     """ Behavior where robot tries to rest """
     name = 'rest-behavior'
+    reads = ('rest-drive',)
+    activation_rate = 8
 
     def __init__(self, behavior_system):
         super().__init__(behavior_system);
 
-    def update(self, elapsed):
+    def is_released(self):
         """ Activates if the rest-drive is active """
-        delta = 8 * elapsed
         rest = self.behavior_system.robot.drive_system.rest_drive
 
-        if self.behavior_system.robot.drive_system.active_drive == rest:
+        return self.behavior_system.robot.drive_system.active_drive == rest
+
+    def update(self, elapsed):
+        delta = self.activation_rate * elapsed
+
+        if self.is_released():
             self.activation_level = self.activation_level + delta
         else:
             self.activation_level = max(0, self.activation_level - delta)
@@ -313,6 +279,8 @@ class RestBehavior(Behavior):
 
 class BehaviorSystem(system.System):
     """ Represents the behavior system of the robot """
+    name = 'behavior-system'
+    kind = 'behavior'
 
     def __init__(self, robot):
         super().__init__(robot)
@@ -325,13 +293,22 @@ class BehaviorSystem(system.System):
             EngageWithFaceBehavior(self),
             RestBehavior(self),
         ]
+
+        for behavior in self.behaviors:
+            robot.registry.register(behavior, 'behavior')
         self.active_behavior = None
 
+        # Tasks performing behaviors while the robot runs on an event loop
+        self.tasks = set()
+
+        # Time from switching away from each behavior until its steps stopped
+        self.preemption_latency = {}
+
     def update(self, elapsed):
         """ Update all behaviors """
         
-        for behavior in self.behaviors:
-            behavior.update(elapsed)
+        for behavior in self.robot.registry.update_order('behavior'):
+            behavior.evaluate(elapsed)
             if behavior.is_active:
                 behavior.activation_duration += elapsed
 
@@ -351,6 +328,39 @@ class BehaviorSystem(system.System):
             # Activate the new behavior
             if self.active_behavior:
                 self.active_behavior.is_active = True
-                self.active_behavior.last_activated = timeit()
+                self.active_behavior.last_activated = self.robot.clock.now()
                 self.active_behavior.activation_duration = 0
-                self.active_behavior.activate()
\ No newline at end of file
+
+                # On an event loop the behavior runs as a task that awaits its actions
+                if self.robot.loop:
+                    task = self.robot.loop.create_task(self.active_behavior.perform())
+                    task.add_done_callback(self.on_task_done)
+                    self.tasks.add(task)
+                else:
+                    self.active_behavior.activate()
+
+    def on_task_done(self, task):
+        self.tasks.discard(task)
+
+        if not task.cancelled() and task.exception():
+            self.robot.logger.error('Behavior task failed: {!r}'.format(task.exception()))
+
+    def cancel_tasks(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+    def on_step_started(self, sequence, step):
+        self.action_started(sequence.owner, step.name)
+
+    def action_started(self, behavior, name):
+        """ Emits `action-started` with the behavior, the action's name and the time it was started at """
+        self.emit('action-started', behavior, name, self.robot.clock.now())
+
+    def on_sequence_stopped(self, sequence, latency):
+        """ Records how long a cancelled behavior's steps took to actually stop """
+        hist = self.preemption_latency.get(sequence.owner.name)
+        if hist is None:
+            hist = self.preemption_latency[sequence.owner.name] = instrumentation.LatencyHistogram()
+        hist.record(latency)
+
+        self.robot.instrumentation.record('preemption', latency)
\ No newline at end of file
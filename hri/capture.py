@@ -0,0 +1,315 @@
+from .instrumentation import LatencyHistogram
+
+from collections import deque
+import io
+import os
+import threading
+import time
+import zlib
+
+class ImageDirectorySink(object):
+    """ Writes every frame to its own `image{run_id}_{number}.jpg` file """
+
+    def __init__(self, directory, run_id):
+        self.directory = directory
+        self.run_id = run_id
+
+    def write(self, data, number, timestamp):
+        with open(os.path.join(self.directory, 'image{}_{}.jpg'.format(self.run_id, number)), 'wb') as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+
+class ImageWriter(object):
+    """ Encodes camera images and hands them to a sink on a pool of background threads
+
+    Images wait in a bounded queue. When the queue is full, either the oldest
+    queued image (`drop-oldest`) or the incoming one (`drop-newest`) is
+    dropped, so `submit` never blocks the control loop on disk I/O. The sink
+    is either an `ImageDirectorySink` or an `archive.FrameArchiveWriter`.
+
+    Images are encoded in parallel but handed to the sink in the order they
+    were taken from the queue: an image encoded ahead of an earlier one
+    waits until the earlier one has been written (or failed).
+    """
+    DROP_OLDEST = 'drop-oldest'
+    DROP_NEWEST = 'drop-newest'
+
+    def __init__(self, sink, workers=2, max_queue=32, policy=DROP_OLDEST, image_format='JPEG'):
+        if policy not in (self.DROP_OLDEST, self.DROP_NEWEST):
+            raise ValueError('Unknown drop policy: {}'.format(policy))
+
+        self.sink = sink
+        self.max_queue = max_queue
+        self.policy = policy
+        self.image_format = image_format
+
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        # Encoded images waiting for the images taken from the queue before them, by the order they were taken in
+        self.write_lock = threading.Lock()
+        self.pending = {}
+        self.taken_count = 0
+        self.next_write = 0
+
+        self.submitted_count = 0
+        self.written_count = 0
+        self.dropped_count = 0
+        self.error_count = 0
+        self.last_error = None
+
+        self.encode_latency = LatencyHistogram()
+        self.write_latency = LatencyHistogram()
+
+        # The worker threads are started with the first submitted image
+        self.worker_count = workers
+        self.workers = []
+
+    def submit(self, image, number, timestamp):
+        """ Queues an image to be written to the sink, returning False if it was dropped """
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('ImageWriter is closed')
+
+            if not self.workers:
+                self._start_workers()
+
+            self.submitted_count += 1
+
+            if len(self.queue) >= self.max_queue:
+                self.dropped_count += 1
+
+                if self.policy == self.DROP_NEWEST:
+                    return False
+
+                self.queue.popleft()
+
+            self.queue.append((image, number, timestamp))
+            self.condition.notify()
+            return True
+
+    def queue_depth(self):
+        return len(self.queue)
+
+    def stats(self):
+        """ Returns the queue depth, frame counters, and encode/write latency summaries """
+        return {
+            'queue_depth': len(self.queue),
+            'submitted': self.submitted_count,
+            'written': self.written_count,
+            'dropped': self.dropped_count,
+            'errors': self.error_count,
+            'encode': self.encode_latency.summary(),
+            'write': self.write_latency.summary(),
+        }
+
+    def close(self, wait=True):
+        """ Stops accepting images; waits for the queued ones to be written unless `wait` is False """
+        with self.condition:
+            self.closed = True
+            if not wait:
+                self.dropped_count += len(self.queue)
+                self.queue.clear()
+            self.condition.notify_all()
+
+        if wait:
+            for worker in self.workers:
+                worker.join()
+
+            self.sink.close()
+
+    def _start_workers(self):
+        self.workers = [threading.Thread(target=self._worker, name='image-writer-{}'.format(i), daemon=True) for i in range(self.worker_count)]
+        for worker in self.workers:
+            worker.start()
+
+    def encode(self, image):
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.image_format)
+        return buffer.getvalue()
+
+    def _worker(self):
+        timer = time.perf_counter
+
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+
+                if not self.queue:
+                    return
+
+                image, number, timestamp = self.queue.popleft()
+                order = self.taken_count
+                self.taken_count += 1
+
+            try:
+                start = timer()
+                data = self.encode(image)
+                encoded = (data, number, timestamp, timer() - start)
+            except Exception as e:
+                self._failed(e)
+                encoded = None
+
+            self._write_in_order(order, encoded)
+
+    def _write_in_order(self, order, encoded):
+        """ Writes the encoded image, and any encoded after it that were waiting for it, to the sink in order """
+        timer = time.perf_counter
+
+        with self.write_lock:
+            self.pending[order] = encoded
+
+            while self.next_write in self.pending:
+                encoded = self.pending.pop(self.next_write)
+                self.next_write += 1
+
+                if encoded is None:
+                    continue
+
+                data, number, timestamp, encode_latency = encoded
+                try:
+                    start = timer()
+                    self.sink.write(data, number, timestamp)
+                    written = timer()
+                except Exception as e:
+                    self._failed(e)
+                    continue
+
+                with self.condition:
+                    self.encode_latency.record(encode_latency)
+                    self.write_latency.record(written - start)
+                    self.written_count += 1
+
+    def _failed(self, error):
+        with self.condition:
+            self.error_count += 1
+            self.last_error = error
+
+
+class CapturePolicy(object):
+    """ Decides whether the latest camera image is worth saving
+
+    Deciding is split in two, so that policies can be combined in any order:
+    `accepts` only looks at the image and the robot, and `commit` is then
+    called with whether the image was captured, which is when a policy
+    updates its state.
+    """
+
+    def accepts(self, robot, image):
+        return True
+
+    def commit(self, robot, image, captured):
+        pass
+
+    def should_capture(self, robot, image):
+        captured = self.accepts(robot, image)
+        self.commit(robot, image, captured)
+        return captured
+
+
+class NewFramePolicy(CapturePolicy):
+    """ Captures only images that differ from the last one captured
+
+    Frames are compared by `image_number`, or by a CRC of the pixel data
+    when `use_hash` is set (for sources without image numbers). The key of
+    the last image offered is kept, so an image offered again isn't hashed
+    again.
+    """
+
+    def __init__(self, use_hash=False):
+        self.use_hash = use_hash
+        self.last_image = None
+        self.last_image_key = None
+        self.last_key = None
+
+    def frame_key(self, image):
+        if image is not self.last_image:
+            if self.use_hash or getattr(image, 'image_number', None) is None:
+                self.last_image_key = zlib.crc32(image.raw_image.tobytes())
+            else:
+                self.last_image_key = image.image_number
+            self.last_image = image
+
+        return self.last_image_key
+
+    def accepts(self, robot, image):
+        return self.frame_key(image) != self.last_key
+
+    def commit(self, robot, image, captured):
+        if captured:
+            self.last_key = self.frame_key(image)
+
+
+class RateLimitPolicy(CapturePolicy):
+    """ Captures at most `fps` images per second of robot time """
+
+    def __init__(self, fps):
+        self.interval = 1 / fps
+        self.last_capture = None
+
+    def accepts(self, robot, image):
+        return self.last_capture is None or robot.clock.now() - self.last_capture >= self.interval
+
+    def commit(self, robot, image, captured):
+        if captured:
+            self.last_capture = robot.clock.now()
+
+
+class EveryNthFramePolicy(CapturePolicy):
+    """ Captures every `n`-th image offered to it, counting the images other policies declined too """
+
+    def __init__(self, n):
+        self.n = n
+        self.count = 0
+
+    def accepts(self, robot, image):
+        return self.count % self.n == 0
+
+    def commit(self, robot, image, captured):
+        self.count += 1
+
+
+class StimulusDetectedPolicy(CapturePolicy):
+    """ Captures only while at least one stimulus is detected """
+
+    def accepts(self, robot, image):
+        return robot.perception_system.any_detected()
+
+
+class BehaviorActivePolicy(CapturePolicy):
+    """ Captures only while a behavior (optionally one of `names`) is active """
+
+    def __init__(self, names=None):
+        self.names = set(names) if names else None
+
+    def accepts(self, robot, image):
+        behavior = robot.behavior_system.active_behavior
+
+        if behavior is None:
+            return False
+
+        return self.names is None or behavior.name in self.names
+
+
+class AllOf(CapturePolicy):
+    """ Captures when every policy accepts
+
+    Every policy is then told whether the image was captured, so a rate
+    limit only uses up its slot on images that are actually saved, whatever
+    order the policies are given in.
+    """
+
+    def __init__(self, *policies):
+        self.policies = list(policies)
+
+    def accepts(self, robot, image):
+        return all(policy.accepts(robot, image) for policy in self.policies)
+
+    def commit(self, robot, image, captured):
+        for policy in self.policies:
+            policy.commit(robot, image, captured)
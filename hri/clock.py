@@ -0,0 +1,52 @@
+from timeit import default_timer as timeit
+import asyncio
+
+class Clock(object):
+    """ Wall clock that the robot and its systems use to measure time """
+
+    def now(self):
+        return timeit()
+
+    def advance(self, seconds):
+        """ Wall time passes on its own, so there is nothing to advance """
+        pass
+
+    def advance_to(self, time):
+        pass
+
+    def wait(self, event, timeout):
+        """ Blocks until the event is set or the timeout passes, returning whether the event was set """
+        return event.wait(timeout)
+
+    async def sleep(self, seconds):
+        """ Sleeps on the running event loop """
+        await asyncio.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """ Manually advanced clock for deterministic, faster-than-real-time runs """
+
+    def __init__(self, start=0):
+        self.time = start
+
+    def now(self):
+        return self.time
+
+    def advance(self, seconds):
+        self.time += seconds
+
+    def advance_to(self, time):
+        self.time = time
+
+    def wait(self, event, timeout):
+        """ Advances by the timeout instead of sleeping """
+        if event.is_set():
+            return True
+
+        self.advance(timeout)
+        return event.is_set()
+
+    async def sleep(self, seconds):
+        """ Advances by the time instead of sleeping, but still yields to the event loop """
+        self.advance(seconds)
+        await asyncio.sleep(0)
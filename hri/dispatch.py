@@ -0,0 +1,143 @@
+from . import instrumentation
+
+from collections import deque
+import threading
+import time
+
+IMMEDIATE = 'immediate'
+TICK = 'tick'
+THREAD = 'thread'
+LOOP = 'loop'
+
+class EventDispatcher(object):
+    """ Delivers the events that systems emit to their listeners
+
+    In `immediate` mode listeners run synchronously inside `emit`, as with a
+    plain pyee emitter. Otherwise each listener call is appended to a queue
+    (a deque, whose appends and pops are atomic, so emitting never takes a
+    lock) and delivered later in a batch:
+
+    - `tick`: by `end_tick()`, which the robot calls once the tick is over
+    - `thread`: on a dispatcher thread, woken up whenever there are events
+    - `loop`: on an asyncio event loop, scheduled thread-safely
+
+    Listeners then see the robot's state as of the end of the tick (or, on a
+    thread or loop, as it is when they run), but a slow listener can't delay
+    the systems. The time spent in each listener is recorded either way.
+    """
+
+    def __init__(self, mode=TICK, logger=None, loop=None, window=1000):
+        if mode not in (IMMEDIATE, TICK, THREAD, LOOP):
+            raise ValueError('Unknown dispatch mode {}'.format(mode))
+        if mode == LOOP and loop is None:
+            raise ValueError('The loop dispatch mode needs an event loop')
+
+        self.mode = mode
+        self.logger = logger
+        self.loop = loop
+        self.window = window
+        self.timer = time.perf_counter
+
+        self.queue = deque()
+        self.histograms = {}
+        self.delivered = 0
+        self.errors = 0
+
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+        self.scheduled = False
+
+    def submit(self, f, args, kwargs):
+        """ Delivers a listener call now or queues it, depending on the mode """
+        if self.mode == IMMEDIATE:
+            self.deliver(f, args, kwargs, raise_errors=True)
+            return
+
+        self.queue.append((f, args, kwargs))
+
+        if self.mode == THREAD:
+            if self.thread is None:
+                self.start()
+            self.wakeup.set()
+        elif self.mode == LOOP and not self.scheduled:
+            self.scheduled = True
+            self.loop.call_soon_threadsafe(self._flush_scheduled)
+
+    def deliver(self, f, args, kwargs, raise_errors=False):
+        """ Runs one listener call, recording how long it took """
+        start = self.timer()
+        try:
+            f(*args, **kwargs)
+        except Exception:
+            self.errors += 1
+            if raise_errors:
+                raise
+            if self.logger:
+                self.logger.exception('Error in event listener {}'.format(listener_name(f)))
+        finally:
+            self.histogram(listener_name(f)).record(self.timer() - start)
+            self.delivered += 1
+
+    def flush(self):
+        """ Delivers every queued listener call, returning how many were delivered """
+        count = 0
+
+        while True:
+            try:
+                f, args, kwargs = self.queue.popleft()
+            except IndexError:
+                return count
+
+            self.deliver(f, args, kwargs)
+            count += 1
+
+    def end_tick(self):
+        """ Delivers the events queued during the tick when in tick mode """
+        return self.flush() if self.mode == TICK else 0
+
+    def _flush_scheduled(self):
+        self.scheduled = False
+        self.flush()
+
+    def start(self):
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name='event-dispatcher', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopping:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """ Stops the dispatcher thread, if any, and delivers what is still queued """
+        if self.thread:
+            self.stopping = True
+            self.wakeup.set()
+            self.thread.join()
+            self.thread = None
+
+        self.flush()
+
+    def histogram(self, name):
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = instrumentation.LatencyHistogram(self.window)
+        return hist
+
+    def stats(self):
+        """ Returns the queue depth, delivery counters and the latency summary of every listener """
+        return {
+            'mode': self.mode,
+            'queue_depth': len(self.queue),
+            'delivered': self.delivered,
+            'errors': self.errors,
+            'listeners': {name: hist.summary() for name, hist in list(self.histograms.items())},
+        }
+
+
+def listener_name(f):
+    """ Returns a readable name for a listener, such as Robot.on_stimulus_detected """
+    return getattr(f, '__qualname__', None) or repr(f)
@@ -1,10 +1,14 @@
 from . import system
+from . import incremental
 
 import operator
 
-class Drive(object):
+class Drive(incremental.Incremental):
     """ Represents a homeostatic drive or motivation for the robot """
     name = None
+    reads = ()
+    reads_previous = ()
+    desired_stimulus_type = None
 
     def __init__(self, drive_system):
         self.drive_system = drive_system
@@ -29,6 +33,12 @@ class Drive(object):
     def is_homeostatic(self):
         return self.range_homeostatic[0] <= self.drive_level <= self.range_homeostatic[1]
 
+    def input_key(self):
+        return ()
+
+    def state_key(self):
+        return self.drive_level
+
     def update(self, elapsed):
         # TODO: Implement properly, calculating the drive
         pass
@@ -57,10 +67,16 @@ class SoloDrive(Drive):
     the drive_level will decrease (towards overwhelmed). Otherwise, it will increase.
     """
     name = 'solo-drive'
+    reads_previous = ('desired-stimulus-releaser',)
+    desired_stimulus_type = 'toy-stimulus'
    
     def __init__(self, drive_system):
         super().__init__(drive_system)
 
+    def input_key(self):
+        rel = self.drive_system.robot.perception_system.get_releaser('desired-stimulus-releaser')
+        return (rel.is_active(), self.drive_system.active_drive == self)
+
     def update(self, elapsed):
         rel = self.drive_system.robot.perception_system.get_releaser('desired-stimulus-releaser')
         is_active = (self.drive_system.active_drive == self)
@@ -74,10 +90,16 @@ class SoloDrive(Drive):
 class SocialDrive(Drive):
     """ The drive that motivates the system to play with people """
     name = 'social-drive'
+    reads_previous = ('desired-stimulus-releaser',)
+    desired_stimulus_type = 'face-stimulus'
    
     def __init__(self, drive_system):
         super().__init__(drive_system)
 
+    def input_key(self):
+        rel = self.drive_system.robot.perception_system.get_releaser('desired-stimulus-releaser')
+        return (rel.is_active(), self.drive_system.active_drive == self)
+
     def update(self, elapsed):
         rel = self.drive_system.robot.perception_system.get_releaser('desired-stimulus-releaser')
         is_active = (self.drive_system.active_drive == self)
@@ -90,6 +112,8 @@ class SocialDrive(Drive):
 
 class DriveSystem(system.System):
     """ System that manages the state of the robot's drives """
+    name = 'drive-system'
+    kind = 'drive'
     
     def __init__(self, robot):
         super().__init__(robot)
@@ -99,6 +123,9 @@ class DriveSystem(system.System):
         self.social_drive = SocialDrive(self)
         self.drives = [self.rest_drive, self.solo_drive, self.social_drive]
 
+        for drive in self.drives:
+            robot.registry.register(drive, 'drive')
+
         self.rest_drive.drive_level = -100      # Overwhelmed
         self.solo_drive.drive_level = -20       # Homeostatic
         self.social_drive.drive_level = 35      # Underwhelmed
@@ -116,8 +143,8 @@ class DriveSystem(system.System):
 
     def update(self, elapsed):
         # Update the various drives
-        for drive in self.drives:
-            drive.update(elapsed)
+        for drive in self.robot.registry.update_order('drive'):
+            drive.evaluate(elapsed)
 
         # If the active drive is not within the homeostatic range, then keep it active
         if not self.active_drive.is_homeostatic():
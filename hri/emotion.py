@@ -1,9 +1,21 @@
 from . import system
+from . import incremental
 import operator
 
-class Emotion(object):
+# Affect components are clamped to this magnitude before they are averaged
+AFFECT_LIMIT = 1250
+
+class Emotion(incremental.Incremental):
     """ Class that represents an emotion's elicitor and activation process """
     name = None
+    reads = ('releaser',)
+
+    # Per affect component (arousal, valence, stance): whether a releaser's
+    # value must be above (True) or below (False) the threshold to count
+    affect_filter = ((True, 0), (True, 0), (True, 0))
+
+    # Releaser that must be active for this emotion to be elicited at all
+    elicited_by = None
 
     def __init__(self, emotion_system):
         self.emotion_system = emotion_system
@@ -17,9 +29,21 @@ class Emotion(object):
         self.activation_decay = 0
         self.activation_max = 200
 
+        # Values that the temporally-bound activation terms are reset to
+        self.default_activation_bias = 0
+        self.default_activation_persistence = 0
+
+        self.elicitation_divisor = 50
+
         self.threshold_expression = 60
         self.threshold_behavior = 100
 
+    def input_key(self):
+        return self.emotion_system.affect_key
+
+    def state_key(self):
+        return (self.activation_level, self.activation_decay, self.activation_bias, self.activation_persistence, self.net_affect, self.elicitation_level)
+
     def should_cause_expression(self):
         return self.activation_level >= self.threshold_expression
 
@@ -28,166 +52,73 @@ class Emotion(object):
 
     def reset_activation_terms(self):
         """ Reset the temporally-bound activation terms """
-        raise NotImplementedError()
-
-    def filter_affect(self, affect):
-        """ Returns the adjusted affect if it passes this emotion's filter """
-        raise NotImplementedError()
-
-    def compute_net_affect(self):
-        """ Compute the net affect of this emotion process """
-        filtered_affects = [self.filter_affect(rel.affect) for rel in self.emotion_system.robot.perception_system.releasers if rel.is_active()]
-        filtered_affects = [(
-            min(max(affect[0], -1250), 1250) if affect[0] else None,
-            min(max(affect[1], -1250), 1250) if affect[1] else None,
-            min(max(affect[2], -1250), 1250) if affect[2] else None,
-        ) for affect in filtered_affects]
-
-        arousal_count = 0
-        arousal_value = 0
-        valence_count = 0
-        valence_value = 0
-        stance_count = 0
-        stance_value = 0
-
-        for affect in filtered_affects:
-            if affect[0]:
-                arousal_count += 1
-                arousal_value += affect[0]
-
-            if affect[1]:
-                valence_count += 1
-                valence_value += affect[1]
-
-            if affect[2]:
-                stance_count += 1
-                stance_value += affect[2]
-
-        if arousal_count: arousal_value /= arousal_count
-        if valence_count: valence_value /= valence_count
-        if stance_count: stance_value /= stance_count
-        self.net_affect = (arousal_value, valence_value, stance_value)
-
-    def compute_elicitation_level(self):
-        """ Compute the elicitation level based on the net affect """
-        raise NotImplementedError()
-
-    def compute_activation_level(self):
-        """ Compute the activation level of this emotion process """
-        # If the net affect has any None components, then it cannot be activated
-        if not all(self.net_affect):
-            # If we are already activated, let it decay naturally
-            if self.activation_level >= self.threshold_expression:
-                self.activation_level -= self.activation_decay
-            else:
-                self.activation_level = 0
-        else:
-            self.activation_level = max(0, min(abs(self.elicitation_level) + self.activation_bias + self.activation_persistence - self.activation_decay, self.activation_max))
-
-    def update(self, elapsed):
-        """ Combines all releasers into an elicitation and activation level """
-        self.compute_net_affect()
-        self.compute_elicitation_level()
-        self.compute_activation_level()
+        self.activation_bias = self.default_activation_bias
+        self.activation_persistence = self.default_activation_persistence
+        self.activation_decay = 0
 
+    def update_activation_terms(self, elapsed):
+        """ Lets an expressed emotion decay over time, and resets the terms of one that isn't """
         if self.activation_level > self.threshold_expression:
             self.activation_decay += elapsed / 10
         else:
             self.reset_activation_terms()
 
+    def update(self, elapsed):
+        """ Combines all releasers into an elicitation and activation level """
+        self.emotion_system.update_emotion(elapsed, self)
+
 class JoyEmotion(Emotion):
     """ The joy emotion (for example, when a desired stimulus is present) """
     name = 'joy-emotion'
 
+    # The joy-emotion deals with higher arousal, higher valence, and higher stance
+    affect_filter = ((True, 250), (True, 250), (True, 250))
+
     def __init__(self, emotion_system):
         super().__init__(emotion_system)
 
-        self.activation_bias = 20
-        self.activation_persistence = 10
-        self.activation_decay = 0
-
-    def reset_activation_terms(self):
-        """ Reset the temporally-bound activation terms """
-        self.activation_bias = 20
-        self.activation_persistence = 10
-        self.activation_decay = 0
-
-    def filter_affect(self, affect):
-        """ The joy-emotion deals with higher arousal, higher valence, and higher stance """
-        return (
-            affect[0] if affect[0] > 250 else None,
-            affect[1] if affect[1] > 250 else None,
-            affect[2] if affect[2] > 250 else None, 
-        )
-
-    def compute_elicitation_level(self):
-        self.elicitation_level = sum([abs(v) for v in self.net_affect]) / 30
+        self.default_activation_bias = 20
+        self.default_activation_persistence = 10
+        self.elicitation_divisor = 30
+        self.reset_activation_terms()
 
 
 class SorrowEmotion(Emotion):
     """ The sorrow emotion (for example, when a desired stimulus is absent for a while) """
     name = 'sorrow-emotion'
 
+    # The sorrow-emotion deals with non-high arousal, lower valence, and lower stance
+    affect_filter = ((False, 250), (False, -250), (False, -250))
+
     def __init__(self, emotion_system):
         super().__init__(emotion_system)
 
-        self.activation_bias = 20
-        self.activation_persistence = 10
-        self.activation_decay = 0
-
-    def reset_activation_terms(self):
-        """ Reset the temporally-bound activation terms """
-        self.activation_bias = 20
-        self.activation_persistence = 10
-        self.activation_decay = 0
-
-    def filter_affect(self, affect):
-        """ The sorrow-emotion deals with non-high arousal, lower valence, and lower stance """
-        return (
-            affect[0] if affect[0] < 250 else None,
-            affect[1] if affect[1] < -250 else None,
-            affect[2] if affect[2] < -250 else None, 
-        )
-
-    def compute_elicitation_level(self):
-        self.elicitation_level = sum([abs(v) for v in self.net_affect]) / 50
+        self.default_activation_bias = 20
+        self.default_activation_persistence = 10
+        self.reset_activation_terms()
 
 
 class FearEmotion(Emotion):
     """ The joy emotion (for example, when a threatening stimulus is present) """
     name = 'fear-emotion'
 
+    # The fear-emotion deals with higher arousal, lower valence, and lower stance,
+    # and only while a stimulus is threatening
+    affect_filter = ((True, 250), (False, -250), (False, -250))
+    elicited_by = 'threatening-stimulus-releaser'
+
     def __init__(self, emotion_system):
         super().__init__(emotion_system)
 
-        self.activation_bias = 20
-        self.activation_persistence = 10
-        self.activation_decay = 0
-
-    def reset_activation_terms(self):
-        """ Reset the temporally-bound activation terms """
-        self.activation_bias = 20
-        self.activation_persistence = 10
-        self.activation_decay = 0
-
-    def filter_affect(self, affect):
-        """ The sorrow-emotion deals with higher arousal, lower valence, and lower stance """
-        return (
-            affect[0] if affect[0] > 250 else None,
-            affect[1] if affect[1] < -250 else None,
-            affect[2] if affect[2] < - 250 else None, 
-        )
-
-    def compute_elicitation_level(self):
-        if not any([rel for rel in self.emotion_system.robot.perception_system.releasers if rel.is_active() and rel.name == 'threatening-stimulus-releaser']):
-            self.net_affect = (None, None, None)
-            self.elicitation_level = 0
-        else:
-            self.elicitation_level = sum([abs(v) for v in self.net_affect]) / 50
+        self.default_activation_bias = 20
+        self.default_activation_persistence = 10
+        self.reset_activation_terms()
 
 
 class EmotionSystem(system.System):
     """ System that manages the emotional state of the robot """
+    name = 'emotion-system'
+    kind = 'emotion'
     
     def __init__(self, robot):
         super().__init__(robot)
@@ -196,13 +127,55 @@ class EmotionSystem(system.System):
         self.emotion_sorrow = SorrowEmotion(self)
         self.emotion_fear = FearEmotion(self)
         self.emotions = [self.emotion_joy, self.emotion_sorrow, self.emotion_fear]
+
+        for em in self.emotions:
+            robot.registry.register(em, 'emotion')
         self.active_emotion = None
+        self.active_releasers = []
+        self.affect_key = None
+
+    def update_emotion(self, elapsed, em):
+        """ Computes the net affect, elicitation and activation of one emotion """
+        # Emotions that need a releaser can't be elicited while it is inactive
+        if em.elicited_by is not None and not self.robot.perception_system.get_releaser(em.elicited_by).is_active():
+            em.net_affect = (None, None, None)
+            em.elicitation_level = 0.0
+        else:
+            # Average the affect components on the right side of the emotion's thresholds (zero counts as missing)
+            sums = [0.0, 0.0, 0.0]
+            counts = [0, 0, 0]
+            for rel in self.active_releasers:
+                for i, value, (above, threshold) in zip(range(3), rel.affect, em.affect_filter):
+                    if value and ((value > threshold) if above else (value < threshold)):
+                        sums[i] += -AFFECT_LIMIT if value < -AFFECT_LIMIT else AFFECT_LIMIT if value > AFFECT_LIMIT else value
+                        counts[i] += 1
+
+            arousal, valence, stance = (total / count if count else 0.0 for total, count in zip(sums, counts))
+            em.net_affect = (arousal, valence, stance)
+            em.elicitation_level = (abs(arousal) + abs(valence) + abs(stance)) / em.elicitation_divisor
+
+        # If the net affect has any missing components, then it cannot be activated, and an
+        # already activated emotion decays naturally
+        net_affect = em.net_affect
+        if not (net_affect[0] and net_affect[1] and net_affect[2]):
+            if em.activation_level >= em.threshold_expression:
+                em.activation_level = float(em.activation_level - em.activation_decay)
+            else:
+                em.activation_level = 0.0
+        else:
+            em.activation_level = float(max(0, min(abs(em.elicitation_level) + em.activation_bias + em.activation_persistence - em.activation_decay, em.activation_max)))
+
+        em.update_activation_terms(elapsed)
 
     def update(self, elapsed):
         """ Update all emotion elicitors and processes, and arbitrate their activation """
-        
-        for em in self.emotions:
-            em.update(elapsed)
+        self.active_releasers = [rel for rel in self.robot.perception_system.releasers if rel.is_active()]
+
+        # Emotions only need to be recomputed when the affect of the active releasers changes
+        self.affect_key = tuple((rel.handle, rel.affect) for rel in self.active_releasers)
+
+        for em in self.robot.registry.update_order('emotion'):
+            em.evaluate(elapsed)
 
         new_active = max(self.emotions, key=operator.attrgetter('activation_level'))
 
@@ -0,0 +1,52 @@
+class Incremental(object):
+    """ Mixin for components that can skip their update when nothing they read has changed
+
+    `input_key` returns a hashable summary of everything the update reads
+    from outside the component (or None when it must always run), and
+    `state_key` summarizes the component's own state. Once an update leaves
+    the state unchanged, the component is clean: later evaluations with the
+    same input key reuse the cached result until an input (or the state
+    itself, from outside the update) changes.
+    """
+    update_count = 0
+    skip_count = 0
+
+    _clean = False
+    _last_input_key = None
+    _last_state_key = None
+
+    def input_key(self):
+        return None
+
+    def state_key(self):
+        return None
+
+    def mark_dirty(self):
+        """ Forces the next evaluation to run the update """
+        self._clean = False
+
+    def can_skip(self, key, state):
+        """ Returns whether an update with the given input key, from the given state, would change nothing """
+        return key is not None and self._clean and key == self._last_input_key and state == self._last_state_key
+
+    def record_update(self, key, state):
+        """ Notes that the update ran with the given input key, starting from the given state """
+        self.update_count += 1
+
+        after = self.state_key()
+        self._clean = key is not None and after == state
+        self._last_input_key = key
+        self._last_state_key = after
+
+    def evaluate(self, elapsed):
+        """ Runs the update unless the component is clean, returning whether it ran """
+        key = self.input_key()
+        state = self.state_key()
+
+        if self.can_skip(key, state):
+            self.skip_count += 1
+            return False
+
+        self.update(elapsed)
+        self.record_update(key, state)
+        return True
@@ -0,0 +1,100 @@
+from . import system
+
+from collections import deque
+import time
+
+class LatencyHistogram(object):
+    """ Rolling window of latency samples (in seconds) that can be queried for percentiles """
+
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.max = 0
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction, sorted_samples=None):
+        """ Returns the sample at the given fraction (0-1) of the rolling window """
+        sorted_samples = sorted_samples or sorted(self.samples)
+        if not sorted_samples:
+            return None
+
+        index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+        return sorted_samples[index]
+
+    def summary(self):
+        """ Returns p50/p95/p99/max of the rolling window, plus the all-time max and count """
+        sorted_samples = sorted(self.samples)
+
+        return {
+            'count': self.count,
+            'p50': self.percentile(0.50, sorted_samples),
+            'p95': self.percentile(0.95, sorted_samples),
+            'p99': self.percentile(0.99, sorted_samples),
+            'max': sorted_samples[-1] if sorted_samples else None,
+            'max_ever': self.max,
+        }
+
+
+class TickInstrumentation(system.System):
+    """ Records the wall time spent in each section of every tick
+
+    Emits `tick-overrun` whenever a tick exceeds the budget, and `tick-stats`
+    with the current summary every `report_interval` seconds of robot time.
+    """
+
+    def __init__(self, robot, budget=0.03, window=1000, report_interval=10):
+        super().__init__(robot)
+
+        self.timer = time.perf_counter
+        self.budget = budget
+        self.window = window
+        self.report_interval = report_interval
+
+        self.histograms = {}
+        self.tick_count = 0
+        self.overrun_count = 0
+
+        self.tick_start = None
+        self.last_report = robot.clock.now()
+
+    def histogram(self, name):
+        """ Returns the histogram for a section, creating it on first use """
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = LatencyHistogram(self.window)
+        return hist
+
+    def record(self, name, seconds):
+        self.histogram(name).record(seconds)
+
+    def begin_tick(self):
+        self.tick_start = self.timer()
+
+    def end_tick(self):
+        duration = self.timer() - self.tick_start
+        self.record('tick', duration)
+        self.tick_count += 1
+
+        if duration > self.budget:
+            self.overrun_count += 1
+            self.emit('tick-overrun', duration)
+
+        now = self.robot.clock.now()
+        if now - self.last_report >= self.report_interval:
+            self.last_report = now
+            self.emit('tick-stats', self.summary())
+
+    def summary(self):
+        """ Returns the tick counters and the latency summary of every section """
+        return {
+            'ticks': self.tick_count,
+            'overruns': self.overrun_count,
+            'budget': self.budget,
+            'sections': {name: hist.summary() for name, hist in list(self.histograms.items())},
+            'evaluations': self.robot.registry.evaluation_counts(),
+        }
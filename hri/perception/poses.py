@@ -0,0 +1,256 @@
+import numpy as np
+
+ESTIMATORS = ('window', 'ewma')
+
+class PoseStore(object):
+    """ Recent positions and timestamps of every stimulus, in shared NumPy ring buffers
+
+    Each stimulus owns a slot, which holds its last `capacity` positions
+    (x, y, z in mm) and the times they were detected at. Only floats are
+    stored, so no SDK objects are kept alive, and the kinematics of many
+    slots are computed together in a single pass. Slots are reused once
+    released, and the store doubles in size when it runs out of them.
+
+    The length of the path through each slot's window is kept as a running
+    sum, updated as positions enter and leave the window, so the average
+    speed over the window costs constant time per appended position
+    whatever the capacity. The sums are recomputed from the window every
+    `capacity` evictions so that rounding errors don't accumulate. A slot
+    has no speed until it holds `min_samples` positions (the capacity by
+    default; lower it to get an estimate before the window fills).
+
+    With the 'ewma' estimator, the speed is instead an exponentially
+    weighted moving average of the speeds between consecutive positions,
+    kept as one running value per slot. Each sample is weighted by how much
+    time it covers relative to `time_constant` (in seconds), so the
+    smoothing doesn't depend on the update rate. A speed is available from
+    the second position onwards.
+    """
+
+    def __init__(self, capacity=10, slots=16, min_samples=None, estimator='window', time_constant=0.3):
+        if estimator not in ESTIMATORS:
+            raise ValueError('Unknown speed estimator {!r}, expected one of {}'.format(estimator, ', '.join(ESTIMATORS)))
+
+        self.capacity = capacity
+        self.min_samples = max(2, min_samples or capacity)
+        self.estimator = estimator
+        self.time_constant = time_constant
+
+        self.positions = np.zeros((slots, capacity, 3))
+        self.times = np.zeros((slots, capacity))
+        self.heads = np.zeros(slots, int)
+        self.counts = np.zeros(slots, int)
+
+        # The distance from the previous position to each position, and their sum over each window
+        self.segments = np.zeros((slots, capacity))
+        self.path_lengths = np.zeros(slots)
+        self.evictions = np.zeros(slots, int)
+
+        # The exponentially weighted speed of each slot, NaN until it has one
+        self.smoothed_speeds = np.full(slots, np.nan)
+
+        self.free = list(range(slots - 1, -1, -1))
+
+    def allocate(self):
+        """ Returns an empty slot """
+        if not self.free:
+            self._grow()
+
+        slot = self.free.pop()
+        self.clear(slot)
+        return slot
+
+    def release(self, slot):
+        self.clear(slot)
+        self.free.append(slot)
+
+    def clear(self, slot):
+        """ Empties a slot (or an array of slots) """
+        self.heads[slot] = 0
+        self.counts[slot] = 0
+        self.path_lengths[slot] = 0
+        self.evictions[slot] = 0
+        self.smoothed_speeds[slot] = np.nan
+
+    def _grow(self):
+        slots = len(self.heads)
+        for name in ('positions', 'times', 'heads', 'counts', 'segments', 'path_lengths', 'evictions'):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+        self.smoothed_speeds = np.concatenate([self.smoothed_speeds, np.full(slots, np.nan)])
+        self.free.extend(range(2 * slots - 1, slots - 1, -1))
+
+    def append(self, slot, x, y, z, time):
+        """ Records a position, overwriting the oldest once the slot is full, and returns the slot's speed or None """
+        capacity = self.capacity
+        head = int(self.heads[slot])
+        count = int(self.counts[slot])
+
+        if count:
+            px, py, pz = self.positions[slot, head - 1]
+            dx = x - px
+            dy = y - py
+            dz = z - pz
+            segment = np.sqrt(dx*dx + dy*dy + dz*dz)
+            interval = time - self.times[slot, head - 1]
+        else:
+            segment = 0.0
+            interval = 0.0
+
+        path_length = self.path_lengths[slot] + segment
+        evicted = count == capacity
+        if evicted:
+            # The segment from the overwritten position to the next oldest leaves the window
+            path_length -= self.segments[slot, (head + 1) % capacity]
+            self.evictions[slot] += 1
+
+        self.positions[slot, head] = (x, y, z)
+        self.times[slot, head] = time
+        self.segments[slot, head] = segment
+        self.heads[slot] = head = (head + 1) % capacity
+        self.counts[slot] = count = min(count + 1, capacity)
+
+        if evicted and self.evictions[slot] % capacity == 0:
+            path_length = self._path_length(slot, head)
+        self.path_lengths[slot] = path_length
+
+        if self.estimator == 'ewma':
+            speed = self.smoothed_speeds[slot]
+            if interval > 0:
+                sample = segment / interval
+                speed = sample if np.isnan(speed) else speed + (1 - np.exp(-interval / self.time_constant)) * (sample - speed)
+                self.smoothed_speeds[slot] = speed
+            return None if np.isnan(speed) else float(speed)
+
+        duration = time - self.times[slot, (head - count) % capacity]
+        if count < self.min_samples or not duration > 0:
+            return None
+        return max(0.0, float(path_length / duration))
+
+    def append_many(self, slots, positions, time):
+        """ Records a position (n, 3) in each of the distinct slots, all at the same time, exactly as `append` would """
+        capacity = self.capacity
+        slots = np.asarray(slots, int)
+        heads = self.heads[slots]
+        counts = self.counts[slots]
+
+        dx, dy, dz = np.moveaxis(positions - self.positions[slots, heads - 1], -1, 0)
+        segments = np.where(counts > 0, np.sqrt(dx*dx + dy*dy + dz*dz), 0.0)
+        intervals = np.where(counts > 0, time - self.times[slots, heads - 1], 0.0)
+
+        full = counts == capacity
+        path_lengths = self.path_lengths[slots] + segments
+        path_lengths = np.where(full, path_lengths - self.segments[slots, (heads + 1) % capacity], path_lengths)
+        self.evictions[slots] += full
+
+        self.positions[slots, heads] = positions
+        self.times[slots, heads] = time
+        self.segments[slots, heads] = segments
+        self.heads[slots] = heads = (heads + 1) % capacity
+        self.counts[slots] = counts = np.minimum(counts + 1, capacity)
+
+        evictions = self.evictions[slots]
+        resummed = full & (evictions % capacity == 0)
+        if resummed.any():
+            path_lengths = np.where(resummed, self._path_length(slots, heads), path_lengths)
+        self.path_lengths[slots] = path_lengths
+
+        if self.estimator == 'ewma':
+            speeds = self.smoothed_speeds[slots]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                samples = segments / intervals
+                smoothed = speeds + (1 - np.exp(-intervals / self.time_constant)) * (samples - speeds)
+            smoothed = np.where(np.isnan(speeds), samples, smoothed)
+            self.smoothed_speeds[slots] = np.where(intervals > 0, smoothed, speeds)
+
+    def _path_length(self, slots, heads):
+        """ Sums the segments of each full window, oldest first, leaving out the oldest position's own """
+        path_length = 0.0
+        for i in range(1, self.capacity):
+            path_length = path_length + self.segments[slots, (heads + i) % self.capacity]
+        return path_length
+
+    def count(self, slot):
+        return int(self.counts[slot])
+
+    def history(self, slot):
+        """ Returns the slot's positions and times, oldest first """
+        order = (self.heads[slot] - self.counts[slot] + np.arange(self.counts[slot])) % self.capacity
+        return self.positions[slot, order], self.times[slot, order]
+
+    def window(self, slots):
+        """ Returns the positions (n, capacity, 3) and times (n, capacity) of the slots
+
+        Samples are oldest first and aligned to the end of the window, with
+        NaN in place of the samples that a slot doesn't have yet.
+        """
+        slots = np.asarray(slots, int)
+        counts = self.counts[slots]
+        offsets = np.arange(self.capacity) - self.capacity
+        order = (self.heads[slots, None] + offsets) % self.capacity
+        valid = offsets >= -counts[:, None]
+
+        positions = np.where(valid[:, :, None], self.positions[slots[:, None], order], np.nan)
+        times = np.where(valid, self.times[slots[:, None], order], np.nan)
+        return positions, times
+
+    def speeds(self, slots):
+        """ Returns the speed (mm/s) of each slot as its estimator gives it, NaN where there is none yet
+
+        The window estimator averages over the slot's window, and needs
+        `min_samples` positions.
+        """
+        slots = np.asarray(slots, int)
+        if self.estimator == 'ewma':
+            return self.smoothed_speeds[slots]
+
+        heads = self.heads[slots]
+        counts = self.counts[slots]
+        durations = self.times[slots, (heads - 1) % self.capacity] - self.times[slots, (heads - counts) % self.capacity]
+        ready = (counts >= self.min_samples) & (durations > 0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(ready, np.maximum(0, self.path_lengths[slots] / durations), np.nan)
+
+    def velocities(self, slots):
+        """ Returns each slot's displacement over its window divided by the window's duration (n, 3) """
+        first, last, duration = self._ends(slots)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (last[0] - first[0]) / duration[:, None]
+
+    def accelerations(self, slots):
+        """ Returns the change between the velocities over each half of each slot's window (n, 3) """
+        positions, times = self.window(slots)
+        counts = self.counts[np.asarray(slots, int)]
+
+        # Split each window at its middle sample
+        rows = np.arange(len(counts))
+        start = np.minimum(self.capacity - counts, self.capacity - 1)
+        middle = np.minimum(self.capacity - (counts + 1) // 2, self.capacity - 1)
+        end = np.full(len(counts), self.capacity - 1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            early = (positions[rows, middle] - positions[rows, start]) / (times[rows, middle] - times[rows, start])[:, None]
+            late = (positions[rows, end] - positions[rows, middle]) / (times[rows, end] - times[rows, middle])[:, None]
+            midpoints = (times[rows, end] - times[rows, start]) / 2
+
+            return np.where((counts >= 3)[:, None], (late - early) / midpoints[:, None], np.nan)
+
+    def headings(self, slots):
+        """ Returns the direction of each slot's displacement over its window, in radians from the x axis """
+        first, last, duration = self._ends(slots)
+        delta = last[0] - first[0]
+
+        return np.where(duration > 0, np.arctan2(delta[:, 1], delta[:, 0]), np.nan)
+
+    def _ends(self, slots):
+        """ Returns the oldest and newest (positions, times) of each slot, and the time between them """
+        positions, times = self.window(slots)
+        counts = self.counts[np.asarray(slots, int)]
+        rows = np.arange(len(counts))
+        start = np.minimum(self.capacity - counts, self.capacity - 1)
+
+        first = (positions[rows, start], times[rows, start])
+        last = (positions[:, -1], times[:, -1])
+        return first, last, last[1] - first[1]
@@ -1,6 +1,11 @@
-class Releaser(object):
+from .. import incremental
+
+class Releaser(incremental.Incremental):
     """ Represents a releaser process in the perception system """
     name = 'releaser'
+    reads = ()
+    affect_base = (0, 0, 0)
+    affect_growth = 5
 
     def __init__(self, perception_system):
         self.perception_system = perception_system
@@ -13,6 +18,18 @@ class Releaser(object):
 
     def is_active(self):
         return self.activation_level >= self.activation_threshold
+
+    def state_key(self):
+        return (self.activation_level, self.affect, self.active_duration)
+
+    def stimulus(self):
+        """ Returns the stimulus that the releaser responds to, or None if it doesn't respond to one """
+        return None
+
+    def compute_affect(self):
+        """ Computes the affect, which grows in magnitude the longer the releaser is active """
+        growth = self.active_duration * self.affect_growth
+        return tuple(base - growth if base < 0 else base + growth for base in self.affect_base)
     
     def update(self, elapsed):
         """ Computes the activation level and affect for the releaser """
@@ -30,34 +47,41 @@ class AbsenceOfDesiredStimulusReleaser(Releaser):
     
     """
     name = 'absence-of-desired-stimulus-releaser'
+    reads = ('drive',)
+    affect_base = (-500, -500, -500)
+
+    def stimulus(self):
+        return self.perception_system.desired_stimulus
+
+    def input_key(self):
+        drive = self.perception_system.active_drive
+        if drive.name == 'rest-drive':
+            return (drive.name,)
+
+        # While the stimulus is absent, the activation grows with its disappearance duration
+        stimulus = self.perception_system.desired_stimulus
+        if stimulus and stimulus.detected:
+            return (drive.name, True)
+        return None
 
     def update(self, elapsed):
-        drive = self.perception_system.robot.drive_system.active_drive
-        stimulus = None
+        drive = self.perception_system.active_drive
+        stimulus = self.perception_system.desired_stimulus
 
         # Don't operate on the rest-drive
         if drive.name == 'rest-drive':
             return
 
-        # Find the first appropriate stimulus for this type
-        for id, stim in self.perception_system.stimuli.items():
-            if drive.name == 'solo-drive':
-                if stim.type == 'toy-stimulus':
-                    stimulus = stim
-                    break
-            elif drive.name == 'social-drive':
-                if stim.type == 'face-stimulus':
-                    stimulus = stim
-                    break
-
         if not (stimulus and stimulus.detected):
-            self.activation_level = self.activation_threshold + 5 * stimulus.disappearance_duration
+            # With no stimulus of the desired type yet, it has been absent since perception started
+            disappearance_duration = stimulus.disappearance_duration if stimulus else self.perception_system.uptime
+            self.activation_level = self.activation_threshold + 5 * disappearance_duration
         else:
             self.activation_level = 0
 
         if self.is_active():
             self.active_duration += 0 #elapsed
-            self.affect = (-500 - (self.active_duration*5), -500 - (self.active_duration*5), -500 - (self.active_duration*5))
+            self.affect = self.compute_affect()
         else:
             self.active_duration = 0
             self.affect = None
@@ -74,26 +98,31 @@ class DesiredStimulusReleaser(Releaser):
     
     """
     name = 'desired-stimulus-releaser'
+    reads = ('drive',)
+    affect_base = (1000, 1000, 500)
+
+    def stimulus(self):
+        return self.perception_system.desired_stimulus
+
+    def input_key(self):
+        drive = self.perception_system.active_drive
+        if drive.name == 'rest-drive':
+            return (drive.name,)
+
+        # While the stimulus is present, the activation grows with its detection duration
+        stimulus = self.perception_system.desired_stimulus
+        if stimulus and stimulus.detected:
+            return None
+        return (drive.name, False)
 
     def update(self, elapsed):
-        drive = self.perception_system.robot.drive_system.active_drive
-        stimulus = None
+        drive = self.perception_system.active_drive
+        stimulus = self.perception_system.desired_stimulus
 
         # Don't operate on the rest-drive
         if drive.name == 'rest-drive':
             return
 
-        # Find the first appropriate stimulus for this type
-        for id, stim in self.perception_system.stimuli.items():
-            if drive.name == 'solo-drive':
-                if stim.type == 'toy-stimulus':
-                    stimulus = stim
-                    break
-            elif drive.name == 'social-drive':
-                if stim.type == 'face-stimulus':
-                    stimulus = stim
-                    break
-
         if stimulus and stimulus.detected:
             self.activation_level = self.activation_threshold + 5 * stimulus.detection_duration
         else:
@@ -101,7 +130,7 @@ class DesiredStimulusReleaser(Releaser):
 
         if self.is_active():
             self.active_duration += 0 #elapsed
-            self.affect = (1000 + (self.active_duration*5), 1000 + (self.active_duration*5), 500 + (self.active_duration*5))
+            self.affect = self.compute_affect()
         else:
             self.active_duration = 0
             self.affect = None
@@ -118,32 +147,40 @@ class UndesiredStimulusReleaser(Releaser):
     
     """
     name = 'undesired-stimulus-releaser'
+    reads = ('drive',)
+    affect_base = (-250, -1000, -500)
+
+    def stimulus(self):
+        return self.perception_system.undesired_stimulus
+
+    def input_key(self):
+        drive = self.perception_system.active_drive
+        if drive.name == 'rest-drive':
+            return (drive.name,)
+
+        stimulus = self.perception_system.desired_stimulus
+        if stimulus and stimulus.detected:
+            return (drive.name, True)
+
+        # While another stimulus is present, the activation grows with its detection duration
+        if self.perception_system.undesired_stimulus:
+            return None
+        return (drive.name, False)
 
     def update(self, elapsed):
-        drive = self.perception_system.robot.drive_system.active_drive
-        stimulus = None
+        drive = self.perception_system.active_drive
+        stimulus = self.perception_system.desired_stimulus
 
         # Don't operate on the rest-drive
         if drive.name == 'rest-drive':
             return
 
-        # Find the first appropriate stimulus for this type
-        for id, stim in self.perception_system.stimuli.items():
-            if drive.name == 'solo-drive':
-                if stim.type == 'toy-stimulus':
-                    stimulus = stim
-                    break
-            elif drive.name == 'social-drive':
-                if stim.type == 'face-stimulus':
-                    stimulus = stim
-                    break
-
         # If the stimulus this drive expects was detected, then we will not activate
         if stimulus and stimulus.detected:
             self.activation_level = 0
         else:
             # If the expected stimulus didn't exist, but at least one was found, activate
-            stimulus = next(iter([stimulus for id, stimulus in self.perception_system.stimuli.items() if stimulus.detected] or []), None)
+            stimulus = self.perception_system.undesired_stimulus
 
             if stimulus:
                 self.activation_level = self.activation_threshold + 5 * stimulus.detection_duration
@@ -152,7 +189,7 @@ class UndesiredStimulusReleaser(Releaser):
 
         if self.is_active():
             self.active_duration += 0 #elapsed
-            self.affect = (-250 - (self.active_duration*5), -1000 - (self.active_duration*5), -500 - (self.active_duration*5))
+            self.affect = self.compute_affect()
         else:
             self.active_duration = 0
             self.affect = None
@@ -161,9 +198,15 @@ class UndesiredStimulusReleaser(Releaser):
 class OverwhelmedDriveReleaser(Releaser):
     """ Releaser for detecting if the active drive is overstimulated """
     name = 'overwhelmed-drive-releaser'
+    reads = ('drive',)
+    affect_base = (1000, -500, -500)
+
+    def input_key(self):
+        drive = self.perception_system.active_drive
+        return (drive.name, drive.drive_level if drive.is_overwhelmed() else False)
 
     def update(self, elapsed):
-        drive = self.perception_system.robot.drive_system.active_drive
+        drive = self.perception_system.active_drive
         
         if drive.is_overwhelmed():
             overwhelmed_amount = drive.range_overwhelmed[1] - drive.drive_level
@@ -174,7 +217,7 @@ class OverwhelmedDriveReleaser(Releaser):
 
         if self.is_active():
             self.active_duration += 0 #elapsed
-            self.affect = (1000 + (self.active_duration*5), -500 - (self.active_duration*5), -500 - (self.active_duration*5))
+            self.affect = self.compute_affect()
         else:
             self.active_duration = 0
             self.affect = None
@@ -183,9 +226,15 @@ class OverwhelmedDriveReleaser(Releaser):
 class UnderwhelmedDriveReleaser(Releaser):
     """ Releaser for detecting if the active drive is understimulated """
     name = 'underwhelmed-drive-releaser'
+    reads = ('drive',)
+    affect_base = (-1000, -500, -500)
+
+    def input_key(self):
+        drive = self.perception_system.active_drive
+        return (drive.name, drive.drive_level if drive.is_underwhelmed() else False)
 
     def update(self, elapsed):
-        drive = self.perception_system.robot.drive_system.active_drive
+        drive = self.perception_system.active_drive
         
         if drive.is_underwhelmed():
             underwhelmed_amount = drive.drive_level - drive.range_underwhelmed[0]
@@ -196,7 +245,7 @@ class UnderwhelmedDriveReleaser(Releaser):
 
         if self.is_active():
             self.active_duration += 0 #elapsed
-            self.affect = (-1000 - (self.active_duration*5), -500 - (self.active_duration*5), -500 - (self.active_duration*5))
+            self.affect = self.compute_affect()
         else:
             self.active_duration = 0
             self.affect = None
@@ -211,18 +260,27 @@ class ThreateningStimulusReleaser(Releaser):
     
     """
     name = 'threatening-stimulus-releaser'
+    affect_base = (1000, -1000, -1000)
 
-    def update(self, elapsed):
-        stimulus = None
+    def find_threatening_stimulus(self):
+        """ Returns the first detected stimulus that is moving faster than its type's threshold """
+        for type, detected in self.perception_system.detected_by_type.items():
+            for id, stim in detected.items():
+                if stim.threatening_speed is not None and (stim.average_speed or 0) > stim.threatening_speed:
+                    return stim
+        return None
 
-        # Find the first stimulus that is above threshold
-        for id, stim in self.perception_system.stimuli.items():
-            if stim.detected and stim.type == 'toy-stimulus' and (stim.average_speed or 0) > 100:
-                stimulus = stim
-                break
-            elif stim.detected and stim.type == 'face-stimulus' and (stim.average_speed or 0) > 300:
-                stimulus = stim
-                break
+    def stimulus(self):
+        return self.find_threatening_stimulus()
+
+    def input_key(self):
+        # While a stimulus is threatening, the activation keeps changing
+        if self.find_threatening_stimulus():
+            return None
+        return ()
+
+    def update(self, elapsed):
+        stimulus = self.find_threatening_stimulus()
 
         # If a stimulus is above threshold
         if stimulus and stimulus.detected:
@@ -241,7 +299,7 @@ class ThreateningStimulusReleaser(Releaser):
 
         if self.is_active():
             self.active_duration += 0 #elapsed
-            self.affect = (1000 + (self.active_duration*5), -1000 - (self.active_duration*5), -1000 - (self.active_duration*5))
+            self.affect = self.compute_affect()
         else:
             self.active_duration = 0
             self.affect = None
\ No newline at end of file
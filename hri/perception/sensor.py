@@ -1,16 +1,40 @@
+from collections import OrderedDict
 import random
 import math
 
 from . import stimulus
+from .. import simulation
 
 class Vision(object):
-    """ Interacts with the vision sensor and records stimuli """
+    """ Interacts with the vision sensor and records stimuli
+
+    Every face and object the SDK reports is tracked as its own stimulus,
+    keyed by its face or object id. A stimulus disappears once it hasn't
+    been seen for its type's disappearance timeout, and is forgotten
+    altogether once it hasn't been seen for `stimulus_ttl` seconds, or
+    sooner (least recently seen first) when more than `max_stimuli` are
+    tracked.
+    """
 
     def __init__(self, perception_system):
         self.perception_system = perception_system
 
         self.face_disappearance_timeout = 3 # seconds
         self.toy_disappearance_timeout = 3 # seconds
+        self.stimulus_ttl = 60 # seconds
+        self.max_stimuli = 32
+
+        # Remaining disappearance timeouts of the stimuli that are detected
+        self.disappearance_timeouts = {}
+
+        # When each stimulus was last seen, least recently seen first
+        self.last_seen = OrderedDict()
+
+        # Optional replay.InputRecorder that is given what the SDK reports every update
+        self.recorder = None
+
+        # Simulated faces and toys, seen along with what the SDK reports, for testing
+        self.test_entities = {'face': [], 'toy': []}
 
         # For testing!
         self.test_face_target = random.randint(-100, 100)
@@ -18,31 +42,75 @@ class Vision(object):
         self.test_toy_target = random.randint(-100, 100)
         self.test_toy_current = 0
 
+    def see(self, stimulus_class, id, detected_object, timeout, elapsed, now):
+        """ Detects the stimulus with the given id, creating it when it is first seen """
+        stim = self.perception_system.stimuli.get(id)
+        if stim is None:
+            stim = stimulus_class(self.perception_system, id)
+            self.perception_system.add_stimulus(stim)
+
+        self.disappearance_timeouts[id] = timeout
+        self.last_seen[id] = now
+        self.last_seen.move_to_end(id)
+
+        stim.detect(detected_object, elapsed)
+        return id
+
+    def evict(self, now):
+        """ Forgets the least recently seen stimuli that are expired or over the limit """
+        while self.last_seen:
+            id, last_seen = next(iter(self.last_seen.items()))
+            stim = self.perception_system.stimuli[id]
+
+            if stim.detected or (now - last_seen < self.stimulus_ttl and len(self.last_seen) <= self.max_stimuli):
+                break
+
+            del self.last_seen[id]
+            self.disappearance_timeouts.pop(id, None)
+            self.perception_system.remove_stimulus(stim)
+
     def update(self, elapsed):
         robot = self.perception_system.robot
         cozmo = robot.cozmo
+        now = robot.clock.now()
+        seen = set()
 
-        # If the robot sees any faces, mark 'face-1' as detected:
-        first_face = next(cozmo.world.visible_faces, None)
-        if first_face:
-            self.face_disappearance_timeout = 3
-            self.perception_system.stimuli['face-1'].detect(first_face, elapsed)
-        else:
-            self.face_disappearance_timeout -= elapsed
-            if self.face_disappearance_timeout <= 0:
-                self.perception_system.stimuli['face-1'].disappear()
-
-        # If the robot sees any blocks, mark 'face-1' as detected:
-        first_block = next(cozmo.world.visible_objects, None)
-        if first_block:
-            self.toy_disappearance_timeout = 3
-            self.perception_system.stimuli['toy-1'].detect(first_block, elapsed)
-        else:
-            self.toy_disappearance_timeout -= elapsed
-            if self.toy_disappearance_timeout <= 0:
-                self.perception_system.stimuli['toy-1'].disappear()
+        faces = list(cozmo.world.visible_faces) + self.test_entities['face']
+        blocks = list(cozmo.world.visible_objects) + self.test_entities['toy']
+
+        if self.recorder:
+            self.recorder.record_inputs(faces, blocks)
+
+        # Mark each face and block the robot sees as detected
+        for face in faces:
+            seen.add(self.see(stimulus.FaceStimulus, 'face-{}'.format(face.face_id), face, self.face_disappearance_timeout, elapsed, now))
+
+        for block in blocks:
+            seen.add(self.see(stimulus.ToyStimulus, 'toy-{}'.format(block.object_id), block, self.toy_disappearance_timeout, elapsed, now))
+
+        # Stimuli that are no longer seen disappear once their timeout runs out
+        for id in [id for id in self.disappearance_timeouts if id not in seen]:
+            self.disappearance_timeouts[id] -= elapsed
+            if self.disappearance_timeouts[id] <= 0:
+                del self.disappearance_timeouts[id]
+                self.perception_system.stimuli[id].disappear()
+
+        self.evict(now)
 
-        pass
+    def set_test_stimulus(self, type, visible):
+        """ Shows or hides the simulated 'face' or 'toy', which is seen (and disappears) like a real one
+
+        The list is replaced rather than changed, so this can be called from
+        another thread than the one updating the robot.
+        """
+        if not visible:
+            self.test_entities[type] = []
+        elif not self.test_entities[type]:
+            entity = simulation.SimulatedEntity(face_id=0) if type == 'face' else simulation.SimulatedEntity(object_id=0)
+            self.test_entities[type] = [entity]
+
+    def toggle_test_stimulus(self, type):
+        self.set_test_stimulus(type, not self.test_entities[type])
 
     def test_update(self, elapsed):
         """ Generate random detections and disappearances for a stimulus """
@@ -66,12 +134,5 @@ class Vision(object):
             self.test_toy_current -= delta_toy
 
         # Generate events based upon this smooth randomness
-        if self.test_face_current > 0:
-            self.perception_system.stimuli['face-1'].detect()
-        else:
-            self.perception_system.stimuli['face-1'].disappear()
-
-        if self.test_toy_current > 0:
-            self.perception_system.stimuli['toy-1'].detect()
-        else:
-            self.perception_system.stimuli['toy-1'].disappear()
\ No newline at end of file
+        self.set_test_stimulus('face', self.test_face_current > 0)
+        self.set_test_stimulus('toy', self.test_toy_current > 0)
@@ -1,12 +1,9 @@
 from . import system
 
-from collections import deque
-from timeit import default_timer as timeit
-import math
-
 class Stimulus(object):
     """ Represents a perceivable stimulus """
     type = 'stimulus'
+    threatening_speed = None
 
     def __init__(self, perception_system, id):
         self.perception_system = perception_system
@@ -14,56 +11,47 @@ class Stimulus(object):
         self.id = id
         self.detected = False
         self.detected_object = None
-        self.last_detected_poses = deque(maxlen=10)
-        self.last_detected_elapsed = deque(maxlen=9)
+        self.pose_slot = perception_system.pose_store.allocate()
+
+        # As estimated by the pose store from the detected poses, while detected
         self.average_speed = None
         
         self.last_detection = None
         self.detection_duration = 0
 
+        # A stimulus that has never been detected has been absent since perception started
         self.last_disappearance = None
-        self.disappearance_duration = 0
-
-    def compute_distance(self, posA, posB):
-        return math.sqrt((posB.x - posA.x)**2 + (posB.y - posA.y)**2 + (posB.y - posA.y)**2)
-
-    def compute_average_speed(self):
-        total_distance = 0
-        total_time = 0
+        self.disappearance_duration = perception_system.uptime
 
-        # Wait until the poses are filled out
-        if len(self.last_detected_poses) != self.last_detected_poses.maxlen:
-            return None
-
-        for i in range(self.last_detected_elapsed.maxlen):
-            total_distance += self.compute_distance(self.last_detected_poses[i].position, self.last_detected_poses[i+1].position)
-            total_time += self.last_detected_elapsed[i]
-
-        return total_distance / total_time
+    def pose_history(self):
+        """ Returns the recently detected positions (n, 3) and their times, oldest first """
+        return self.perception_system.pose_store.history(self.pose_slot)
 
     def detect(self, detected_object, elapsed):
         """ Update the detection attributes """
+        position = detected_object.pose.position
+        position = (position.x, position.y, position.z)
+
         self.detected_object = detected_object
-        self.last_detected_poses.append(detected_object.pose)
-        self.last_detected_elapsed.append(elapsed)
-        self.average_speed = self.compute_average_speed()
+        self.average_speed = self.perception_system.pose_store.append(self.pose_slot, *position, self.perception_system.uptime)
 
         if not self.detected:
             self.detected = True
-            self.last_detection = timeit()
+            self.last_detection = self.perception_system.robot.clock.now()
             self.detection_duration = 0
+            self.perception_system.index_detected(self)
             self.perception_system.emit('stimulus-detected', self)
 
     def disappear(self):
         """ Update the disappearance attributes """
         if self.detected:
             self.detected = False
-            self.last_disappearance = timeit()
+            self.last_disappearance = self.perception_system.robot.clock.now()
             self.disappearance_duration = 0
             self.detected_object = None
-            self.last_detected_poses.clear()
-            self.last_detected_elapsed.clear()
+            self.perception_system.pose_store.clear(self.pose_slot)
             self.average_speed = None
+            self.perception_system.index_disappeared(self)
             self.perception_system.emit('stimulus-disappeared', self)
 
     def update(self, elapsed):
@@ -75,6 +63,8 @@ class Stimulus(object):
 
 class FaceStimulus(Stimulus):
     type = 'face-stimulus'
+    threatening_speed = 300 # mm/s
 
 class ToyStimulus(Stimulus):
-    type = 'toy-stimulus'
\ No newline at end of file
+    type = 'toy-stimulus'
+    threatening_speed = 100 # mm/s
\ No newline at end of file
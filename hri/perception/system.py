@@ -2,18 +2,33 @@ from .. import system
 from . import stimulus
 from . import releaser
 from . import sensor
+from . import poses
+
+import numpy as np
 
 class PerceptionSystem(system.System):
     """ The perception system of the robot, containing sensors, stimuli, and releasers """
+    name = 'perception-system'
+    kind = 'releaser'
 
     def __init__(self, robot):
         super().__init__(robot)
 
-        # Create a stimulus mapping
-        self.stimuli = {
-            'face-1': stimulus.FaceStimulus(self, 'face-1'),
-            'toy-1': stimulus.ToyStimulus(self, 'toy-1'),
-        }
+        # Create a stimulus mapping, indexed by type for all and for detected stimuli.
+        # Stimuli are added by the sensors as they are first perceived
+        self.stimuli = {}
+        self.stimuli_by_type = {}
+        self.detected_by_type = {}
+        self.uptime = 0
+
+        # Recent positions of every stimulus, from which their speeds are estimated (averaged
+        # over the window by default, or smoothed with estimator='ewma')
+        self.pose_store = poses.PoseStore(capacity=10, estimator='window')
+
+        # The context that every releaser reads, computed once per tick
+        self.active_drive = None
+        self.desired_stimulus = None
+        self.undesired_stimulus = None
 
         # Create a list of releasers
         self.releasers = [
@@ -25,25 +40,96 @@ class PerceptionSystem(system.System):
             releaser.OverwhelmedDriveReleaser(self),
         ]
 
+        for rel in self.releasers:
+            robot.registry.register(rel, 'releaser')
+
         # Initialize our sensors
         self.vision = sensor.Vision(self)
 
 
     def get_releaser(self, name):
-        for rel in self.releasers:
-            if rel.name == name:
-                return rel
-        return None
-        
+        return self.robot.registry.get(name)
+
+    def add_stimulus(self, stim):
+        self.stimuli[stim.id] = stim
+        self.stimuli_by_type.setdefault(stim.type, {})[stim.id] = stim
+        self.detected_by_type.setdefault(stim.type, {})
+
+        if stim.detected:
+            self.index_detected(stim)
+
+    def remove_stimulus(self, stim):
+        del self.stimuli[stim.id]
+        del self.stimuli_by_type[stim.type][stim.id]
+        self.detected_by_type[stim.type].pop(stim.id, None)
+        self.pose_store.release(stim.pose_slot)
+        self.emit('stimulus-removed', stim)
+
+    def index_detected(self, stim):
+        self.detected_by_type[stim.type][stim.id] = stim
+
+    def index_disappeared(self, stim):
+        self.detected_by_type[stim.type].pop(stim.id, None)
+
+    def any_detected(self):
+        return any(self.detected_by_type.values())
+
+    def detected_kinematics(self):
+        """ Returns the detected stimuli with their speeds, velocities, accelerations and headings
+
+        The kinematics are computed from the pose store in one pass, as arrays
+        with a row per stimulus (NaN where there are too few poses).
+        """
+        stimuli = [stim for detected in self.detected_by_type.values() for stim in detected.values()]
+        slots = np.array([stim.pose_slot for stim in stimuli], int)
+
+        return stimuli, {
+            'speed': self.pose_store.speeds(slots),
+            'velocity': self.pose_store.velocities(slots),
+            'acceleration': self.pose_store.accelerations(slots),
+            'heading': self.pose_store.headings(slots),
+        }
+
+    def update_context(self):
+        """ Finds the stimuli that the releasers compare against the active drive
+
+        The desired stimulus is the first detected stimulus of the type the
+        active drive is looking for (or the first known one of that type if
+        none is detected, or None if there is none), and the undesired
+        stimulus is the first detected stimulus of another type when the
+        desired one isn't detected.
+        """
+        self.active_drive = self.robot.drive_system.active_drive
+        self.desired_stimulus = None
+        self.undesired_stimulus = None
+
+        desired_type = self.active_drive.desired_stimulus_type
+        if desired_type is None:
+            return
+
+        detected = self.detected_by_type.get(desired_type)
+        known = detected or self.stimuli_by_type.get(desired_type)
+        if known:
+            self.desired_stimulus = next(iter(known.values()))
+
+        if not detected:
+            for type, others in self.detected_by_type.items():
+                if others:
+                    self.undesired_stimulus = next(iter(others.values()))
+                    break
 
     def update(self, elapsed):
+        self.uptime += elapsed
+
         # Update each stimulus
         for id, stim in self.stimuli.items():
             stim.update(elapsed)
 
+        self.update_context()
+
         # Update each releaser
-        for rel in self.releasers:
-            rel.update(elapsed)
+        for rel in self.robot.registry.update_order('releaser'):
+            rel.evaluate(elapsed)
 
         # Update the sensors
         self.vision.update(elapsed)
\ No newline at end of file
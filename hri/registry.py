@@ -0,0 +1,134 @@
+class Registry(object):
+    """ Shared registry of the robot's drives, releasers, emotions and behaviors
+
+    Components are looked up in constant time by name or by the integer
+    handle assigned when they are registered. Each component class lists the
+    names of the components it reads in `reads` (a kind such as 'releaser'
+    stands for every component of that kind). Both the update order within
+    each kind and the order in which the kinds' systems update are derived
+    from those declarations.
+
+    A component that reads another as it was at the end of the previous
+    tick lists it in `reads_previous` instead, which doesn't constrain the
+    order (drives read a releaser that is itself computed from the active
+    drive, for example). Any other cycle between kinds is an error.
+    """
+
+    def __init__(self):
+        self.components = []
+        self.by_name = {}
+        self.by_kind = {}
+        self.kinds = {}
+        self.orders = {}
+
+    def register(self, component, kind):
+        """ Adds the component and returns its handle """
+        if component.name in self.by_name:
+            raise ValueError('Component {} is already registered'.format(component.name))
+
+        component.handle = len(self.components)
+        self.components.append(component)
+        self.by_name[component.name] = component
+        self.by_kind.setdefault(kind, []).append(component)
+        self.kinds[component.name] = kind
+        self.orders.clear()
+
+        return component.handle
+
+    def get(self, key):
+        """ Returns the component with the given name or handle, or None """
+        if isinstance(key, int):
+            return self.components[key] if 0 <= key < len(self.components) else None
+
+        return self.by_name.get(key)
+
+    def of_kind(self, kind):
+        """ Returns the components of a kind, in registration order """
+        return list(self.by_kind.get(kind, []))
+
+    def evaluation_counts(self):
+        """ Returns how many times each component's update ran and was skipped """
+        return {
+            component.name: {'updates': component.update_count, 'skips': component.skip_count}
+            for component in self.components
+        }
+
+    def dependencies(self, component):
+        """ Returns the components that the component declares it reads """
+        dependencies = []
+
+        for key in component.reads:
+            if key in self.by_name:
+                dependencies.append(self.by_name[key])
+            elif key in self.by_kind:
+                dependencies.extend(dep for dep in self.by_kind[key] if dep is not component)
+            else:
+                raise KeyError('{} reads unknown component {}'.format(component.name, key))
+
+        return dependencies
+
+    def kind_order(self):
+        """ Returns the kinds ordered so that each one updates after the other kinds its components read """
+        order = self.orders.get(None)
+
+        if order is None:
+            reads = {kind: set() for kind in self.by_kind}
+            for component in self.components:
+                kind = self.kinds[component.name]
+
+                for key in getattr(component, 'reads_previous', ()):
+                    if key not in self.by_name and key not in self.by_kind:
+                        raise KeyError('{} reads unknown component {}'.format(component.name, key))
+
+                for key in component.reads:
+                    read_kind = key if key in self.by_kind else self.kinds.get(key)
+                    if read_kind is None:
+                        raise KeyError('{} reads unknown component {}'.format(component.name, key))
+                    if read_kind != kind:
+                        reads[kind].add(read_kind)
+
+            remaining = list(self.by_kind)
+            order = []
+
+            while remaining:
+                for kind in remaining:
+                    if reads[kind].issubset(order):
+                        break
+                else:
+                    raise ValueError('Circular reads between the {} components; declare reads of the previous tick in reads_previous'.format(', '.join(remaining)))
+
+                remaining.remove(kind)
+                order.append(kind)
+
+            self.orders[None] = order
+
+        return order
+
+    def update_order(self, kind):
+        """ Returns the components of a kind ordered so that each one updates after those it reads """
+        order = self.orders.get(kind)
+
+        if order is None:
+            order = self.orders[kind] = self._sort(self.by_kind.get(kind, []))
+
+        return order
+
+    def _sort(self, components):
+        """ Topologically sorts the components, keeping registration order where it is free to """
+        members = set(component.handle for component in components)
+        remaining = list(components)
+        updated = set()
+        order = []
+
+        while remaining:
+            for component in remaining:
+                if all(dep.handle in updated or dep.handle not in members for dep in self.dependencies(component)):
+                    break
+            else:
+                raise ValueError('Circular dependency between {}'.format(', '.join(c.name for c in remaining)))
+
+            remaining.remove(component)
+            updated.add(component.handle)
+            order.append(component)
+
+        return order
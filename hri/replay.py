@@ -0,0 +1,249 @@
+""" Recording and deterministic replay of what the robot sees
+
+An InputRecorder captures, every tick, the time, which systems were updated
+and the `elapsed` each was given, the faces and objects that the SDK
+reported to `Vision.update` (ids and positions) if perception ran, and the
+drive, emotion and behavior the robot then chose:
+
+    recorder = replay.InputRecorder('run.replay').attach(robot)
+
+`replay()` feeds a recording through a fresh headless robot (a virtual
+clock, and a SimulatedCozmo in place of the SDK's actions) as fast as it
+can, repeating each tick's recorded updates, and reports the ticks at which
+its decisions differ from the recorded ones. This works the same for runs
+stepped in lockstep and for ticks chosen by the live loop's scheduler:
+
+    python -m hri.replay run.replay
+
+Actions never complete in a replay, so behaviors that wait on their actions'
+callbacks only get as far as their first action.
+"""
+from . import clock
+from . import robot as hrirobot
+from . import simulation
+
+from collections import namedtuple
+import argparse
+import json
+import logging
+import os
+import struct
+import sys
+
+MAGIC = b'HRI-REPLAY 2\n'
+
+# time, update count, face count, object count, active drive, active emotion, active behavior
+TICK_RECORD = struct.Struct('<dBHHhhh')
+
+# index of the updated system, elapsed
+UPDATE_RECORD = struct.Struct('<Bd')
+
+# face or object id, x, y, z
+ENTITY_RECORD = struct.Struct('<qddd')
+
+# The decisions that are compared, as the snapshot field holding the active component and the component kind
+DECISIONS = (
+    ('drive', 'active_drive', 'drives'),
+    ('emotion', 'active_emotion', 'emotions'),
+    ('behavior', 'active_behavior', 'behaviors'),
+)
+
+RecordedTick = namedtuple('RecordedTick', ['time', 'updates', 'faces', 'objects', 'decisions'])
+
+
+def component_names(robot):
+    """ Returns the names of the robot's drives, emotions and behaviors, which decisions are recorded as indexes into """
+    return {
+        'drives': [drive.name for drive in robot.drive_system.drives],
+        'emotions': [em.name for em in robot.emotion_system.emotions],
+        'behaviors': [beh.name for beh in robot.behavior_system.behaviors],
+    }
+
+
+class InputRecorder(object):
+    """ Writes the updates, vision inputs and resulting decisions of every tick to a binary file
+
+    The file starts with a JSON header holding the start time, the system
+    names and the component names, followed by one fixed-size record per
+    tick, each followed by one record per system update and one per visible
+    face and object. Writes are buffered.
+    """
+
+    def __init__(self, path, buffer_size=1024 * 1024):
+        self.path = path
+        self.buffer_size = buffer_size
+
+        self.file = None
+        self.robot = None
+        self.names = None
+        self.indexes = None
+        self.systems = None
+        self.inputs = None
+        self.tick_count = 0
+
+    def attach(self, robot):
+        """ Starts recording the robot's updates, vision inputs and decisions, returning the recorder """
+        self.robot = robot
+        self.names = component_names(robot)
+        self.indexes = {kind: {name: i for i, name in enumerate(names)} for kind, names in self.names.items()}
+        self.systems = {name: i for i, (name, _) in enumerate(robot.systems)}
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.file = open(self.path, 'wb', buffering=self.buffer_size)
+        self.file.write(MAGIC)
+        self.file.write(json.dumps({'start': robot.last_update, 'systems': list(self.systems), 'names': self.names}).encode() + b'\n')
+
+        robot.perception_system.vision.recorder = self
+        robot.recorders.append(self)
+        return self
+
+    def record_inputs(self, faces, objects):
+        """ Called by Vision with the faces and objects the SDK reports """
+        self.inputs = (
+            [(face.face_id,) + position(face) for face in faces],
+            [(obj.object_id,) + position(obj) for obj in objects],
+        )
+
+    def record(self, snapshot):
+        """ Writes the tick's updates and inputs along with the decisions in the snapshot """
+        if self.file is None:
+            return
+
+        # Perception (and so Vision) doesn't run in every tick of the live loop
+        faces, objects = self.inputs or ((), ())
+        self.inputs = None
+
+        updates = self.robot.updates
+        decisions = [self.indexes[kind].get(getattr(snapshot, field), -1) for _, field, kind in DECISIONS]
+        self.file.write(TICK_RECORD.pack(self.robot.last_update, len(updates), len(faces), len(objects), *decisions))
+        for name, elapsed in updates:
+            self.file.write(UPDATE_RECORD.pack(self.systems[name], elapsed))
+        for entity in faces + objects:
+            self.file.write(ENTITY_RECORD.pack(*entity))
+
+        self.tick_count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def position(entity):
+    pos = entity.pose.position
+    return (pos.x, pos.y, pos.z)
+
+
+def read_recording(path):
+    """ Returns the header of a recording and a list of its RecordedTicks, whose updates are (system name, elapsed) """
+    with open(path, 'rb') as f:
+        if f.readline() != MAGIC:
+            raise ValueError('{} is not an input recording'.format(path))
+
+        header = json.loads(f.readline())
+        data = f.read()
+
+    systems = header['systems']
+    ticks = []
+    offset = 0
+
+    # A partially written trailing tick is ignored
+    while offset + TICK_RECORD.size <= len(data):
+        now, update_count, face_count, object_count, *decisions = TICK_RECORD.unpack_from(data, offset)
+        start = offset + TICK_RECORD.size
+        entities_start = start + update_count * UPDATE_RECORD.size
+        end = entities_start + (face_count + object_count) * ENTITY_RECORD.size
+        if end > len(data):
+            break
+
+        updates = [UPDATE_RECORD.unpack_from(data, start + i * UPDATE_RECORD.size) for i in range(update_count)]
+        entities = [ENTITY_RECORD.unpack_from(data, entities_start + i * ENTITY_RECORD.size) for i in range(face_count + object_count)]
+        ticks.append(RecordedTick(now, [(systems[i], elapsed) for i, elapsed in updates], entities[:face_count], entities[face_count:], tuple(decisions)))
+        offset = end
+
+    return header, ticks
+
+
+def show(world_list, entities, tracked, make_entity):
+    """ Makes the simulated world report exactly the recorded entities, reusing one SimulatedEntity per id """
+    del world_list[:]
+
+    for id, x, y, z in entities:
+        entity = tracked.get(id)
+        if entity is None:
+            entity = tracked[id] = make_entity(id)
+        entity.move_to(x, y, z)
+        world_list.append(entity)
+
+
+def replay(path, logger=None):
+    """ Replays a recording through a headless robot and returns where its decisions diverge
+
+    Each tick runs the recorded system updates, with their recorded
+    `elapsed`, on a clock that reads the tick's recorded time. The report holds the number of ticks, how many ticks each decision
+    differed in, and the first tick at which each one differed (with the
+    recorded and replayed component names), or None where it never did.
+    """
+    header, ticks = read_recording(path)
+
+    if logger is None:
+        logger = logging.getLogger('replay')
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+
+    robot = hrirobot.Robot(logger, clock=clock.VirtualClock(header['start']), cozmo=simulation.SimulatedCozmo())
+
+    names = component_names(robot)
+    if names != header['names']:
+        raise ValueError('The recording was made by a robot with different drives, emotions or behaviors')
+
+    tasks = {task.name: task for task in robot.scheduler.tasks}
+    if set(header['systems']) != set(tasks):
+        raise ValueError('The recording was made by a robot with different systems')
+
+    world = robot.cozmo.world
+    faces = {}
+    objects = {}
+
+    divergences = {decision: 0 for decision, _, _ in DECISIONS}
+    first = {decision: None for decision, _, _ in DECISIONS}
+
+    for i, tick in enumerate(ticks):
+        show(world.faces, tick.faces, faces, lambda id: simulation.SimulatedEntity(face_id=id))
+        show(world.objects, tick.objects, objects, lambda id: simulation.SimulatedEntity(object_id=id))
+
+        robot.clock.advance_to(tick.time)
+        robot.run_tick(tick.time, [(tasks[name], elapsed) for name, elapsed in tick.updates])
+        snapshot = robot.snapshots.latest()
+
+        for (decision, field, kind), recorded in zip(DECISIONS, tick.decisions):
+            recorded = names[kind][recorded] if recorded >= 0 else None
+            replayed = getattr(snapshot, field)
+
+            if replayed != recorded:
+                divergences[decision] += 1
+                if first[decision] is None:
+                    first[decision] = {'tick': i, 'time': tick.time, 'recorded': recorded, 'replayed': replayed}
+
+    return {
+        'ticks': len(ticks),
+        'diverged': any(divergences.values()),
+        'divergences': divergences,
+        'first_divergence': first,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a recording of vision inputs and report where the decisions diverge')
+    parser.add_argument('recording', help='Recording written by InputRecorder')
+    args = parser.parse_args(argv)
+
+    report = replay(args.recording)
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+    return 1 if report['diverged'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
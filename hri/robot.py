@@ -2,25 +2,43 @@ from . import drive
 from . import perception
 from . import emotion
 from . import behavior
+from . import instrumentation
+from . import registry
+from . import capture
+from . import archive
+from . import dispatch
+from . import snapshot
+from . import scheduler
+from .clock import Clock
+from . import simulation
 
-import cozmo as cozmosdk
 import threading
 import sys
 import logging
 import asyncio
 import time
 import math
-from timeit import default_timer as timeit
 
 class Robot(object):
     """ Robot class composed of all systems representing the robot's state """
 
-    def __init__(self, logger):
+    def __init__(self, logger, clock=None, cozmo=None, dispatcher=None, recorders=()):
         self.timestamp = math.floor(time.time())
         self.last_image_i = 0
 
         self.logger = logger
-        self.last_update = timeit()
+        self.clock = clock or Clock()
+        self.last_update = self.clock.now()
+        self.update_interval = 0.03
+
+        # Until a real robot connects, the systems act on a simulated one
+        self.cozmo = cozmo or simulation.SimulatedCozmo()
+
+        # Components of every system are registered here as they are created
+        self.registry = registry.Registry()
+
+        # Events emitted by the systems are delivered in a batch at the end of each tick
+        self.dispatcher = dispatcher or dispatch.EventDispatcher(logger=logger)
 
         # Set up the drives
         self.drive_system = drive.DriveSystem(self)
@@ -35,7 +53,44 @@ class Robot(object):
 
         self.behavior_system = behavior.BehaviorSystem(self)
 
-        # Set up the update loop
+        # The systems update in the order that their components' declared reads require
+        systems = {system.kind: system for system in (self.drive_system, self.perception_system, self.emotion_system, self.behavior_system)}
+        self.systems = [(systems[kind].name, systems[kind]) for kind in self.registry.kind_order()]
+
+        # When running against the robot, each system is updated at its own rate
+        rates = {
+            'drive-system': 10,
+            'perception-system': 60,
+            'emotion-system': 1 / self.update_interval,
+            'behavior-system': 1 / self.update_interval,
+        }
+        self.scheduler = scheduler.Scheduler()
+        for name, system in self.systems:
+            self.scheduler.add(name, system, rate=rates[name])
+
+        # The (system name, elapsed) of each update in the latest tick, so that recorders can repeat it
+        self.updates = []
+
+        # The state at the end of each tick is published for readers on other threads
+        self.snapshots = snapshot.SnapshotBuffer()
+
+        # Recorders (such as telemetry.TelemetryRecorder) that record every snapshot
+        self.recorders = list(recorders)
+
+        # Measure how long each part of a tick takes
+        self.instrumentation = instrumentation.TickInstrumentation(self, budget=self.update_interval)
+        self.instrumentation.on('tick-stats', self.on_tick_stats)
+
+        # The latest timing summary, published for readers outside the control loop like the snapshots
+        self.tick_stats = None
+
+        # Camera images are written in the background, but only when the capture policy wants them
+        self.image_writer = capture.ImageWriter(archive.FrameArchiveWriter('run_out_images/run{}'.format(self.timestamp)))
+        self.capture_policy = capture.NewFramePolicy()
+
+        # Set up the update loop; `loop` is the event loop while running as a coroutine
+        self.loop = None
+        self.use_asyncio = False
         self.connected_event = threading.Event()
         self.update_event = threading.Event()
         self.update_thread = threading.Thread(target=self.robot_thread)
@@ -54,36 +109,225 @@ class Robot(object):
         new_id = new_emotion.name if new_emotion else '(none)'
         self.logger.info('Emotion changed from {} to {}'.format(previous_id, new_id))
 
-    def start(self, use_cozmo = False):
+    def on_tick_stats(self, stats):
+        # The summary is a new dict every report, which is never changed once emitted
+        self.tick_stats = stats
+
+        tick = stats['sections']['tick']
+        self.logger.debug('Tick p50 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms ({} of {} ticks over budget)'.format(
+            tick['p50'] * 1000, tick['p99'] * 1000, tick['max'] * 1000, stats['overruns'], stats['ticks']))
+
+        evaluations = stats['evaluations'].values()
+        skips = sum(counts['skips'] for counts in evaluations)
+        total = skips + sum(counts['updates'] for counts in evaluations)
+        if total:
+            self.logger.debug('Skipped {} of {} component updates ({:.0f}%)'.format(skips, total, 100 * skips / total))
+
+        events = self.dispatcher.stats()
+        if events['listeners']:
+            name, slowest = max(events['listeners'].items(), key=lambda item: item[1]['p99'])
+            self.logger.debug('Events: {} delivered, {} errors, {} queued, slowest listener {} p99 {:.1f}ms'.format(
+                events['delivered'], events['errors'], events['queue_depth'], name, slowest['p99'] * 1000))
+
+        missed = ['{} {}'.format(name, task['misses']) for name, task in self.scheduler.stats().items() if task['misses']]
+        if missed:
+            self.logger.debug('Deadline misses: {}'.format(', '.join(missed)))
+
+        images = self.image_writer.stats()
+        if images['submitted']:
+            self.logger.debug('Images: {} written, {} dropped, {} errors, {} queued, write p99 {:.1f}ms'.format(
+                images['written'], images['dropped'], images['errors'], images['queue_depth'], (images['write']['p99'] or 0) * 1000))
+
+    def start(self, use_cozmo = False, use_asyncio = False):
+        """ Runs the control loop on the update thread, as a coroutine on that thread's event loop when `use_asyncio` is set """
         self.use_cozmo = use_cozmo
+        self.use_asyncio = use_asyncio
         self.update_thread.start()
 
     def stop(self):
         self.update_event.set()
 
+    def update(self, elapsed):
+        """ Runs the systems' pipeline (drive -> perception -> emotion -> behavior) once """
+        timer = self.instrumentation.timer
+        record = self.instrumentation.record
+        self.updates = [(name, elapsed) for name, _ in self.systems]
+
+        for name, system in self.systems:
+            start = timer()
+            system.update(elapsed)
+            record(name, timer() - start)
+
+    def update_due(self, due):
+        """ Runs the scheduled (task, elapsed) updates, each with the time since that system's last update """
+        timer = self.instrumentation.timer
+        record = self.instrumentation.record
+        self.updates = [(task.name, elapsed) for task, elapsed in due]
+
+        for task, elapsed in due:
+            start = timer()
+            task.system.update(elapsed)
+            record(task.name, timer() - start)
+
+    def step(self, elapsed, now=None):
+        """ Advances the clock by `elapsed` seconds (if it is virtual) and updates the systems without sleeping
+
+        A virtual clock is set to `now` instead when it is given, so that a
+        replayed tick sees exactly the time it was recorded at.
+        """
+        if now is None:
+            self.clock.advance(elapsed)
+        else:
+            self.clock.advance_to(now)
+        self.last_update = self.clock.now()
+
+        self.instrumentation.begin_tick()
+        self.update(elapsed)
+        self.publish_snapshot()
+        self.instrumentation.end_tick()
+
+        self.dispatch_events()
+        self.record_telemetry()
+
+    def run_for(self, seconds, elapsed=0.03):
+        """ Steps the systems through `seconds` of robot time in increments of `elapsed` """
+        remaining = seconds
+
+        while remaining > 1e-9:
+            step_elapsed = min(elapsed, remaining)
+            self.step(step_elapsed)
+            remaining -= step_elapsed
+
     def robot_connected(self, conn):
         if conn:
             self.cozmo = conn.wait_for_robot()
 
-        while not self.update_event.wait(0.03):
-            now = timeit()
-            elapsed = now - self.last_update
-            self.last_update = now
+        self.scheduler.start(self.clock.now())
 
-            # Update the systems
-            self.drive_system.update(elapsed)
-            self.perception_system.update(elapsed)
-            self.emotion_system.update(elapsed)
-            self.behavior_system.update(elapsed)
+        while not self.clock.wait(self.update_event, max(0, self.scheduler.next_deadline() - self.clock.now())):
+            self.tick(self.clock.now())
 
-            # Save the current image
-            if self.cozmo and self.cozmo.world.latest_image:
-                self.cozmo.world.latest_image.raw_image.save('run_out_images/image{}_{}.jpg'.format(self.timestamp, self.last_image_i))
-                self.last_image_i += 1
+        self.shutdown()
+
+    async def robot_connected_async(self, conn):
+        if conn:
+            self.cozmo = await conn.wait_for_robot()
+
+        await self.control_loop()
+
+    async def control_loop(self):
+        """ Runs the systems as a coroutine on the running event loop until `stop()` is called
+
+        This is the same loop as `robot_connected`, but it sleeps on timers
+        scheduled on the event loop (such as the SDK's) instead of blocking a
+        thread. Behaviors are activated as tasks on the same loop, so they
+        can await their actions, and other I/O can share the loop.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.scheduler.start(self.clock.now())
+
+        try:
+            while not self.update_event.is_set():
+                await self.clock.sleep(max(0, self.scheduler.next_deadline() - self.clock.now()))
+
+                if not self.update_event.is_set():
+                    self.tick(self.clock.now())
+        finally:
+            self.behavior_system.cancel_tasks()
+            self.loop = None
+            self.shutdown()
+
+    def tick(self, now):
+        """ Updates the systems whose deadlines have passed, returning whether any were """
+        due = self.scheduler.take_due(now)
+        if not due:
+            return False
+
+        self.run_tick(now, due)
+        return True
+
+    def run_tick(self, now, due):
+        """ Runs one tick at time `now` of the given (task, elapsed) updates, as chosen by the scheduler or recorded """
+        self.last_update = now
+
+        self.instrumentation.begin_tick()
+
+        # Update the systems whose deadlines have passed
+        self.update_due(due)
+
+        # Save the current image
+        self.save_image()
+
+        self.publish_snapshot()
+        self.instrumentation.end_tick()
+
+        self.dispatch_events()
+        self.record_telemetry()
+
+    def shutdown(self):
+        """ Delivers the remaining events and closes the image writer and recorders """
+        self.dispatcher.close()
+        self.image_writer.close()
+        for recorder in self.recorders:
+            recorder.close()
+
+    def publish_snapshot(self):
+        """ Publishes an immutable copy of the systems' state for readers outside the control loop """
+        start = self.instrumentation.timer()
+        self.snapshots.publish(self)
+        self.instrumentation.record('snapshot', self.instrumentation.timer() - start)
+
+    def dispatch_events(self):
+        """ Delivers the events queued during the tick, outside of the tick's time """
+        start = self.instrumentation.timer()
+        if self.dispatcher.end_tick():
+            self.instrumentation.record('event-dispatch', self.instrumentation.timer() - start)
+
+    def record_telemetry(self):
+        """ Records the latest snapshot, outside of the tick's time """
+        if self.recorders:
+            start = self.instrumentation.timer()
+            snapshot = self.snapshots.latest()
+            for recorder in self.recorders:
+                recorder.record(snapshot)
+            self.instrumentation.record('telemetry', self.instrumentation.timer() - start)
+
+    @property
+    def sdk(self):
+        """ The SDK module, whose enums and units the behaviors start their actions with, or a stand-in while simulated
+
+        The SDK is only imported once a real robot is used, so headless runs don't need it installed.
+        """
+        if isinstance(self.cozmo, simulation.SimulatedCozmo):
+            return simulation.sdk
+
+        import cozmo as cozmosdk
+        return cozmosdk
+
+    def save_image(self):
+        """ Queues the latest camera image to be saved, if there is one and the capture policy accepts it """
+        image = self.cozmo.world.latest_image if self.cozmo else None
+
+        if image:
+            start = self.instrumentation.timer()
+
+            if not self.capture_policy.should_capture(self, image):
+                return
+
+            self.image_writer.submit(image.raw_image, self.last_image_i, getattr(image, 'image_recv_time', None) or time.time())
+            self.last_image_i += 1
+            self.instrumentation.record('image-save', self.instrumentation.timer() - start)
 
     def robot_thread(self):
         if self.use_cozmo:
+            import cozmo as cozmosdk
             cozmosdk.logger = self.logger
-            cozmosdk.connect_with_tkviewer(lambda conn: self.robot_connected(conn))
+
+            if self.use_asyncio:
+                cozmosdk.connect_with_tkviewer(self.robot_connected_async)
+            else:
+                cozmosdk.connect_with_tkviewer(lambda conn: self.robot_connected(conn))
+        elif self.use_asyncio:
+            asyncio.run(self.robot_connected_async(None))
         else:
             self.robot_connected(None)
\ No newline at end of file
@@ -0,0 +1,90 @@
+from .instrumentation import LatencyHistogram
+
+import math
+
+class Task(object):
+    """ A system updated every `period` seconds, offset by `phase` seconds """
+
+    def __init__(self, name, system, period, phase=0):
+        self.name = name
+        self.system = system
+        self.period = period
+        self.phase = phase
+
+        self.deadline = None
+        self.last_update = None
+        self.run_count = 0
+        self.miss_count = 0
+        self.lateness = LatencyHistogram()
+
+    def start(self, now):
+        self.deadline = now + self.phase
+        self.last_update = now
+
+
+class Scheduler(object):
+    """ Updates each system at its own rate, against absolute deadlines
+
+    A system's deadlines fall at fixed multiples of its period after the
+    scheduler starts (plus its phase), so the time spent sleeping and
+    updating doesn't push later deadlines back. Each system is handed the
+    time since its own previous update as `elapsed`. When a system is late
+    by one or more whole periods, the deadlines it missed are counted and
+    skipped rather than run back to back.
+    """
+
+    def __init__(self):
+        self.tasks = []
+
+    def add(self, name, system, rate, phase=0):
+        """ Schedules a system at `rate` updates per second; returns its task """
+        task = Task(name, system, 1 / rate, phase)
+        self.tasks.append(task)
+        return task
+
+    def get(self, name):
+        for task in self.tasks:
+            if task.name == name:
+                return task
+        return None
+
+    def start(self, now):
+        for task in self.tasks:
+            task.start(now)
+
+    def next_deadline(self):
+        return min(task.deadline for task in self.tasks)
+
+    def take_due(self, now):
+        """ Returns (task, elapsed) for each task whose deadline has passed, in the order the tasks were added """
+        due = []
+
+        for task in self.tasks:
+            if now < task.deadline:
+                continue
+
+            late = now - task.deadline
+            task.lateness.record(late)
+
+            missed = math.floor(late / task.period)
+            task.miss_count += missed
+            task.deadline += (missed + 1) * task.period
+
+            due.append((task, now - task.last_update))
+            task.last_update = now
+            task.run_count += 1
+
+        return due
+
+    def stats(self):
+        """ Returns each task's rate, phase, run and miss counts and lateness summary """
+        return {
+            task.name: {
+                'rate': 1 / task.period,
+                'phase': task.phase,
+                'runs': task.run_count,
+                'misses': task.miss_count,
+                'lateness': task.lateness.summary(),
+            }
+            for task in self.tasks
+        }
@@ -0,0 +1,182 @@
+from collections import namedtuple
+import asyncio
+import random
+
+# Stand-ins for the SDK's pose, which is all that is read of the faces and objects it reports
+Position = namedtuple('Position', ['x', 'y', 'z'])
+Pose = namedtuple('Pose', ['position'])
+
+
+class SimulatedSDK(object):
+    """ Stand-in for the SDK module's enums and units, so actions can be started without the SDK installed
+
+    Attributes stand for themselves by their dotted name, and calling one
+    records its arguments, so `sdk.anim.Triggers.NeutralFace` and
+    `sdk.util.degrees(0)` show up in the simulated actions as what they
+    name rather than the SDK objects.
+    """
+
+    def __init__(self, name='cozmo'):
+        self._name = name
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return SimulatedSDK('{}.{}'.format(self._name, name))
+
+    def __call__(self, *args, **kwargs):
+        return SimulatedSDK('{}({})'.format(self._name, ', '.join([repr(arg) for arg in args] + ['{}={!r}'.format(*item) for item in kwargs.items()])))
+
+    def __repr__(self):
+        return self._name
+
+sdk = SimulatedSDK()
+
+class SimulatedAction(object):
+    """ Stand-in for an SDK action or behavior that records how it was started """
+
+    def __init__(self, name, args, kwargs):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+
+        self.is_running = True
+        self.is_active = True
+        self.aborted = False
+        self.completed_callbacks = []
+
+    def on_completed(self, callback):
+        self.completed_callbacks.append(callback)
+
+    async def wait_for_completed(self, timeout=None):
+        """ Waits until `complete()` is called, like the SDK's coroutine """
+        if self.is_running:
+            completed = asyncio.get_running_loop().create_future()
+            self.on_completed(lambda action: completed.done() or completed.set_result(action))
+            await asyncio.wait_for(completed, timeout)
+
+        return self
+
+    def complete(self):
+        """ Finishes the action and notifies its completion callbacks """
+        self.is_running = False
+        self.is_active = False
+
+        for callback in self.completed_callbacks:
+            callback(self)
+
+    def abort(self):
+        """ Stops the action, which then reports its completion like an aborted SDK action """
+        if self.is_running:
+            self.aborted = True
+            self.complete()
+
+    def stop(self):
+        self.is_running = False
+        self.is_active = False
+
+
+class SimulatedEntity(object):
+    """ A face or object that the simulated world reports as visible """
+
+    def __init__(self, x=0, y=0, z=0, face_id=None, object_id=None):
+        self.face_id = face_id
+        self.object_id = object_id
+        self.pose = Pose(Position(x, y, z))
+
+    def move_to(self, x, y, z=0):
+        self.pose = Pose(Position(x, y, z))
+
+
+class SimulatedWorld(object):
+    """ Stand-in for the SDK world, holding the currently visible faces and objects """
+
+    def __init__(self):
+        self.faces = []
+        self.objects = []
+        self.latest_image = None
+
+    @property
+    def visible_faces(self):
+        return iter(self.faces)
+
+    @property
+    def visible_objects(self):
+        return iter(self.objects)
+
+
+class SimulatedCozmo(object):
+    """ Stand-in for the SDK robot so the systems can run headless
+
+    Actions never complete on their own; call `complete()` on an entry of
+    `actions` to drive a behavior's callback chain forward.
+    """
+
+    def __init__(self):
+        self.world = SimulatedWorld()
+        self.actions = []
+
+    def _start_action(self, name, *args, **kwargs):
+        action = SimulatedAction(name, args, kwargs)
+        self.actions.append(action)
+        return action
+
+    def play_anim_trigger(self, *args, **kwargs):
+        return self._start_action('play_anim_trigger', *args, **kwargs)
+
+    def set_head_angle(self, *args, **kwargs):
+        return self._start_action('set_head_angle', *args, **kwargs)
+
+    def drive_straight(self, *args, **kwargs):
+        return self._start_action('drive_straight', *args, **kwargs)
+
+    def turn_in_place(self, *args, **kwargs):
+        return self._start_action('turn_in_place', *args, **kwargs)
+
+    def say_text(self, *args, **kwargs):
+        return self._start_action('say_text', *args, **kwargs)
+
+    def start_behavior(self, *args, **kwargs):
+        return self._start_action('start_behavior', *args, **kwargs)
+
+
+class RandomStimulusScript(object):
+    """ Seeded random visits of a face and a toy to a simulated world, for unattended runs
+
+    Each stimulus appears and disappears at random (with the given mean
+    visible and absent durations) and moves while visible, occasionally fast
+    enough to be threatening.
+    """
+
+    def __init__(self, world, seed=None, mean_visible=20, mean_absent=30, fast_probability=0.1, fast_speed=400, slow_speed=50):
+        self.world = world
+        self.random = random.Random(seed)
+
+        self.mean_visible = mean_visible
+        self.mean_absent = mean_absent
+        self.fast_probability = fast_probability
+        self.fast_speed = fast_speed
+        self.slow_speed = slow_speed
+
+        self.face = SimulatedEntity(face_id=1)
+        self.toy = SimulatedEntity(object_id=1)
+        self.entities = [(self.face, world.faces), (self.toy, world.objects)]
+        self.velocities = {}
+
+    def update(self, elapsed):
+        for entity, visible in self.entities:
+            present = entity in visible
+            mean = self.mean_visible if present else self.mean_absent
+
+            if self.random.random() < elapsed / mean:
+                if present:
+                    visible.remove(entity)
+                else:
+                    visible.append(entity)
+                    fast = self.random.random() < self.fast_probability
+                    self.velocities[entity] = self.fast_speed if fast else self.random.uniform(0, self.slow_speed)
+                continue
+
+            if present:
+                position = entity.pose.position
+                entity.move_to(position.x + self.velocities[entity] * elapsed, position.y, position.z)
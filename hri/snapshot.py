@@ -0,0 +1,102 @@
+from collections import namedtuple
+
+DriveState = namedtuple('DriveState', 'name drive_level status')
+StimulusState = namedtuple('StimulusState', 'id type detected detection_duration disappearance_duration average_speed')
+ReleaserState = namedtuple('ReleaserState', 'name activation_level activation_threshold affect active')
+EmotionState = namedtuple('EmotionState', 'name activation_level net_affect')
+BehaviorState = namedtuple('BehaviorState', 'name activation_level activation_threshold active')
+
+Snapshot = namedtuple('Snapshot', [
+    'sequence', 'time', 'uptime',
+    'drives', 'active_drive',
+    'stimuli',
+    'releasers',
+    'emotions', 'active_emotion',
+    'behaviors', 'active_behavior',
+])
+Snapshot.__doc__ = """ Immutable copy of the robot's state at the end of a tick
+
+The collections are tuples of the *State records, in the order the systems
+hold them, and the active_* fields are names (or None).
+"""
+
+def drive_status(drive):
+    if drive.is_overwhelmed():
+        return 'overwhelmed'
+    if drive.is_underwhelmed():
+        return 'underwhelmed'
+    if drive.is_homeostatic():
+        return 'homeostatic'
+    return ''
+
+def name_of(component):
+    return component.name if component else None
+
+def capture(robot, sequence):
+    """ Copies the state of the robot's systems into a Snapshot """
+    drive_system = robot.drive_system
+    perception_system = robot.perception_system
+    emotion_system = robot.emotion_system
+    behavior_system = robot.behavior_system
+
+    return Snapshot(
+        sequence=sequence,
+        time=robot.clock.now(),
+        uptime=perception_system.uptime,
+
+        drives=tuple(
+            DriveState(drive.name, drive.drive_level, drive_status(drive))
+            for drive in drive_system.drives
+        ),
+        active_drive=name_of(drive_system.active_drive),
+
+        stimuli=tuple(
+            StimulusState(stim.id, stim.type, stim.detected, stim.detection_duration, stim.disappearance_duration, stim.average_speed)
+            for stim in perception_system.stimuli.values()
+        ),
+
+        releasers=tuple(
+            ReleaserState(rel.name, rel.activation_level, rel.activation_threshold, rel.affect, rel.is_active())
+            for rel in perception_system.releasers
+        ),
+
+        emotions=tuple(
+            EmotionState(em.name, em.activation_level, em.net_affect)
+            for em in emotion_system.emotions
+        ),
+        active_emotion=name_of(emotion_system.active_emotion),
+
+        behaviors=tuple(
+            BehaviorState(beh.name, beh.activation_level, beh.activation_threshold, beh.is_active)
+            for beh in behavior_system.behaviors
+        ),
+        active_behavior=name_of(behavior_system.active_behavior),
+    )
+
+
+class SnapshotBuffer(object):
+    """ Double buffer of snapshots, published by the control loop and read from any thread
+
+    Snapshots are immutable, so publishing only has to swap the (latest,
+    previous) pair, which is a single reference assignment: readers never
+    take a lock and never see a partially updated state.
+    """
+
+    def __init__(self):
+        self.buffers = (None, None)
+        self.sequence = 0
+
+    def publish(self, robot):
+        """ Captures the robot's state and makes it the latest snapshot """
+        self.sequence += 1
+        snapshot = capture(robot, self.sequence)
+        self.buffers = (snapshot, self.buffers[0])
+        return snapshot
+
+    def latest(self):
+        """ Returns the most recently published snapshot, or None before the first tick """
+        return self.buffers[0]
+
+    def pair(self):
+        """ Returns the latest and previous snapshots together, for readers that compare them """
+        return self.buffers
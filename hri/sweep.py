@@ -0,0 +1,276 @@
+""" Parameter sweeps over the robot's tuning constants
+
+Runs headless simulations of `Robot` across a process pool, one per
+parameter combination, and streams each run's summary metrics to a JSON
+lines file as soon as it finishes:
+
+    python -m hri.sweep --grid 'emotion_system.emotion_joy.threshold_expression=[40, 60, 80]' \\
+                        --grid 'perception_system.releasers.threatening-stimulus-releaser.affect_base.0=[800, 1000]' \\
+                        --grid 'drive_system.social_drive.range_underwhelmed=[[30, 100], [50, 100]]' \\
+                        --duration 600 --output sweep.jsonl
+
+    python -m hri.sweep --random emotion_system.emotion_fear.default_activation_bias=0:40 --samples 200 --output sweep.jsonl
+
+Parameter paths are attribute names relative to the robot. A segment that
+isn't an attribute selects the item with that `name` from a list (drives,
+releasers, emotions, behaviors), and a trailing number replaces one element
+of a tuple or list such as `affect_base` or `range_underwhelmed`. Grid
+values are given as a JSON array, so a value can itself be a list.
+
+Terms that are reset every tick are swept through the default they are
+reset to: `activation_bias` and `activation_persistence` set the emotion's
+`default_activation_bias` and `default_activation_persistence`, and
+`activation_decay` (always reset to 0) can't be swept.
+
+A run that fails is recorded as a line with its parameters, seed and
+`error` instead of its metrics, and the rest of the sweep carries on.
+"""
+from . import clock
+from . import robot as hrirobot
+from . import simulation
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+
+ENGAGEMENT_BEHAVIORS = ('engage-with-face-behavior', 'play-with-toy-behavior')
+
+# Terms that are reset every tick, and the defaults they are reset to (None where they can't be set)
+RESET_EVERY_TICK = {
+    'activation_bias': 'default_activation_bias',
+    'activation_persistence': 'default_activation_persistence',
+    'activation_decay': None,
+}
+
+
+def resolve(obj, path):
+    """ Returns the object at the dotted parameter path """
+    for segment in path.split('.'):
+        if isinstance(obj, (list, tuple)) and segment.isdigit():
+            obj = obj[int(segment)]
+        elif hasattr(obj, segment):
+            obj = getattr(obj, segment)
+        else:
+            matches = [item for item in obj if getattr(item, 'name', None) == segment]
+            if not matches:
+                raise KeyError('No parameter {} in {}'.format(segment, path))
+            obj = matches[0]
+
+    return obj
+
+
+def set_parameter(robot, path, value):
+    """ Sets the parameter at the dotted path, keeping dependent values consistent """
+    parent_path, _, name = path.rpartition('.')
+    parent = resolve(robot, parent_path) if parent_path else robot
+
+    if name in RESET_EVERY_TICK and hasattr(parent, 'reset_activation_terms'):
+        if RESET_EVERY_TICK[name] is None:
+            raise ValueError('{} is reset every tick and can\'t be swept'.format(path))
+        name = RESET_EVERY_TICK[name]
+
+    if name.isdigit():
+        # Replace one element of a tuple/list attribute
+        owner_path, _, attribute = parent_path.rpartition('.')
+        owner = resolve(robot, owner_path) if owner_path else robot
+        values = list(parent)
+        values[int(name)] = value
+        setattr(owner, attribute, type(parent)(values))
+        owner_name = attribute
+    else:
+        setattr(parent, name, value)
+        owner, owner_name = parent, name
+
+    # The homeostatic range sits between the overwhelmed and underwhelmed ranges
+    if owner_name in ('range_overwhelmed', 'range_underwhelmed'):
+        owner.range_homeostatic = [owner.range_overwhelmed[1], owner.range_underwhelmed[0]]
+
+
+def grid(spec):
+    """ Expands {path: [values]} into every combination of parameters """
+    paths = list(spec)
+    return [dict(zip(paths, values)) for values in itertools.product(*(spec[path] for path in paths))]
+
+
+def random_sample(spec, samples, seed=None):
+    """ Draws parameter sets from {path: (low, high)} uniformly, or {path: [choices]} """
+    rng = random.Random(seed)
+    parameter_sets = []
+
+    for _ in range(samples):
+        parameters = {}
+        for path, values in spec.items():
+            if isinstance(values, tuple):
+                parameters[path] = rng.uniform(*values)
+            else:
+                parameters[path] = rng.choice(values)
+        parameter_sets.append(parameters)
+
+    return parameter_sets
+
+
+class RunMetrics(object):
+    """ Accumulates summary metrics of a simulated run """
+
+    def __init__(self, robot):
+        self.robot = robot
+
+        self.emotion_time = {em.name: 0 for em in robot.emotion_system.emotions}
+        self.emotion_time['(none)'] = 0
+        self.behavior_time = {beh.name: 0 for beh in robot.behavior_system.behaviors}
+        self.behavior_time['(none)'] = 0
+
+        self.drive_switches = 0
+        self.emotion_switches = 0
+        self.behavior_switches = 0
+        self.first_engagement = None
+
+        robot.drive_system.on('active-drive-changed', self.on_active_drive_changed)
+        robot.emotion_system.on('active-emotion-changed', self.on_active_emotion_changed)
+        robot.behavior_system.on('active-behavior-changed', self.on_active_behavior_changed)
+
+    def on_active_drive_changed(self, previous_drive, new_drive):
+        self.drive_switches += 1
+
+    def on_active_emotion_changed(self, previous_emotion, new_emotion):
+        self.emotion_switches += 1
+
+    def on_active_behavior_changed(self, previous_behavior, new_behavior):
+        self.behavior_switches += 1
+
+        if self.first_engagement is None and new_behavior and new_behavior.name in ENGAGEMENT_BEHAVIORS:
+            self.first_engagement = self.robot.clock.now()
+
+    def update(self, elapsed):
+        emotion = self.robot.emotion_system.active_emotion
+        behavior = self.robot.behavior_system.active_behavior
+        self.emotion_time[emotion.name if emotion else '(none)'] += elapsed
+        self.behavior_time[behavior.name if behavior else '(none)'] += elapsed
+
+    def summary(self):
+        return {
+            'emotion_time': self.emotion_time,
+            'behavior_time': self.behavior_time,
+            'drive_switches': self.drive_switches,
+            'emotion_switches': self.emotion_switches,
+            'behavior_switches': self.behavior_switches,
+            'time_to_first_engagement': self.first_engagement,
+        }
+
+
+def run_simulation(parameters, seed=None, duration=600, elapsed=0.03):
+    """ Runs one headless simulation with the given parameters and returns its summary """
+    logger = logging.getLogger('sweep')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    robot = hrirobot.Robot(logger, clock=clock.VirtualClock())
+    for path, value in parameters.items():
+        set_parameter(robot, path, value)
+
+    script = simulation.RandomStimulusScript(robot.cozmo.world, seed=seed)
+    metrics = RunMetrics(robot)
+
+    remaining = duration
+    while remaining > 1e-9:
+        step_elapsed = min(elapsed, remaining)
+        script.update(step_elapsed)
+        robot.step(step_elapsed)
+        metrics.update(step_elapsed)
+        remaining -= step_elapsed
+
+    return {'parameters': parameters, 'seed': seed, 'duration': duration, 'metrics': metrics.summary()}
+
+
+def run_sweep(parameter_sets, output, seeds=(0,), duration=600, elapsed=0.03, workers=None):
+    """ Runs every parameter set with every seed across a process pool
+
+    Each result is appended to `output` as a JSON line as soon as its run
+    finishes, or its error if it failed. Only a bounded number of runs are in
+    flight at once, so large sweeps don't accumulate in memory. Returns the
+    number of completed and failed runs.
+    """
+    workers = workers or os.cpu_count()
+    runs = ((parameters, seed) for parameters in parameter_sets for seed in seeds)
+    counts = {'completed': 0, 'failed': 0}
+
+    with open(output, 'a') as f, ProcessPoolExecutor(max_workers=workers) as executor:
+        # The parameters and seed of each run in flight
+        pending = {}
+
+        def write_finished():
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                parameters, seed = pending.pop(future)
+                try:
+                    result = future.result()
+                    counts['completed'] += 1
+                except Exception as e:
+                    result = {'parameters': parameters, 'seed': seed, 'duration': duration, 'error': repr(e)}
+                    counts['failed'] += 1
+
+                f.write(json.dumps(result, sort_keys=True) + '\n')
+                f.flush()
+
+        for parameters, seed in runs:
+            # Keep the pool busy without queueing the whole sweep
+            if len(pending) >= workers * 2:
+                write_finished()
+
+            pending[executor.submit(run_simulation, parameters, seed, duration, elapsed)] = (parameters, seed)
+
+        while pending:
+            write_finished()
+
+    return counts['completed'], counts['failed']
+
+
+def parse_values(text):
+    """ Parses a JSON array of grid values """
+    values = json.loads(text)
+    if not isinstance(values, list):
+        raise ValueError('Grid values must be a JSON array, not {}'.format(text))
+    return values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sweep the robot tuning constants over headless simulations')
+    parser.add_argument('--grid', action='append', default=[], metavar='PATH=[V1, V2, ...]', help='JSON array of values to combine in a grid')
+    parser.add_argument('--random', action='append', default=[], metavar='PATH=LOW:HIGH', help='uniform range to sample from')
+    parser.add_argument('--samples', type=int, default=100, help='number of random parameter sets')
+    parser.add_argument('--seeds', type=int, default=1, help='stimulus scripts to run per parameter set')
+    parser.add_argument('--duration', type=float, default=600, help='simulated seconds per run')
+    parser.add_argument('--elapsed', type=float, default=0.03, help='simulated seconds per tick')
+    parser.add_argument('--workers', type=int, help='processes to use (defaults to all cores)')
+    parser.add_argument('--output', required=True, help='JSON lines file to append results to')
+    args = parser.parse_args(argv)
+
+    grid_spec = {}
+    for entry in args.grid:
+        path, _, values = entry.partition('=')
+        try:
+            grid_spec[path] = parse_values(values)
+        except ValueError as e:
+            parser.error('--grid {}: {}'.format(path, e))
+
+    random_spec = {}
+    for entry in args.random:
+        path, _, bounds = entry.partition('=')
+        low, _, high = bounds.partition(':')
+        random_spec[path] = (float(low), float(high))
+
+    parameter_sets = grid(grid_spec) if grid_spec else [{}]
+    if random_spec:
+        parameter_sets = [dict(fixed, **sampled) for fixed in parameter_sets for sampled in random_sample(random_spec, args.samples)]
+
+    completed, failed = run_sweep(parameter_sets, args.output, range(args.seeds), args.duration, args.elapsed, args.workers)
+    print('Completed {} runs, {} failed'.format(completed, failed), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
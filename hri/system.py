@@ -3,10 +3,18 @@ import pyee
 class System(pyee.EventEmitter):
     """ A system object that has access to its robot """
 
+    # The name its updates are timed and scheduled under, and the kind of registry component it updates
+    name = None
+    kind = None
+
     def __init__(self, robot):
         super().__init__()
         
         self.robot = robot
 
+    def _emit_run(self, f, args, kwargs):
+        # Listeners are called (or queued) by the robot's dispatcher
+        self.robot.dispatcher.submit(f, args, kwargs)
+
     def update(self, elapsed):
         pass
@@ -0,0 +1,208 @@
+import json
+import math
+import os
+
+import numpy as np
+
+SCHEMA_FILENAME = 'schema.json'
+COLUMN_FILENAME = '{}.bin'
+
+# Components whose state is recorded, as the snapshot field that holds them
+KINDS = ('drives', 'releasers', 'emotions', 'behaviors')
+
+
+def columns(names):
+    """ Returns the (dtype, shape) of every column, given the component names of each kind """
+    drives, releasers, emotions, behaviors = (len(names[kind]) for kind in KINDS)
+
+    return {
+        'sequence': ('<u8', ()),
+        'time': ('<f8', ()),
+        'drive_level': ('<f4', (drives,)),
+        'releaser_activation': ('<f4', (releasers,)),
+        'releaser_affect': ('<f4', (releasers, 3)),
+        'emotion_activation': ('<f4', (emotions,)),
+        'emotion_net_affect': ('<f4', (emotions, 3)),
+        'behavior_activation': ('<f4', (behaviors,)),
+        'active_drive': ('<i2', ()),
+        'active_emotion': ('<i2', ()),
+        'active_behavior': ('<i2', ()),
+    }
+
+
+def affect_values(affect):
+    """ Converts an affect (or None, or a tuple of Nones) to three floats, NaN where missing """
+    if affect is None:
+        return (math.nan, math.nan, math.nan)
+    return tuple(math.nan if value is None else value for value in affect)
+
+
+class TelemetryRecorder(object):
+    """ Records the robot's state every tick into one binary file per column
+
+    Rows are taken from the published snapshots and collected in NumPy
+    buffers of `buffer_ticks` rows, which are appended to the column files
+    once full, so a tick only costs a few array assignments. The drive,
+    releaser, emotion and behavior names, and the dtype and shape of every
+    column, are stored in a schema file; active components are recorded as
+    indexes into those names, with -1 for none.
+
+    The directory is created with the first recorded snapshot. Reopening
+    an existing recording appends to it, provided it has the same schema.
+    """
+
+    def __init__(self, directory, buffer_ticks=1000):
+        self.directory = directory
+        self.buffer_ticks = buffer_ticks
+
+        self.names = None
+        self.indexes = None
+        self.buffers = None
+        self.files = None
+        self.buffered = 0
+        self.row_count = 0
+
+    def _open(self, snapshot):
+        self.names = {kind: [state.name for state in getattr(snapshot, kind)] for kind in KINDS}
+        self.indexes = {kind: {name: i for i, name in enumerate(self.names[kind])} for kind in KINDS}
+        schema = {
+            'names': self.names,
+            'columns': {name: {'dtype': dtype, 'shape': list(shape)} for name, (dtype, shape) in columns(self.names).items()},
+        }
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        schema_path = os.path.join(self.directory, SCHEMA_FILENAME)
+        if os.path.exists(schema_path):
+            with open(schema_path) as f:
+                if json.load(f) != schema:
+                    raise ValueError('Telemetry in {} was recorded with a different schema'.format(self.directory))
+        else:
+            with open(schema_path, 'w') as f:
+                json.dump(schema, f, indent=2)
+
+        self.buffers = {
+            name: np.zeros((self.buffer_ticks,) + shape, dtype)
+            for name, (dtype, shape) in columns(self.names).items()
+        }
+
+        # Drop a partially written trailing row, so that every column continues at the same row
+        self.row_count = count_rows(self.directory, schema['columns'])
+        self.files = {}
+        for name, buffer in self.buffers.items():
+            path = os.path.join(self.directory, COLUMN_FILENAME.format(name))
+            f = self.files[name] = open(path, 'r+b' if os.path.exists(path) else 'wb')
+            f.truncate(self.row_count * buffer[0].nbytes)
+            f.seek(0, os.SEEK_END)
+
+    def record(self, snapshot):
+        """ Appends a row for the snapshot """
+        if self.buffers is None:
+            self._open(snapshot)
+
+        row = self.buffered
+        buffers = self.buffers
+        indexes = self.indexes
+
+        buffers['sequence'][row] = snapshot.sequence
+        buffers['time'][row] = snapshot.time
+        buffers['drive_level'][row] = [drive.drive_level for drive in snapshot.drives]
+        buffers['releaser_activation'][row] = [rel.activation_level for rel in snapshot.releasers]
+        buffers['releaser_affect'][row] = [affect_values(rel.affect) for rel in snapshot.releasers]
+        buffers['emotion_activation'][row] = [em.activation_level for em in snapshot.emotions]
+        buffers['emotion_net_affect'][row] = [affect_values(em.net_affect) for em in snapshot.emotions]
+        buffers['behavior_activation'][row] = [beh.activation_level for beh in snapshot.behaviors]
+        buffers['active_drive'][row] = indexes['drives'].get(snapshot.active_drive, -1)
+        buffers['active_emotion'][row] = indexes['emotions'].get(snapshot.active_emotion, -1)
+        buffers['active_behavior'][row] = indexes['behaviors'].get(snapshot.active_behavior, -1)
+
+        self.buffered += 1
+        if self.buffered == self.buffer_ticks:
+            self.flush()
+
+    def flush(self):
+        """ Appends the buffered rows to the column files """
+        if not self.buffered:
+            return
+
+        for name, buffer in self.buffers.items():
+            f = self.files[name]
+            f.write(buffer[:self.buffered].tobytes())
+            f.flush()
+
+        self.row_count += self.buffered
+        self.buffered = 0
+
+    def close(self):
+        if self.files is not None:
+            self.flush()
+            for f in self.files.values():
+                f.close()
+            self.files = None
+            self.buffers = None
+
+
+def count_rows(directory, schema_columns):
+    """ Returns the number of complete rows, which every column file holds """
+    rows = None
+
+    for name, column in schema_columns.items():
+        path = os.path.join(directory, COLUMN_FILENAME.format(name))
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        row_size = np.dtype(column['dtype']).itemsize * int(np.prod(column['shape'], dtype=int))
+        rows = size // row_size if rows is None else min(rows, size // row_size)
+
+    return rows or 0
+
+
+class TelemetryReader(object):
+    """ Reads a telemetry recording as memory-mapped NumPy arrays, one row per tick """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        with open(os.path.join(directory, SCHEMA_FILENAME)) as f:
+            schema = json.load(f)
+
+        self.names = schema['names']
+        self.schema_columns = schema['columns']
+        self.arrays = {}
+        self.refresh()
+
+    def refresh(self):
+        """ Picks up the rows recorded since the recording was opened """
+        self.row_count = count_rows(self.directory, self.schema_columns)
+        self.arrays.clear()
+
+    def __len__(self):
+        return self.row_count
+
+    def column(self, name):
+        """ Returns a column as a read-only array of shape (rows,) + the column's shape """
+        array = self.arrays.get(name)
+
+        if array is None:
+            column = self.schema_columns[name]
+            shape = (self.row_count,) + tuple(column['shape'])
+
+            if self.row_count:
+                path = os.path.join(self.directory, COLUMN_FILENAME.format(name))
+                array = np.memmap(path, dtype=column['dtype'], mode='r', shape=shape)
+            else:
+                array = np.zeros(shape, column['dtype'])
+
+            self.arrays[name] = array
+
+        return array
+
+    __getitem__ = column
+
+    def active_names(self, kind):
+        """ Returns the name of the active component of a kind ('drives', 'emotions' or 'behaviors') in every row, or None """
+        names = np.array(self.names[kind] + [None], dtype=object)
+        return names[self.column('active_' + kind[:-1])]
+
+    def series(self, kind, name):
+        """ Returns the activation level (the drive level for 'drives') of the named component in every row """
+        column = 'drive_level' if kind == 'drives' else kind[:-1] + '_activation'
+        return self.column(column)[:, self.names[kind].index(name)]
@@ -0,0 +1,206 @@
+from .instrumentation import LatencyHistogram
+
+import heapq
+import json
+
+STAGES = ('releaser', 'emotion', 'behavior', 'action')
+
+
+class LatencyTracer(object):
+    """ Traces how long the robot takes to react to a stimulus, from detection to its first action
+
+    Each reaction is reconstructed as a chain when the active behavior
+    changes, using the components the new behavior declares it reads:
+
+    - the releaser it reads that most recently crossed its threshold and is
+      still active
+    - the emotion it reads that most recently became active, if any
+    - the detection of the stimulus that releaser responded to when it
+      crossed (or its disappearance, when it wasn't detected then, which is
+      what the absence releaser responds to)
+    - the first action the behavior then starts
+
+    Every timestamp is robot clock time, tagged with the tick (snapshot
+    sequence) it happened in. Stages are matched up by tick rather than by
+    time, since on the wall clock a snapshot is stamped after the updates
+    of its tick. A stage that was already reached before the previous one
+    (such as an emotion that was already active) counts as taking no time. Behaviors that aren't released by a stimulus, such as
+    those released by the drive releasers, don't form chains. The time
+    spent in each stage and in the whole chain is kept in LatencyHistograms,
+    along with the `keep_slowest` slowest chains.
+    """
+
+    def __init__(self, robot, keep_slowest=20, window=1000, dump_path=None):
+        self.robot = robot
+        self.keep_slowest = keep_slowest
+        self.dump_path = dump_path
+
+        self.stages = {stage: LatencyHistogram(window) for stage in STAGES}
+        self.total = LatencyHistogram(window)
+        self.slowest = []
+        self.chain_count = 0
+        self.incomplete_count = 0
+
+        # The releasers and emotions read by each behavior
+        registry = robot.registry
+        releasers = set(rel.name for rel in registry.of_kind('releaser'))
+        emotions = set(em.name for em in registry.of_kind('emotion'))
+        self.reads = {}
+        for behavior in registry.of_kind('behavior'):
+            names = [dep.name for dep in registry.dependencies(behavior)]
+            self.reads[behavior.name] = ([name for name in names if name in releasers], [name for name in names if name in emotions])
+
+        # The last detection and disappearance of each stimulus, by id
+        self.detections = {}
+        self.disappearances = {}
+        self.crossings = {}
+        self.activations = {}
+        self.actions = {}
+        self.pending = {}
+        self.previous = None
+
+    def attach(self):
+        """ Starts tracing the robot's reactions, returning the tracer """
+        self.robot.perception_system.on('stimulus-detected', self.on_stimulus_detected)
+        self.robot.perception_system.on('stimulus-disappeared', self.on_stimulus_disappeared)
+        self.robot.perception_system.on('stimulus-removed', self.on_stimulus_removed)
+        self.robot.behavior_system.on('action-started', self.on_action_started)
+        self.robot.recorders.append(self)
+        return self
+
+    def tick(self):
+        snapshot = self.robot.snapshots.latest()
+        return snapshot.sequence if snapshot else 0
+
+    def on_stimulus_detected(self, stimulus):
+        self.detections[stimulus.id] = (stimulus.last_detection, self.tick(), '{} {} detected'.format(stimulus.type, stimulus.id))
+
+    def on_stimulus_disappeared(self, stimulus):
+        self.disappearances[stimulus.id] = (stimulus.last_disappearance, self.tick(), '{} {} disappeared'.format(stimulus.type, stimulus.id))
+
+    def on_stimulus_removed(self, stimulus):
+        self.detections.pop(stimulus.id, None)
+        self.disappearances.pop(stimulus.id, None)
+
+    def cause(self, name):
+        """ Returns the detection (or disappearance) of the stimulus that the named releaser responds to, or None """
+        stimulus = self.robot.registry.get(name).stimulus()
+        if stimulus is None:
+            return None
+
+        if stimulus.detected:
+            return self.detections.get(stimulus.id)
+        return self.disappearances.get(stimulus.id)
+
+    def on_action_started(self, behavior, name, time):
+        action = (time, self.tick(), name)
+        chain = self.pending.pop(behavior.name, None)
+
+        if chain is None:
+            self.actions[behavior.name] = action
+        elif action[1] >= chain['behavior'][1]:
+            self.complete(chain, action)
+
+    def record(self, snapshot):
+        """ Notes the threshold crossings and changes in the snapshot, and starts a chain on a behavior change """
+        previous = self.previous
+        self.previous = snapshot
+        if previous is None:
+            return
+
+        stamp = (snapshot.time, snapshot.sequence)
+
+        for rel, was in zip(snapshot.releasers, previous.releasers):
+            if rel.active and not was.active:
+                # The releaser's stimulus is looked up while the perception context is still the one it crossed in
+                self.crossings[rel.name] = (stamp + (rel.name,), self.cause(rel.name))
+            elif was.active and not rel.active:
+                self.crossings.pop(rel.name, None)
+
+        if snapshot.active_emotion != previous.active_emotion and snapshot.active_emotion:
+            self.activations[snapshot.active_emotion] = stamp + (snapshot.active_emotion,)
+
+        if snapshot.active_behavior != previous.active_behavior:
+            # A chain still waiting for its action when its behavior ends never completes
+            if previous.active_behavior in self.pending:
+                del self.pending[previous.active_behavior]
+                self.incomplete_count += 1
+
+            if snapshot.active_behavior:
+                self.begin(snapshot.active_behavior, stamp + (snapshot.active_behavior,))
+
+    def begin(self, behavior, stamp):
+        releaser_names, emotion_names = self.reads[behavior]
+
+        crossings = [self.crossings[name] for name in releaser_names if name in self.crossings]
+        if not crossings:
+            return
+
+        # Chains are only formed when the releaser responded to a stimulus
+        releaser, detection = max(crossings, key=lambda crossing: crossing[0])
+        if detection is None or detection[1] > releaser[1]:
+            return
+
+        activations = [self.activations[name] for name in emotion_names if name in self.activations]
+
+        chain = {
+            'detection': detection,
+            'releaser': releaser,
+            'emotion': max(activations) if activations else None,
+            'behavior': stamp,
+        }
+
+        action = self.actions.pop(behavior, None)
+        if action is not None and action[1] >= stamp[1]:
+            self.complete(chain, action)
+        else:
+            self.pending[behavior] = chain
+
+    def complete(self, chain, action):
+        chain['action'] = action
+        self.chain_count += 1
+
+        latencies = {}
+        last = chain['detection'][0]
+        for stage in STAGES:
+            reached = chain[stage][0] if chain[stage] else last
+            latencies[stage] = max(0, reached - last)
+            last = max(last, reached)
+
+            self.stages[stage].record(latencies[stage])
+
+        total = last - chain['detection'][0]
+        self.total.record(total)
+
+        record = {'total': total, 'latencies': latencies}
+        record.update({stage: stamp and {'time': stamp[0], 'tick': stamp[1], 'name': stamp[2]} for stage, stamp in chain.items()})
+
+        entry = (total, self.chain_count, record)
+        if len(self.slowest) < self.keep_slowest:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+
+    def stats(self):
+        """ Returns the chain counts and the per-stage and total latency summaries """
+        return {
+            'chains': self.chain_count,
+            'incomplete': self.incomplete_count,
+            'stages': {stage: hist.summary() for stage, hist in self.stages.items()},
+            'total': self.total.summary(),
+        }
+
+    def slowest_chains(self):
+        """ Returns the slowest chains seen, slowest first """
+        return [record for _, _, record in sorted(self.slowest, key=lambda entry: entry[:2], reverse=True)]
+
+    def dump(self, path):
+        """ Writes the stats followed by the slowest chains, one JSON object per line """
+        with open(path, 'w') as f:
+            f.write(json.dumps(self.stats()) + '\n')
+            for chain in self.slowest_chains():
+                f.write(json.dumps(chain) + '\n')
+
+    def close(self):
+        if self.dump_path:
+            self.dump(self.dump_path)
@@ -1,7 +1,15 @@
 import hri
+import hri.replay
+import hri.telemetry
+import hri.tracing
 import math
+import os
 import logging
+import logging.handlers
+import queue
 import threading
+import time
+from collections import deque
 from urwid import *
 
 import cozmo.tkview as tkview
@@ -12,9 +20,81 @@ def format_affect(affect):
     else:
         return ''
 
-class RobotView(logging.StreamHandler):
-    
-    def __init__(self, logger):
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """ Queues log records untouched, so that they are formatted by whoever drains the queue
+
+    Records are dropped (and counted) rather than blocking the caller when
+    the queue is full.
+    """
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class RowTable(object):
+    """ Rows of persistent Text widgets, laid out over one Pile per column
+
+    Each row is identified by a key. `update` adds and removes rows as keys
+    come and go, and only sets the text of the cells whose markup changed,
+    so that urwid only re-renders what is actually different.
+    """
+
+    def __init__(self, piles):
+        self.piles = piles
+        self.cells = {}
+        self.markups = {}
+        self.order = []
+
+    def update(self, rows):
+        """ Shows the given (key, markups) rows in order, with one markup per column """
+        order = []
+
+        for key, markups in rows:
+            order.append(key)
+            cells = self.cells.get(key)
+
+            if cells is None:
+                self.cells[key] = [Text(markup) for markup in markups]
+                self.markups[key] = list(markups)
+                continue
+
+            shown = self.markups[key]
+            for column, markup in enumerate(markups):
+                if markup != shown[column]:
+                    cells[column].set_text(markup)
+                    shown[column] = markup
+
+        if order != self.order:
+            for key in set(self.order).difference(order):
+                del self.cells[key]
+                del self.markups[key]
+
+            for column, pile in enumerate(self.piles):
+                pile.contents[:] = [(self.cells[key][column], ('pack', None)) for key in order]
+
+            self.order = order
+
+class RobotView(logging.Handler):
+    """ Terminal UI showing the robot's state and log
+
+    Each section is a RowTable, so a refresh only touches the rows whose
+    values changed, and it is cheap enough to run every `refresh_interval`
+    seconds. Log records from the robot are queued and only formatted and rendered
+    by the UI loop. The console keeps the last `console_capacity` lines;
+    when `spill_path` is given, older lines are written to that file,
+    rotated once it reaches `spill_bytes`.
+    """
+
+    def __init__(self, logger, refresh_interval=0.1, console_capacity=1000, spill_path=None, spill_bytes=10 * 1024 * 1024, spill_backups=5):
         super().__init__()
 
         self.palette = [
@@ -40,23 +120,28 @@ class RobotView(logging.StreamHandler):
             ('bg', WHITE, DARK_GRAY)
         ]
 
+        self.refresh_interval = refresh_interval
+
         self.header = AttrMap(Text(('title', '\nCozmo\n'), align=CENTER), 'title')
 
         self.drives_name_pile = Pile([])
         self.drives_level_pile = Pile([])
         self.drives_columns = Columns([self.drives_name_pile, self.drives_level_pile])
+        self.drives_table = RowTable([self.drives_name_pile, self.drives_level_pile])
         self.drives_frame = Frame(self.drives_columns, Text(('section_title', '\nDrives\n'), align=CENTER))
 
         self.stimuli_id_pile = Pile([])
         self.stimuli_duration_pile = Pile([])
         self.stimuli_speed_pile = Pile([])
         self.stimuli_columns = Columns([self.stimuli_id_pile, self.stimuli_duration_pile, self.stimuli_speed_pile])
+        self.stimuli_table = RowTable([self.stimuli_id_pile, self.stimuli_duration_pile, self.stimuli_speed_pile])
         self.stimuli_frame = Frame(self.stimuli_columns, Text(('section_title', '\nStimuli\n'), align=CENTER))
 
         self.emotions_name_pile = Pile([])
         self.emotions_level_pile = Pile([])
         self.emotions_affect_pile = Pile([])
         self.emotions_columns = Columns([self.emotions_name_pile, self.emotions_level_pile, self.emotions_affect_pile])
+        self.emotions_table = RowTable([self.emotions_name_pile, self.emotions_level_pile, self.emotions_affect_pile])
         self.emotions_frame = Frame(self.emotions_columns, Text(('section_title', '\nEmotions\n'), align=CENTER))
 
         self.releasers_id_pile = Pile([])
@@ -67,14 +152,24 @@ class RobotView(logging.StreamHandler):
             ('weight', 1, self.releasers_level_pile), 
             ('weight', 2, self.releasers_affect_pile)
         ])
+        self.releasers_table = RowTable([self.releasers_id_pile, self.releasers_level_pile, self.releasers_affect_pile])
         self.releasers_frame = Frame(self.releasers_columns, Text(('section_title', '\nReleasers\n'), align=CENTER))
 
         self.behaviors_name_pile = Pile([])
         self.behaviors_level_pile = Pile([])
         self.behaviors_columns = Columns([self.behaviors_name_pile, self.behaviors_level_pile])
+        self.behaviors_table = RowTable([self.behaviors_name_pile, self.behaviors_level_pile])
         self.behaviors_frame = Frame(self.behaviors_columns, Text(('section_title', '\nBehaviors\n'), align=CENTER))
 
+        self.timing_name_pile = Pile([])
+        self.timing_latency_pile = Pile([])
+        self.timing_columns = Columns([self.timing_name_pile, ('weight', 2, self.timing_latency_pile)])
+        self.timing_table = RowTable([self.timing_name_pile, self.timing_latency_pile])
+        self.timing_frame = Frame(self.timing_columns, Text(('section_title', '\nTiming (p50 / p95 / p99 / max ms)\n'), align=CENTER))
+
         self.console_list_walker = SimpleFocusListWalker([])
+        self.console_records = deque()
+        self.console_capacity = console_capacity
         self.console_list_box = ListBox(self.console_list_walker)
         self.console_frame = Frame(self.console_list_box, Text(('section_title', '\nConsole\n'), align=CENTER))
 
@@ -89,7 +184,9 @@ class RobotView(logging.StreamHandler):
         self.bottom_pile = Pile([
             ('weight', 1, self.releasers_frame),
             ('fixed', 1, AttrWrap(SolidFill(u'\u2500'), 'line')), 
-            ('weight', 1, self.behaviors_frame)
+            ('weight', 1, self.behaviors_frame),
+            ('fixed', 1, AttrWrap(SolidFill(u'\u2500'), 'line')), 
+            ('weight', 1, self.timing_frame)
         ])
 
         self.bottom_columns = Columns([
@@ -112,42 +209,37 @@ class RobotView(logging.StreamHandler):
 
         self.setLevel(logging.DEBUG)
         self.setFormatter(logging.Formatter('%(relativeSeconds)6d: %(message)s'))
-        self.logger = logger
-        self.logger.addHandler(self)
 
-    def update_drives(self):
-        self.drives_name_pile.contents.clear()
-        self.drives_level_pile.contents.clear()
+        self.spill_handler = None
+        if spill_path:
+            self.spill_handler = logging.handlers.RotatingFileHandler(spill_path, maxBytes=spill_bytes, backupCount=spill_backups)
+            self.spill_handler.setFormatter(self.formatter)
 
-        for drive in robot.drive_system.drives:
-            name_markup = []
-            level_markup = []
+        self.records = queue.Queue(maxsize=10 * console_capacity)
+        self.queue_handler = RecordQueueHandler(self.records)
+        self.reported_drops = 0
+        self.logger = logger
+        self.logger.addHandler(self.queue_handler)
 
-            status = 'overwhelmed' if drive.is_overwhelmed() else (
-                     'underwhelmed' if drive.is_underwhelmed() else (
-                     'homeostatic' if drive.is_homeostatic() else (
-                     '')))
+    def update_drives(self, snapshot):
+        rows = []
 
-            if robot.drive_system.active_drive is drive:
+        for drive in snapshot.drives:
+            if snapshot.active_drive == drive.name:
                 name_markup = [('active', '[*] ' + drive.name)]
-                level_markup = [(status, str(math.floor(drive.drive_level)))]
             else:
                 name_markup = ['    ' + drive.name]
-                level_markup = [(status, str(math.floor(drive.drive_level)))]
 
-            self.drives_name_pile.contents.append((Text(name_markup), ('pack', None)))
-            self.drives_level_pile.contents.append((Text(level_markup), ('pack', None)))
+            level_markup = [(drive.status, str(math.floor(drive.drive_level)))]
 
-    def update_stimuli(self):
-        self.stimuli_id_pile.contents.clear()
-        self.stimuli_duration_pile.contents.clear()
-        self.stimuli_speed_pile.contents.clear()
+            rows.append((drive.name, (name_markup, level_markup)))
 
-        for id, stim in robot.perception_system.stimuli.items():
-            id_markup = []
-            duration_markup = []
-            speed_markup = []
+        self.drives_table.update(rows)
 
+    def update_stimuli(self, snapshot):
+        rows = []
+
+        for stim in snapshot.stimuli:
             if stim.detected:
                 speed = stim.average_speed or 0
 
@@ -159,21 +251,15 @@ class RobotView(logging.StreamHandler):
                 duration_markup = [('undetected', '({:8.1f}s)'.format(stim.disappearance_duration))]
                 speed_markup = ['']
 
-            self.stimuli_id_pile.contents.append((Text(id_markup), ('pack', None)))
-            self.stimuli_duration_pile.contents.append((Text(duration_markup), ('pack', None)))
-            self.stimuli_speed_pile.contents.append((Text(speed_markup), ('pack', None)))
+            rows.append((stim.id, (id_markup, duration_markup, speed_markup)))
 
-    def update_emotions(self):
-        self.emotions_name_pile.contents.clear()
-        self.emotions_level_pile.contents.clear()
-        self.emotions_affect_pile.contents.clear()
+        self.stimuli_table.update(rows)
 
-        for em in robot.emotion_system.emotions:
-            name_markup = []
-            level_markup = []
-            affect_markup = []
+    def update_emotions(self, snapshot):
+        rows = []
 
-            if em is robot.emotion_system.active_emotion:
+        for em in snapshot.emotions:
+            if snapshot.active_emotion == em.name:
                 name_markup = [('active', '[*] ' + em.name)]
                 level_markup = [('active', '{:6.1f}'.format(em.activation_level))]
                 affect_markup = [('active', format_affect(em.net_affect))]
@@ -182,21 +268,15 @@ class RobotView(logging.StreamHandler):
                 level_markup = [('not-active', '{:6.1f}'.format(em.activation_level))]
                 affect_markup = [('not-active', format_affect(em.net_affect))]
 
-            self.emotions_name_pile.contents.append((Text(name_markup), ('pack', None)))
-            self.emotions_level_pile.contents.append((Text(level_markup), ('pack', None)))
-            self.emotions_affect_pile.contents.append((Text(affect_markup), ('pack', None)))
+            rows.append((em.name, (name_markup, level_markup, affect_markup)))
 
-    def update_releasers(self):
-        self.releasers_id_pile.contents.clear()
-        self.releasers_level_pile.contents.clear()
-        self.releasers_affect_pile.contents.clear()
+        self.emotions_table.update(rows)
 
-        for rel in robot.perception_system.releasers:
-            id_markup = []
-            level_markup = []
-            affect_markup = []
+    def update_releasers(self, snapshot):
+        rows = []
 
-            if rel.is_active():
+        for rel in snapshot.releasers:
+            if rel.active:
                 id_markup = [('active', '[*] ' + rel.name)]
                 level_markup = [('active', ' {:6.1f} / {:3d}'.format(rel.activation_level, rel.activation_threshold))]
                 affect_markup = [('active', format_affect(rel.affect))]
@@ -205,71 +285,148 @@ class RobotView(logging.StreamHandler):
                 level_markup = [('not-active', ' {:6.1f} / {:3d}'.format(rel.activation_level, rel.activation_threshold))]
                 affect_markup = [('not-active', '')]
 
-            self.releasers_id_pile.contents.append((Text(id_markup), ('pack', None)))
-            self.releasers_level_pile.contents.append((Text(level_markup), ('pack', None)))
-            self.releasers_affect_pile.contents.append((Text(affect_markup), ('pack', None)))
+            rows.append((rel.name, (id_markup, level_markup, affect_markup)))
 
-    def update_behaviors(self):
-        self.behaviors_name_pile.contents.clear()
-        self.behaviors_level_pile.contents.clear()
+        self.releasers_table.update(rows)
 
-        for beh in robot.behavior_system.behaviors:
-            name_markup = []
-            level_markup = []
+    def update_behaviors(self, snapshot):
+        rows = []
 
-            if beh.is_active:
+        for beh in snapshot.behaviors:
+            if beh.active:
                 name_markup = [('active', '[*] ' + beh.name)]
                 level_markup = [('active', ' {:6.1f} / {:3d}'.format(beh.activation_level, beh.activation_threshold))]
             else:
                 name_markup = ['    ' + beh.name]
                 level_markup = [('not-active', ' {:6.1f} / {:3d}'.format(beh.activation_level, beh.activation_threshold))]
 
-            self.behaviors_name_pile.contents.append((Text(name_markup), ('pack', None)))
-            self.behaviors_level_pile.contents.append((Text(level_markup), ('pack', None)))
-            
+            rows.append((beh.name, (name_markup, level_markup)))
+
+        self.behaviors_table.update(rows)
+
+    def update_timing(self):
+        rows = []
+
+        # The histograms belong to the control loop, so the summary it last published is shown
+        stats = robot.tick_stats
+        if stats is None:
+            return
+
+        for name, hist in sorted(stats['sections'].items()):
+            if hist['p50'] is None:
+                continue
+
+            status = 'overwhelmed' if hist['p99'] > stats['budget'] else 'homeostatic'
+            latency = '{:6.2f} / {:6.2f} / {:6.2f} / {:6.2f}'.format(hist['p50'] * 1000, hist['p95'] * 1000, hist['p99'] * 1000, hist['max'] * 1000)
+
+            rows.append((name, ('    ' + name, (status, latency))))
+
+        overruns = '{} of {} ticks over budget'.format(stats['overruns'], stats['ticks'])
+        rows.append((None, ('    overruns', ('not-active', overruns))))
+
+        self.timing_table.update(rows)
 
     def update_all(self, loop, data):
-        self.update_drives()
-        self.update_stimuli()
-        self.update_emotions()
-        self.update_releasers()
-        self.update_behaviors()
+        # The robot thread publishes a new snapshot every tick, so the sections are read from one consistent state
+        snapshot = robot.snapshots.latest()
+
+        if snapshot:
+            self.update_drives(snapshot)
+            self.update_stimuli(snapshot)
+            self.update_emotions(snapshot)
+            self.update_releasers(snapshot)
+            self.update_behaviors(snapshot)
+
+        self.update_timing()
 
         if loop:
-            loop.set_alarm_in(0.5, self.update_all)
+            loop.set_alarm_in(self.refresh_interval, self.update_all)
 
     def emit(self, record):
         try:
             record.relativeSeconds = record.relativeCreated / 1000
             msg = self.format(record)
             self.console_list_walker.append(Text((record.levelname, msg)))
-
-            num_items = len(self.console_list_walker) - 1
-            if self.console_list_walker.focus == (num_items - 1):
-                self.console_list_walker.focus = num_items
+            self.console_records.append(record)
 
         except Exception:
             self.handleError(record)
 
+    def drain_console(self, loop, data):
+        """ Renders the queued log records, keeping the console within its capacity """
+        records = []
+        while True:
+            try:
+                records.append(self.records.get_nowait())
+            except queue.Empty:
+                break
+
+        dropped = self.queue_handler.dropped
+        if dropped > self.reported_drops:
+            records.append(logging.makeLogRecord({
+                'name': self.logger.name,
+                'levelno': logging.ERROR,
+                'levelname': 'ERROR',
+                'msg': 'Dropped {} log records'.format(dropped - self.reported_drops),
+            }))
+            self.reported_drops = dropped
+
+        if records:
+            following = self.console_list_walker.focus in (None, len(self.console_list_walker) - 1)
+
+            # Records that wouldn't survive the trim below are spilled without being rendered
+            overflow = max(0, len(records) - self.console_capacity)
+            for record in records[:overflow]:
+                self.spill(record)
+            for record in records[overflow:]:
+                self.handle(record)
+
+            excess = len(self.console_list_walker) - self.console_capacity
+            if excess > 0:
+                for _ in range(excess):
+                    self.spill(self.console_records.popleft())
+                del self.console_list_walker[:excess]
+
+            if following and self.console_list_walker:
+                self.console_list_walker.focus = len(self.console_list_walker) - 1
+
+        if loop:
+            loop.set_alarm_in(0.1, self.drain_console)
+
+    def spill(self, record):
+        if self.spill_handler:
+            record.relativeSeconds = record.relativeCreated / 1000
+            self.spill_handler.handle(record)
+
+    def close(self):
+        """ Stops queueing records and writes the lines still on the console to the spill file """
+        self.logger.removeHandler(self.queue_handler)
+        self.drain_console(None, None)
+
+        if self.spill_handler:
+            while self.console_records:
+                self.spill(self.console_records.popleft())
+            self.spill_handler.close()
+            self.spill_handler = None
+
+        super().close()
+
     def main(self):
         self.loop = MainLoop(self.view, self.palette, unhandled_input=self.unhandled_input)
-        self.loop.set_alarm_in(0.5, self.update_all)
-        self.loop.run()
+        self.loop.set_alarm_in(0.1, self.drain_console)
+        self.loop.set_alarm_in(self.refresh_interval, self.update_all)
 
-    def unhandled_input(self, key):
-        # Simulate the toy stimulus
-        stim = None
+        try:
+            self.loop.run()
+        finally:
+            self.close()
 
+    def unhandled_input(self, key):
+        # Show or hide a simulated toy or face, which the robot sees on its next update
         if key in ('t', 'T'):
-            stim = robot.perception_system.stimuli['toy-1']
+            robot.perception_system.vision.toggle_test_stimulus('toy')
         if key in ('f', 'F'):
-            stim = robot.perception_system.stimuli['face-1']
-
-        if stim:
-            if stim.detected:
-                stim.disappear()
-            else:
-                stim.detect()
+            robot.perception_system.vision.toggle_test_stimulus('face')
 
         # Quit
         if key in ('q', 'Q'):
@@ -278,7 +435,10 @@ class RobotView(logging.StreamHandler):
 
 logger = logging.getLogger('robot')
 logger.setLevel(logging.DEBUG)
-robot = hri.robot.Robot(logger)
+run_directory = 'run_out_telemetry/run{}'.format(math.floor(time.time()))
+robot = hri.robot.Robot(logger, recorders=[hri.telemetry.TelemetryRecorder(run_directory)])
+hri.replay.InputRecorder(os.path.join(run_directory, 'inputs.replay')).attach(robot)
+hri.tracing.LatencyTracer(robot, dump_path=os.path.join(run_directory, 'reaction_latency.jsonl')).attach()
 robot.start(use_cozmo=True)
 
 RobotView(logger).main()
\ No newline at end of file
@@ -0,0 +1,32 @@
+import hri
+from hri import behavior, clock, simulation
+
+import asyncio
+import logging
+
+
+def make_robot():
+    logger = logging.getLogger('test-behavior')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    return hri.robot.Robot(logger, clock=clock.VirtualClock(), cozmo=simulation.SimulatedCozmo())
+
+
+def test_behavior_deactivated_before_its_task_runs_starts_no_action():
+    robot = make_robot()
+
+    async def main():
+        robot.loop = asyncio.get_running_loop()
+        reject = next(beh for beh in robot.behavior_system.behaviors if isinstance(beh, behavior.RejectStimulusBehavior))
+        reject.is_active = True
+        task = robot.loop.create_task(reject.perform())
+
+        # Switched away from before the event loop first schedules the task
+        reject.is_active = False
+        reject.deactivate()
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(main())
+
+    assert robot.cozmo.actions == []
@@ -0,0 +1,36 @@
+from hri.perception import poses
+
+import math
+import pytest
+
+
+def test_window_speed_averages_over_the_window():
+    store = poses.PoseStore(capacity=4)
+    slot = store.allocate()
+
+    speeds = [store.append(slot, 10.0 * i * i, 0, 0, 0.5 * i) for i in range(6)]
+
+    # None until the window is full, then the path length over the last 4 positions per second
+    assert speeds[:3] == [None, None, None]
+    assert speeds[5] == pytest.approx((250 - 40) / 1.5)
+    assert store.speeds([slot])[0] == speeds[5]
+
+
+def test_ewma_speed_smooths_consecutive_speeds():
+    store = poses.PoseStore(capacity=4, estimator='ewma', time_constant=0.3)
+    slot = store.allocate()
+
+    assert store.append(slot, 0, 0, 0, 0.0) is None
+    assert store.append(slot, 3, 4, 0, 0.1) == pytest.approx(50)
+
+    expected = 50 + (1 - math.exp(-0.2 / 0.3)) * (100 - 50)
+    assert store.append(slot, 3, 4, 20, 0.3) == pytest.approx(expected)
+    assert store.speeds([slot])[0] == pytest.approx(expected)
+
+    store.clear(slot)
+    assert math.isnan(store.speeds([slot])[0])
+
+
+def test_unknown_estimator_is_rejected():
+    with pytest.raises(ValueError):
+        poses.PoseStore(estimator='kalman')
@@ -0,0 +1,33 @@
+import hri
+from hri import clock, simulation, tracing
+
+import logging
+import pytest
+
+
+def make_robot(robot_clock):
+    logger = logging.getLogger('test-tracing')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    return hri.robot.Robot(logger, clock=robot_clock, cozmo=simulation.SimulatedCozmo())
+
+
+@pytest.mark.parametrize('robot_clock', [clock.VirtualClock(), clock.Clock()], ids=['virtual', 'wall'])
+def test_face_forms_one_chain(robot_clock):
+    robot = make_robot(robot_clock)
+    tracer = tracing.LatencyTracer(robot).attach()
+
+    robot.run_for(10)
+    robot.cozmo.world.faces.append(simulation.SimulatedEntity(100, 0, 0, face_id=1))
+    robot.run_for(15)
+
+    assert tracer.chain_count == 1
+    assert tracer.pending == {}
+
+    chain, = tracer.slowest_chains()
+    assert chain['detection']['name'] == 'face-stimulus face-1 detected'
+    assert chain['releaser']['name'] == 'desired-stimulus-releaser'
+    assert chain['behavior']['name'] == 'engage-with-face-behavior'
+    assert chain['detection']['tick'] <= chain['releaser']['tick'] <= chain['behavior']['tick'] <= chain['action']['tick']
+    assert all(latency >= 0 for latency in chain['latencies'].values())